@@ -0,0 +1,320 @@
+"""alloc_profile.py: for opt-in allocation & GC instrumentation
+
+Measures, per frame and per named phase of a frame, how much memory was
+allocated (tracemalloc), how many memory blocks were left allocated, and
+how many garbage collections ran and how long they paused for (gc
+callbacks). Tracing slows everything down, so it is only on while an
+AllocationProfiler is started.
+
+Run as a script to check steady-state simulator frames against their
+allocation budget; it exits with an error if they go over.
+
+Classes:
+AllocationProfiler -- per-frame, per-phase allocation & GC statistics
+
+Methods:
+measure_simulator_frames -- profile steady-state simulator frames
+check_frame_budget -- whether simulator frames stay within their budget
+
+Constants:
+FRAME_BUDGET -- bytes a steady-state simulator frame may allocate
+BLOCK_BUDGET -- memory blocks a steady-state frame may leave allocated
+"""
+
+import gc, sys, time, tracemalloc
+import pygame
+import mass_spectrometer, simulation
+
+# required initialization step
+pygame.init()
+
+# a steady-state frame only makes short-lived tuples & floats, so both
+# budgets are far below what a leak or a per-frame rebuild would cost
+FRAME_BUDGET = 16 * 1024
+BLOCK_BUDGET = 16
+
+class _Phase():
+    """Context manager measuring one phase of a frame."""
+
+    def __init__(self, profiler, name: str) -> None:
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._profiler._start_phase()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._profiler._end_phase(self._name)
+
+class _NullPhase():
+    """Context manager which measures nothing, for a stopped profiler."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+_NULL_PHASE = _NullPhase()
+
+class AllocationProfiler():
+    """A class to represent allocation & GC statistics, frame by frame.
+
+    Phases are measured with tracemalloc's peak, so a phase's bytes are the
+    most it had allocated at once beyond what it started with, including
+    anything freed again before it ended.
+
+    Attributes:
+    frames -- list of finished frames' statistics, each a dict of
+              'phases' (dict of name to phase statistics), 'gc_runs',
+              'gc_pause' and 'time'; phase statistics are dicts of
+              'bytes' (peak allocated), 'net_bytes', 'net_blocks' & 'time'
+    _running -- whether tracing is on
+    _phases -- statistics of the current frame's phases so far
+    _phase_start -- (traced bytes, blocks, time) when the phase began
+    _frame_start -- time the current frame began
+    _gc_runs -- collections so far this frame
+    _gc_pause -- seconds spent collecting so far this frame
+    _gc_start -- time the running collection began
+    _baseline -- tracemalloc snapshot taken when started
+
+    Methods:
+    start -- start tracing
+    stop -- stop tracing
+    phase -- context manager measuring one phase of the frame
+    end_frame -- finish the current frame's statistics
+    get_summary -- per-phase and GC statistics over every frame
+    top_sites -- source lines which have allocated most since start
+    report -- human-readable summary
+    """
+
+    def __init__(self) -> None:
+        """Initialize an AllocationProfiler, stopped."""
+
+        self.frames = []
+        self._running = False
+        self._baseline = None
+        self._reset_frame()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _reset_frame(self) -> None:
+        """Start a fresh frame's statistics."""
+
+        self._phases = {}
+        self._gc_runs = 0
+        self._gc_pause = 0.0
+        self._frame_start = time.perf_counter()
+
+    def _on_gc(self, phase: str, info: dict) -> None:
+        """gc callback, timing every collection."""
+
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        else:
+            self._gc_runs += 1
+            self._gc_pause += time.perf_counter() - self._gc_start
+
+    def start(self) -> None:
+        """Start tracing allocations and collections."""
+
+        if self._running:
+            return
+        tracemalloc.start()
+        gc.callbacks.append(self._on_gc)
+        self._baseline = tracemalloc.take_snapshot()
+        self._running = True
+        self._reset_frame()
+
+    def stop(self) -> None:
+        """Stop tracing allocations and collections."""
+
+        if not self._running:
+            return
+        gc.callbacks.remove(self._on_gc)
+        tracemalloc.stop()
+        self._running = False
+
+    def phase(self, name: str):
+        """Get a context manager measuring one phase of the frame.
+
+        Measures nothing if the profiler is stopped, so calls can stay in
+        place when profiling is off.
+
+        name -- name of the phase, totalled if repeated in a frame
+        """
+
+        if not self._running:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def _start_phase(self) -> None:
+        """Note where a phase began."""
+
+        tracemalloc.reset_peak()
+        traced = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        self._phase_start = (traced, blocks, time.perf_counter())
+
+    def _end_phase(self, name: str) -> None:
+        """Fold a finished phase into the current frame."""
+
+        # measure before making anything, so the profiler isn't counted
+        blocks = sys.getallocatedblocks()
+        end_time = time.perf_counter()
+        current, peak = tracemalloc.get_traced_memory()
+        start_bytes, start_blocks, start_time = self._phase_start
+        stats = self._phases.setdefault(
+            name, {'bytes': 0, 'net_bytes': 0, 'net_blocks': 0, 'time': 0.0})
+        stats['bytes'] += peak - start_bytes
+        stats['net_bytes'] += current - start_bytes
+        stats['net_blocks'] += blocks - start_blocks
+        stats['time'] += end_time - start_time
+
+    def end_frame(self) -> None:
+        """Finish the current frame's statistics and start the next's."""
+
+        if not self._running:
+            return
+        self.frames.append({'phases': self._phases,
+                            'gc_runs': self._gc_runs,
+                            'gc_pause': self._gc_pause,
+                            'time': time.perf_counter() - self._frame_start})
+        self._reset_frame()
+
+    def get_summary(self) -> dict:
+        """Get statistics over every finished frame.
+
+        Returns a dict of 'frames', 'gc_runs', 'max_gc_pause' and 'phases',
+        the last a dict of phase name to dicts of 'mean_bytes',
+        'max_bytes', 'mean_net_blocks' and 'mean_time'
+        """
+
+        phases = {}
+        for frame in self.frames:
+            for name, stats in frame['phases'].items():
+                phases.setdefault(name, []).append(stats)
+
+        return {
+            'frames': len(self.frames),
+            'gc_runs': sum(frame['gc_runs'] for frame in self.frames),
+            'max_gc_pause': max((frame['gc_pause'] for frame in self.frames),
+                                default=0.0),
+            'phases': {name: {
+                'mean_bytes': sum(s['bytes'] for s in stats) / len(stats),
+                'max_bytes': max(s['bytes'] for s in stats),
+                'mean_net_blocks': sum(s['net_blocks'] for s in stats) /
+                                   len(stats),
+                'mean_time': sum(s['time'] for s in stats) / len(stats)}
+                       for name, stats in phases.items()}}
+
+    def top_sites(self, limit: int = 10) -> list:
+        """Get the source lines which have allocated most since start.
+
+        Only works while started.
+
+        Returns a list of tracemalloc StatisticDiffs, largest first
+        """
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+        return snapshot.compare_to(self._baseline, 'lineno')[:limit]
+
+    def report(self) -> str:
+        """Get a human-readable summary of every finished frame."""
+
+        summary = self.get_summary()
+        lines = ['{} frames, {} GC runs, longest GC pause {:.2f} ms'.format(
+            summary['frames'], summary['gc_runs'],
+            summary['max_gc_pause'] * 1000)]
+        for name, stats in summary['phases'].items():
+            lines.append('{}: mean {:.0f} B, max {} B, {:+.1f} blocks, '
+                         '{:.2f} ms'.format(name, stats['mean_bytes'],
+                                            stats['max_bytes'],
+                                            stats['mean_net_blocks'],
+                                            stats['mean_time'] * 1000))
+        return '\n'.join(lines)
+
+def measure_simulator_frames(frames: int = 200, warmup: int = 20
+                             ) -> AllocationProfiler:
+    """Profile steady-state frames of the simulator screen's particle.
+
+    A particle is set going in the usual spectrometer, warmed up, then
+    drawn (onto an off-screen Surface) and moved frame by frame, as the
+    simulator screen does, relaunching whenever it stops. Drawing also
+    checks collisions, so nothing else does.
+
+    frames -- number of frames profiled
+    warmup -- number of frames run first, so caches are already filled
+
+    Returns the (stopped) AllocationProfiler
+    """
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        5, -1, 20, 1, 5, pygame.Rect(simulation.DEFAULT_AREA))
+    screen = pygame.Surface(mass_spec.get_area().size)
+    profiler = AllocationProfiler()
+
+    for frame in range(warmup + frames):
+        if frame == warmup:
+            profiler.start()
+        with profiler.phase('draw'):
+            mass_spec.draw(screen)
+        if mass_spec.get_particle().is_stopped():
+            mass_spec.reset_particle()
+        else:
+            with profiler.phase('physics'):
+                mass_spec.move()
+        profiler.end_frame()
+
+    profiler.stop()
+    return profiler
+
+def check_frame_budget(profiler: AllocationProfiler,
+                       budget: int = FRAME_BUDGET,
+                       block_budget: int = BLOCK_BUDGET) -> list:
+    """Check every profiled frame against an allocation budget.
+
+    profiler -- AllocationProfiler with finished frames
+    budget -- bytes a frame may allocate at peak, default FRAME_BUDGET
+    block_budget -- blocks a frame may leave allocated, on average over
+                    every frame, default BLOCK_BUDGET
+
+    Returns a list of descriptions of what went over, empty if nothing did
+    """
+
+    failures = []
+    for i, frame in enumerate(profiler.frames):
+        allocated = sum(stats['bytes'] for stats in frame['phases'].values())
+        if allocated > budget:
+            failures.append('frame {} allocated {} B (budget {} B)'.format(
+                i, allocated, budget))
+
+    # single frames may grow a free list, but steady state must not grow
+    if profiler.frames:
+        blocks = sum(stats['net_blocks'] for frame in profiler.frames
+                     for stats in frame['phases'].values())
+        if blocks / len(profiler.frames) > block_budget:
+            failures.append('frames kept {:.1f} blocks each on average '
+                            '(budget {})'.format(blocks / len(profiler.frames),
+                                                 block_budget))
+    return failures
+
+def main() -> None:
+    """Check simulator frames against the budget, exiting 1 if over."""
+
+    profiler = measure_simulator_frames()
+    print(profiler.report())
+    failures = check_frame_budget(profiler)
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
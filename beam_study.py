@@ -0,0 +1,441 @@
+"""beam_study.py: for Monte Carlo studies of beam transmission
+
+A beam of ions with spread-out starting positions, angles and speeds is
+run through a mass spectrometer chunk by chunk. Only running statistics are
+kept, never individual particles, so memory use doesn't depend on how many
+particles are run.
+
+Classes:
+BeamDistribution -- spread of a beam's initial conditions
+RunningStats -- Welford mean & variance, updated a chunk at a time
+BeamStudy -- Monte Carlo driver keeping transmission & landing statistics
+
+Constants:
+NORMAL, UNIFORM -- kinds of spread
+CHUNK_SIZE -- default number of particles run at once
+HISTOGRAM_BINS -- default number of landing histogram bins
+"""
+
+import json
+import numpy as np
+import mass_spectrometer, particle_ensemble, simulation, checkpoint
+
+NORMAL = 'normal'
+UNIFORM = 'uniform'
+
+CHUNK_SIZE = 100000
+HISTOGRAM_BINS = 120
+
+# every array a ParticleEnsemble's state is made of
+_ENSEMBLE_ARRAYS = ('mass', 'charge', 'x', 'y', 'v_x', 'v_y', 'stop_reason',
+                    'steps')
+
+class BeamDistribution():
+    """A class to represent the spread of a beam's initial conditions.
+
+    Spreads are standard deviations for NORMAL, and half-widths for
+    UNIFORM. Angles are in radians, positive is down.
+
+    Attributes:
+    mass -- mass of the ions, or a sequence to pick from evenly
+    charge -- charge of the ions, or a sequence matching mass
+    speed -- mean launch speed
+    speed_spread -- spread of launch speed
+    y_spread -- spread of launch y position around the start position
+    angle_spread -- spread of launch angle around straight right
+    kind -- NORMAL or UNIFORM
+
+    Methods:
+    sample -- draw initial conditions for a chunk of ions
+    """
+
+    def __init__(self, mass, charge, speed: float,
+                 speed_spread: float = 0, y_spread: float = 0,
+                 angle_spread: float = 0, kind: str = NORMAL) -> None:
+        """Initialize a BeamDistribution.
+
+        mass -- mass of the ions, or a sequence of species' masses
+        charge -- charge of the ions, or a sequence matching mass
+        speed -- mean launch speed
+        speed_spread -- spread of launch speed, default 0
+        y_spread -- spread of launch y position, default 0
+        angle_spread -- spread of launch angle in radians, default 0
+        kind -- NORMAL or UNIFORM, default NORMAL
+        """
+
+        if kind not in (NORMAL, UNIFORM):
+            raise ValueError('Kind must be NORMAL or UNIFORM')
+
+        self.mass = np.atleast_1d(np.asarray(mass, np.float64))
+        self.charge = np.broadcast_to(np.asarray(charge, np.float64),
+                                      self.mass.shape)
+        if np.any(self.mass <= 0):
+            raise ValueError('Mass must be positive')
+
+        self.speed = speed
+        self.speed_spread = speed_spread
+        self.y_spread = y_spread
+        self.angle_spread = angle_spread
+        self.kind = kind
+
+    def _spread(self, rng: np.random.Generator, spread: float,
+                count: int) -> np.ndarray:
+        """Draw count zero-centered values with the given spread."""
+
+        if self.kind == NORMAL:
+            return rng.normal(0, spread, count)
+        return rng.uniform(-spread, spread, count)
+
+    def sample(self, rng: np.random.Generator, count: int) -> tuple:
+        """Draw initial conditions for a chunk of ions.
+
+        Always draws in the same order, so a Generator in the same state
+        gives the same chunk.
+
+        rng -- numpy Generator to draw from
+        count -- number of ions
+
+        Returns (mass, charge, y offset, x velocity, y velocity) arrays
+        """
+
+        species = rng.integers(0, len(self.mass), count)
+        speed = self.speed + self._spread(rng, self.speed_spread, count)
+        angle = self._spread(rng, self.angle_spread, count)
+        y_offset = self._spread(rng, self.y_spread, count)
+
+        # an ion launched backwards would never enter the instrument
+        speed = np.maximum(speed, 1e-9)
+
+        return (self.mass[species], self.charge[species], y_offset,
+                speed * np.cos(angle), speed * np.sin(angle))
+
+class RunningStats():
+    """A class to represent a running mean & variance (Welford's method).
+
+    Chunks are merged in with Chan et al.'s pairwise update, which is
+    Welford's for a whole array at a time.
+
+    Attributes:
+    count -- number of values seen
+    mean -- mean of the values
+    _m2 -- sum of squared differences from the mean
+
+    Methods:
+    update -- merge a chunk of values in
+    get_variance -- sample variance of the values
+    """
+
+    def __init__(self, count: int = 0, mean=0.0, m2=0.0) -> None:
+        """Initialize a RunningStats, empty by default.
+
+        count, mean, m2 -- state to start from, as from a checkpoint
+        """
+
+        self.count = count
+        self.mean = mean
+        self._m2 = m2
+
+    def update(self, values: np.ndarray) -> None:
+        """Merge a chunk of values (along the first axis) in."""
+
+        values = np.asarray(values, np.float64)
+        count = len(values)
+        if count == 0:
+            return
+
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self._m2 = self._m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def get_variance(self):
+        """Get the sample variance, NaN with fewer than two values."""
+
+        if self.count < 2:
+            return np.full_like(np.asarray(self.mean, np.float64), np.nan)
+        return self._m2 / (self.count - 1)
+
+class BeamStudy():
+    """A class to represent a Monte Carlo beam transmission study.
+
+    An ion is transmitted if it gets through the slit (past the end of the
+    straight section) and then reaches the target: by default, landing on
+    a detector plate, or if a target Rect is given, ever entering it.
+
+    Attributes:
+    _mass_spec -- MassSpectrometer the beam runs through
+    _distribution -- BeamDistribution ions are drawn from
+    _target -- Rect ions must reach, or None for any detector plate
+    _max_steps -- frames before a still-moving ion is given up on
+    _rng -- numpy Generator initial conditions are drawn from
+    _remaining -- number of ions still to be launched
+    _chunk_size -- number of ions launched at once
+    _chunk -- (ensemble, passed slit mask, reached mask) of the chunk being
+              run, or None between chunks
+    _launched -- number of ions run so far
+    _passed_slit -- number which got through the slit
+    _transmitted -- number which got through the slit and reached the target
+    _timed_out -- number given up on
+    _landing -- RunningStats of transmitted ions' (x, y) stop positions
+    _histogram -- counts of transmitted ions' stop y per bin
+    _bin_edges -- edges of the histogram's bins
+
+    Methods:
+    run -- run more ions through, a chunk at a time
+    resume -- carry on with whatever ions are left to run
+    get_state -- copy of everything needed to carry on later
+    load_state -- carry on from a state given by get_state
+    get_transmission -- fraction of ions transmitted
+    get_slit_transmission -- fraction of ions through the slit
+    get_landing_mean -- mean (x, y) stop position of transmitted ions
+    get_landing_variance -- variance of the same
+    get_histogram -- (counts, bin edges) of transmitted ions' stop y
+    get_launched -- getter for _launched
+    """
+
+    def __init__(self, mass_spec: mass_spectrometer.MassSpectrometer,
+                 distribution: BeamDistribution, target=None,
+                 seed: int = None, bins: int = HISTOGRAM_BINS,
+                 max_steps: int = simulation.MAX_STEPS) -> None:
+        """Initialize a BeamStudy.
+
+        mass_spec -- MassSpectrometer the beam runs through; its fields and
+                     geometry are used, not its own particle
+        distribution -- BeamDistribution ions are drawn from
+        target -- Rect ions must reach, default None for any detector plate
+        seed -- seed for the random number generator, default None
+        bins -- number of landing histogram bins over the area's height
+        max_steps -- frames before a still-moving ion is given up on
+        """
+
+        self._mass_spec = mass_spec
+        self._distribution = distribution
+        self._target = target
+        self._max_steps = max_steps
+        self._rng = np.random.default_rng(seed)
+
+        self._remaining = 0
+        self._chunk_size = CHUNK_SIZE
+        self._chunk = None
+
+        self._launched = 0
+        self._passed_slit = 0
+        self._transmitted = 0
+        self._timed_out = 0
+        self._landing = RunningStats(0, np.zeros(2), np.zeros(2))
+
+        area = mass_spec.get_area()
+        self._bin_edges = np.linspace(area.top, area.bottom, bins + 1)
+        self._histogram = np.zeros(bins, np.int64)
+
+    def run(self, count: int, chunk_size: int = CHUNK_SIZE,
+            checkpointer: checkpoint.Checkpointer = None) -> None:
+        """Run more ions through, a chunk at a time.
+
+        count -- number of ions to run
+        chunk_size -- number of ions run at once, default CHUNK_SIZE
+        checkpointer -- optional Checkpointer to save snapshots with, which
+                        load_state and resume can carry on from
+        """
+
+        self._remaining += count
+        self._chunk_size = chunk_size
+        self.resume(checkpointer)
+
+    def resume(self, checkpointer: checkpoint.Checkpointer = None) -> None:
+        """Carry on with whatever ions are left to run.
+
+        After load_state, this continues exactly where the snapshot left
+        off, giving bit-identical results to an uninterrupted run.
+
+        checkpointer -- optional Checkpointer to save snapshots with
+        """
+
+        while self._chunk is not None or self._remaining > 0:
+            if self._chunk is None:
+                size = min(self._chunk_size, self._remaining)
+                self._remaining -= size
+                self._chunk = self._launch_chunk(size)
+            else:
+                self._advance_chunk()
+
+            if checkpointer is not None:
+                checkpointer.maybe_save(self.get_state)
+
+    def _launch_chunk(self, size: int) -> tuple:
+        """Draw a chunk of ions and place them at the start position.
+
+        Returns the chunk as (ensemble, passed slit mask, reached mask)
+        """
+
+        mass, charge, y_offset, v_x, v_y = self._distribution.sample(
+            self._rng, size)
+        ensemble = self._mass_spec.launch_ensemble(mass, charge, v_x,
+                                                   y_offset, v_y)
+        passed = np.zeros(len(ensemble), bool)
+        reached = np.zeros(len(ensemble), bool)
+
+        self._check_chunk(ensemble, passed, reached)
+        return ensemble, passed, reached
+
+    def _advance_chunk(self) -> None:
+        """Move the current chunk a frame, tallying ions as they stop.
+
+        Once most of the chunk has stopped, the stopped ions are tallied and
+        dropped, so the frames left aren't spent on them. When every ion
+        has stopped (or run out of frames) the rest are tallied too.
+        """
+
+        ensemble, passed, reached = self._chunk
+        free = ensemble.get_free()
+
+        # every ion in a chunk is launched together, so free ones have all
+        # moved the same number of frames
+        if not free.any() or ensemble.steps.max() >= self._max_steps:
+            self._tally_chunk(ensemble, passed, reached)
+            self._chunk = None
+            return
+
+        if 2 * free.sum() <= len(ensemble):
+            done = ~free
+            self._tally_chunk(ensemble.take(done), passed[done],
+                              reached[done])
+            ensemble = ensemble.take(free)
+            passed = passed[free]
+            reached = reached[free]
+            self._chunk = ensemble, passed, reached
+
+        self._mass_spec.move_ensemble(ensemble)
+        self._check_chunk(ensemble, passed, reached)
+
+    def _check_chunk(self, ensemble, passed: np.ndarray,
+                     reached: np.ndarray) -> None:
+        """Check a chunk for collisions and note how far ions have got.
+
+        passed, reached -- masks updated in place
+        """
+
+        self._mass_spec.check_ensemble_collisions(ensemble)
+        free = ensemble.get_free()
+        passed |= free & (ensemble.x > self._mass_spec.get_slit_exit_x())
+
+        if self._target is not None:
+            target = self._target
+            reached |= (passed & (ensemble.x >= target.left) &
+                        (ensemble.x < target.right) &
+                        (ensemble.y >= target.top) &
+                        (ensemble.y < target.bottom))
+
+    def _tally_chunk(self, ensemble, passed: np.ndarray,
+                     reached: np.ndarray) -> None:
+        """Fold a finished chunk into the running statistics."""
+
+        if self._target is None:
+            reasons = self._mass_spec.get_stop_reasons()
+            detectors = [reasons.index(name) for name
+                         in self._mass_spec.get_detector_names()]
+            reached = passed & np.isin(ensemble.stop_reason, detectors)
+
+        transmitted = passed & reached
+        landing = np.stack((ensemble.x[transmitted],
+                            ensemble.y[transmitted]), axis=1)
+
+        self._launched += len(ensemble)
+        self._passed_slit += int(passed.sum())
+        self._transmitted += int(transmitted.sum())
+        self._timed_out += int(ensemble.get_free().sum())
+        self._landing.update(landing)
+        self._histogram += np.histogram(landing[:, 1], self._bin_edges)[0]
+
+    def get_state(self) -> dict:
+        """Get a copy of everything needed to carry on later.
+
+        The study's settings (mass spectrometer, distribution, target,
+        bins, max steps) are not included; a study made with the same
+        settings can load_state it.
+
+        Returns a dict of name to array, as checkpoint snapshots hold
+        """
+
+        state = {'rng_state': json.dumps(self._rng.bit_generator.state),
+                 'counts': np.array([self._remaining, self._chunk_size,
+                                     self._launched, self._passed_slit,
+                                     self._transmitted, self._timed_out,
+                                     self._landing.count]),
+                 'landing_mean': np.array(self._landing.mean),
+                 'landing_m2': np.array(self._landing._m2),
+                 'histogram': self._histogram.copy(),
+                 'has_chunk': self._chunk is not None}
+
+        if self._chunk is not None:
+            ensemble, passed, reached = self._chunk
+            for name in _ENSEMBLE_ARRAYS:
+                state['chunk_' + name] = getattr(ensemble, name).copy()
+            state['chunk_passed'] = passed.copy()
+            state['chunk_reached'] = reached.copy()
+
+        return state
+
+    def load_state(self, state: dict) -> None:
+        """Carry on from a state given by get_state (e.g. a snapshot).
+
+        Follow with resume to finish the run that was interrupted.
+
+        state -- dict of name to array
+        """
+
+        rng_state = json.loads(str(state['rng_state']))
+        self._rng = np.random.Generator(
+            getattr(np.random, rng_state['bit_generator'])())
+        self._rng.bit_generator.state = rng_state
+
+        (self._remaining, self._chunk_size, self._launched,
+         self._passed_slit, self._transmitted, self._timed_out,
+         landing_count) = (int(count) for count in state['counts'])
+        self._landing = RunningStats(landing_count,
+                                     state['landing_mean'].copy(),
+                                     state['landing_m2'].copy())
+        self._histogram = state['histogram'].copy()
+
+        self._chunk = None
+        if bool(state['has_chunk']):
+            ensemble = particle_ensemble.ParticleEnsemble.__new__(
+                particle_ensemble.ParticleEnsemble)
+            for name in _ENSEMBLE_ARRAYS:
+                setattr(ensemble, name, state['chunk_' + name].copy())
+            self._chunk = (ensemble, state['chunk_passed'].copy(),
+                           state['chunk_reached'].copy())
+
+    def get_launched(self) -> int:
+        """Get the number of ions run so far."""
+
+        return self._launched
+
+    def get_transmission(self) -> float:
+        """Get the fraction of ions through the slit and at the target."""
+
+        return self._transmitted / self._launched if self._launched else 0
+
+    def get_slit_transmission(self) -> float:
+        """Get the fraction of ions which got through the slit."""
+
+        return self._passed_slit / self._launched if self._launched else 0
+
+    def get_landing_mean(self) -> np.ndarray:
+        """Get the mean (x, y) stop position of transmitted ions."""
+
+        return self._landing.mean
+
+    def get_landing_variance(self) -> np.ndarray:
+        """Get the (x, y) variance of transmitted ions' stop positions."""
+
+        return self._landing.get_variance()
+
+    def get_histogram(self) -> (np.ndarray, np.ndarray):
+        """Get (counts, bin edges) of transmitted ions' stop y."""
+
+        return self._histogram.copy(), self._bin_edges.copy()
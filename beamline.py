@@ -0,0 +1,496 @@
+"""beamline.py: for modelling instruments as a pipeline of stages
+
+An instrument is a Beamline of stages, each a region of the beam's path
+(a velocity selector, a field-free drift, a magnetic sector, a detector).
+A batch of particles streams through the stages in order: each stage
+moves the whole batch, as arrays, until every particle has either left
+through its exit or been lost, and hands the survivors on to the next.
+Stages count what goes in, what comes out and why the rest were lost, and
+time themselves, so multi-stage instruments can be built and compared.
+
+Apertures are idealized: a particle is lost as soon as its edge crosses
+one, rather than when its collision box overlaps a wall's Rect.
+
+Classes:
+Beam -- a batch of particles between stages
+Stage -- abstract base class of stages, with their counters
+VelocitySelector -- crossed electric and magnetic fields behind a slit
+Drift -- field-free flight to an exit plane
+MagneticSector -- magnetic field bending particles back around
+Detector -- records where particles cross a plane onto detector plates
+Beamline -- stages particle batches stream through, in order
+
+Methods:
+from_mass_spectrometer -- a Beamline laid out like a MassSpectrometer
+
+Constants:
+EXITED -- stop reason code of a particle which left through a stage's exit
+"""
+
+import abc, time
+import numpy as np
+import charged_particle, particle_ensemble, mass_spectrometer, simulation
+
+EXITED = 0
+
+class Beam():
+    """A class to represent a batch of particles between stages.
+
+    Attributes:
+    ensemble -- ParticleEnsemble of the particles
+    index -- array of each particle's number in the batch first launched
+    prev_x, prev_y -- arrays of each particle's position a frame earlier
+    hit_y -- array of where each particle landed on a detector, NaN if it
+             hasn't
+
+    Methods:
+    take -- a new Beam of some of the particles
+    __len__ -- number of particles
+    """
+
+    def __init__(self, ensemble: particle_ensemble.ParticleEnsemble,
+                 index: np.ndarray = None) -> None:
+        """Initialize a Beam.
+
+        ensemble -- ParticleEnsemble of the particles, which is moved in
+                    place as the beam goes through stages
+        index -- array of each particle's number, default 0 to n - 1
+        """
+
+        self.ensemble = ensemble
+        self.index = (np.arange(len(ensemble)) if index is None
+                      else np.asarray(index))
+        self.prev_x = ensemble.x.copy()
+        self.prev_y = ensemble.y.copy()
+        self.hit_y = np.full(len(ensemble), np.nan)
+
+    def __len__(self) -> int:
+        """Get the number of particles."""
+
+        return len(self.ensemble)
+
+    def take(self, mask: np.ndarray):
+        """Make a new Beam of some of the particles, all free to move.
+
+        mask -- mask or indices of the particles to take
+
+        Returns the new Beam, sharing no memory with this one
+        """
+
+        taken = Beam.__new__(Beam)
+        taken.ensemble = self.ensemble.take(mask)
+        taken.ensemble.stop_reason[:] = particle_ensemble.FREE
+        for name in ('index', 'prev_x', 'prev_y', 'hit_y'):
+            setattr(taken, name, getattr(self, name)[mask].copy())
+        return taken
+
+class Stage(abc.ABC):
+    """A class to represent one stage of a Beamline.
+
+    Subclasses give their loss reasons, and implement _run to move a beam
+    through and _check to stop each particle which has finished with
+    EXITED or 1 + the index of why it was lost.
+
+    Attributes:
+    name -- name of the stage, for reports
+    reasons -- names of the ways particles can be lost in this stage
+    entered -- number of particles which have entered
+    transmitted -- number of particles which have left through the exit
+    lost -- array of the number of particles lost for each reason
+    steps -- number of frames moved, over every batch
+    time -- seconds spent moving batches
+
+    Methods:
+    process -- move a beam through, returning the survivors
+    get_stats -- dict of the counters
+    reset -- zero the counters
+    """
+
+    def __init__(self, name: str, reasons: tuple) -> None:
+        """Initialize a Stage.
+
+        name -- name of the stage, for reports
+        reasons -- names of the ways particles can be lost in it
+        """
+
+        self.name = name
+        self.reasons = reasons
+        self.reset()
+
+    def reset(self) -> None:
+        """Zero the counters."""
+
+        self.entered = 0
+        self.transmitted = 0
+        self.lost = np.zeros(len(self.reasons), np.int64)
+        self.steps = 0
+        self.time = 0.0
+
+    def process(self, beam: Beam) -> Beam:
+        """Move a beam through the stage.
+
+        beam -- Beam entering the stage, moved in place
+
+        Returns a new Beam of the particles which left through the exit
+        """
+
+        start = time.perf_counter()
+        beam.ensemble.stop_reason[:] = particle_ensemble.FREE
+        self._run(beam)
+
+        codes = beam.ensemble.stop_reason
+        self.entered += len(beam)
+        self.transmitted += int(np.count_nonzero(codes == EXITED))
+        self.lost += np.bincount(codes[codes > EXITED] - 1,
+                                 minlength=len(self.reasons))
+
+        survivors = beam.take(codes == EXITED)
+        self.time += time.perf_counter() - start
+        return survivors
+
+    @abc.abstractmethod
+    def _run(self, beam: Beam) -> None:
+        """Move a beam until every particle has exited or been lost."""
+
+    def _lose(self, beam: Beam, mask: np.ndarray, reason: str) -> None:
+        """Stop particles which are still moving as lost for a reason."""
+
+        beam.ensemble.stop(mask, 1 + self.reasons.index(reason))
+
+    def _step(self, beam: Beam, e_field: float, mag_field: float,
+              max_steps: int) -> None:
+        """Move a beam a frame at a time, checking after each, until every
+        particle has stopped; those still moving at max_steps time out."""
+
+        ensemble = beam.ensemble
+        self._check(beam)
+
+        for _ in range(max_steps):
+            free = ensemble.get_free()
+            if not free.any():
+                break
+            beam.prev_x[free] = ensemble.x[free]
+            beam.prev_y[free] = ensemble.y[free]
+            ensemble.move(e_field, mag_field)
+            self.steps += 1
+            self._check(beam)
+
+        self._lose(beam, ensemble.get_free(), simulation.TIMEOUT)
+
+    @abc.abstractmethod
+    def _check(self, beam: Beam) -> None:
+        """Stop particles which have exited or been lost, after each frame
+        of _step (or once, by stages which move a beam in one go)."""
+
+    def get_stats(self) -> dict:
+        """Get a dict of name, entered, transmitted, lost (a dict by
+        reason), steps and time."""
+
+        return {'name': self.name, 'entered': self.entered,
+                'transmitted': self.transmitted,
+                'lost': dict(zip(self.reasons, self.lost.tolist())),
+                'steps': self.steps, 'time': self.time}
+
+class VelocitySelector(Stage):
+    """A class to represent crossed electric and magnetic fields behind a
+    slit, which only lets particles of about E/B speed through.
+
+    Attributes (besides Stage's):
+    exit_x -- x past which particles have left the selector
+    e_field -- electric field strength, positive is down
+    mag_field -- magnetic field strength, positive is out of page
+    y_min, y_max -- edges of the slit
+    max_steps -- number of frames before particles are given up on
+    """
+
+    def __init__(self, exit_x: float, e_field: float, mag_field: float,
+                 y_min: float, y_max: float,
+                 max_steps: int = simulation.MAX_STEPS,
+                 name: str = 'velocity_selector') -> None:
+        """Initialize a VelocitySelector.
+
+        exit_x -- x past which particles have left the selector
+        e_field, mag_field -- field strengths, as for MassSpectrometer
+        y_min, y_max -- edges of the slit
+        max_steps -- number of frames before particles are given up on
+        name -- name of the stage, default 'velocity_selector'
+        """
+
+        super().__init__(name, ('slit', simulation.TIMEOUT))
+        self.exit_x = exit_x
+        self.e_field = e_field
+        self.mag_field = mag_field
+        self.y_min = y_min
+        self.y_max = y_max
+        self.max_steps = max_steps
+
+    def _run(self, beam: Beam) -> None:
+        self._step(beam, self.e_field, self.mag_field, self.max_steps)
+
+    def _check(self, beam: Beam) -> None:
+        ensemble = beam.ensemble
+        self._lose(beam, (ensemble.y - charged_particle.RADIUS < self.y_min) |
+                   (ensemble.y + charged_particle.RADIUS > self.y_max),
+                   'slit')
+        ensemble.stop(ensemble.x > self.exit_x, EXITED)
+
+class Drift(Stage):
+    """A class to represent field-free flight to an exit plane.
+
+    Without fields particles go in straight lines, so the whole drift is
+    worked out in one step rather than a frame at a time.
+
+    Attributes (besides Stage's):
+    exit_x -- x past which particles have left the drift
+    y_min, y_max -- edges of the drift tube
+    """
+
+    def __init__(self, exit_x: float, y_min: float, y_max: float,
+                 name: str = 'drift') -> None:
+        """Initialize a Drift.
+
+        exit_x -- x past which particles have left the drift
+        y_min, y_max -- edges of the drift tube
+        name -- name of the stage, default 'drift'
+        """
+
+        super().__init__(name, ('wall', 'reversed'))
+        self.exit_x = exit_x
+        self.y_min = y_min
+        self.y_max = y_max
+
+    def _run(self, beam: Beam) -> None:
+        ensemble = beam.ensemble
+        self._lose(beam, ensemble.v_x <= 0, 'reversed')
+        free = ensemble.get_free()
+
+        # whole frames until each particle is past the exit, as if stepped
+        frames = np.zeros(len(ensemble))
+        frames[free] = np.maximum(np.floor(
+            (self.exit_x - ensemble.x[free]) / ensemble.v_x[free]) + 1, 0)
+        beam.prev_x[free] = ensemble.x[free] + (frames[free] - 1) * \
+            ensemble.v_x[free]
+        beam.prev_y[free] = ensemble.y[free] + (frames[free] - 1) * \
+            ensemble.v_y[free]
+        ensemble.x[free] += frames[free] * ensemble.v_x[free]
+        ensemble.y[free] += frames[free] * ensemble.v_y[free]
+        ensemble.steps[free] += frames[free].astype(np.int64)
+        self.steps += int(frames.max(initial=0))
+        self._check(beam)
+
+    def _check(self, beam: Beam) -> None:
+        ensemble = beam.ensemble
+        # a straight path is furthest out at one of its ends
+        edge = charged_particle.RADIUS
+        self._lose(beam, (np.minimum(ensemble.y, beam.prev_y) - edge <
+                          self.y_min) |
+                   (np.maximum(ensemble.y, beam.prev_y) + edge > self.y_max),
+                   'wall')
+        ensemble.stop(slice(None), EXITED)
+
+class MagneticSector(Stage):
+    """A class to represent a magnetic field which bends particles back
+    around, as in the right half of a MassSpectrometer.
+
+    Particles leave once they are heading back left past the exit.
+
+    Attributes (besides Stage's):
+    exit_x -- x particles leave through, heading left
+    mag_field -- magnetic field strength, positive is out of page
+    y_min, y_max -- edges of the sector
+    max_steps -- number of frames before particles are given up on
+    """
+
+    def __init__(self, exit_x: float, mag_field: float, y_min: float,
+                 y_max: float, max_steps: int = simulation.MAX_STEPS,
+                 name: str = 'magnetic_sector') -> None:
+        """Initialize a MagneticSector.
+
+        exit_x -- x particles leave through, heading left
+        mag_field -- magnetic field strength, positive is out of page
+        y_min, y_max -- edges of the sector
+        max_steps -- number of frames before particles are given up on
+        name -- name of the stage, default 'magnetic_sector'
+        """
+
+        super().__init__(name, (mass_spectrometer.TOP_EDGE,
+                                mass_spectrometer.BOTTOM_EDGE,
+                                simulation.TIMEOUT))
+        self.exit_x = exit_x
+        self.mag_field = mag_field
+        self.y_min = y_min
+        self.y_max = y_max
+        self.max_steps = max_steps
+
+    def _run(self, beam: Beam) -> None:
+        self._step(beam, 0, self.mag_field, self.max_steps)
+
+    def _check(self, beam: Beam) -> None:
+        ensemble = beam.ensemble
+        ensemble.stop((ensemble.v_x < 0) & (ensemble.x <= self.exit_x),
+                      EXITED)
+        self._lose(beam, ensemble.y < self.y_min, mass_spectrometer.TOP_EDGE)
+        self._lose(beam, ensemble.y > self.y_max,
+                   mass_spectrometer.BOTTOM_EDGE)
+
+class Detector(Stage):
+    """A class to represent detector plates along a vertical plane.
+
+    Particles arriving from the last stage have just crossed the plane;
+    where each crossed is interpolated along its last frame, as
+    simulation.run_trajectory does, and it has landed if that is on a
+    plate. Landed particles are passed on, with their hit_y set.
+
+    Attributes (besides Stage's):
+    x -- x of the plane
+    spans -- tuple of (y_min, y_max) of every plate
+    _hits -- list of (index, hit_y) arrays from each batch
+
+    Methods (besides Stage's):
+    get_hits -- (index, hit_y) arrays of every particle landed so far
+    """
+
+    def __init__(self, x: float, spans, name: str = 'detector') -> None:
+        """Initialize a Detector.
+
+        x -- x of the plane
+        spans -- sequence of (y_min, y_max) of every plate
+        name -- name of the stage, default 'detector'
+        """
+
+        super().__init__(name, ('missed',))
+        self.x = x
+        self.spans = tuple(spans)
+
+    def reset(self) -> None:
+        """Zero the counters and forget every hit."""
+
+        super().reset()
+        self._hits = []
+
+    def _run(self, beam: Beam) -> None:
+        # particles have already crossed the plane, so only need checking
+        self._check(beam)
+
+    def _check(self, beam: Beam) -> None:
+        ensemble = beam.ensemble
+        start_x, end_x = beam.prev_x, ensemble.x
+        moved = start_x != end_x
+        fraction = np.clip((start_x - self.x) /
+                           np.where(moved, start_x - end_x, 1), 0, 1)
+        hit_y = np.where(moved, beam.prev_y + fraction *
+                         (ensemble.y - beam.prev_y), ensemble.y)
+
+        landed = np.zeros(len(beam), bool)
+        for y_min, y_max in self.spans:
+            landed |= (y_min <= hit_y) & (hit_y <= y_max)
+
+        beam.hit_y[landed] = hit_y[landed]
+        self._hits.append((beam.index[landed], hit_y[landed]))
+        ensemble.stop(landed, EXITED)
+        self._lose(beam, ~landed, 'missed')
+
+    def get_hits(self) -> (np.ndarray, np.ndarray):
+        """Get every particle landed so far.
+
+        Returns (index, hit_y) arrays of each particle's number in its
+        batch and where it landed
+        """
+
+        if not self._hits:
+            return np.empty(0, np.int64), np.empty(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*self._hits))
+
+class Beamline():
+    """A class to represent stages particle batches stream through.
+
+    Attributes:
+    stages -- list of Stages, in the order particles go through them
+
+    Methods:
+    run -- stream a batch of particles through every stage
+    get_stats -- every stage's counters, in order
+    report -- human-readable summary of every stage's counters
+    reset -- zero every stage's counters
+    """
+
+    def __init__(self, stages: list) -> None:
+        """Initialize a Beamline.
+
+        stages -- Stages in the order particles go through them
+        """
+
+        if not stages:
+            raise ValueError('A beamline needs at least one stage')
+        self.stages = list(stages)
+
+    def run(self, ensemble: particle_ensemble.ParticleEnsemble) -> Beam:
+        """Stream a batch of particles through every stage, in order.
+
+        ensemble -- ParticleEnsemble of the particles, which is left as is
+
+        Returns a Beam of the particles which made it out of the last stage
+        """
+
+        beam = Beam(ensemble.take(slice(None)))
+        for stage in self.stages:
+            if not len(beam):
+                break
+            beam = stage.process(beam)
+        return beam
+
+    def get_stats(self) -> list:
+        """Get a list of every stage's counters (see Stage.get_stats)."""
+
+        return [stage.get_stats() for stage in self.stages]
+
+    def report(self) -> str:
+        """Get a human-readable summary of every stage's counters."""
+
+        lines = []
+        for stats in self.get_stats():
+            lost = ', '.join('{} {}'.format(reason, count) for reason, count
+                             in stats['lost'].items() if count)
+            lines.append('{}: {} in, {} out{}, {} frames, {:.2f} ms'.format(
+                stats['name'], stats['entered'], stats['transmitted'],
+                ' (lost ' + lost + ')' if lost else '', stats['steps'],
+                stats['time'] * 1000))
+        return '\n'.join(lines)
+
+    def reset(self) -> None:
+        """Zero every stage's counters."""
+
+        for stage in self.stages:
+            stage.reset()
+
+def from_mass_spectrometer(mass_spec: mass_spectrometer.MassSpectrometer
+                           ) -> Beamline:
+    """Build a Beamline laid out like a MassSpectrometer with the usual
+    four walls: a velocity selector between the horizontal walls, then a
+    magnetic sector bending particles back onto the vertical walls.
+
+    mass_spec -- MassSpectrometer to copy fields and walls from
+
+    Returns the Beamline
+    """
+
+    walls = {obstacle.name: obstacle.rect
+             for obstacle in mass_spec.get_geometry().get_obstacles()}
+    if set(walls) != set(mass_spectrometer.WALL_NAMES):
+        raise ValueError('Only the usual four walls can be copied')
+
+    area = mass_spec.get_area()
+    detector_x = mass_spec.get_detector_x()
+    # a plate is hit if the particle's edge reaches it
+    spans = [(walls[name].top - charged_particle.RADIUS,
+              walls[name].bottom + charged_particle.RADIUS)
+             for name in mass_spec.get_detector_names()]
+
+    return Beamline([
+        VelocitySelector(mass_spec.get_slit_exit_x(), mass_spec.e_field,
+                         mass_spec.mag_field,
+                         walls['upper_horizontal'].bottom,
+                         walls['lower_horizontal'].top),
+        MagneticSector(detector_x, mass_spec.mag_field, area.top,
+                       area.top + area.height),
+        Detector(detector_x, spans)])
@@ -5,6 +5,7 @@ ChargedParticle -- for representing a moving charged particle
 
 Constants:
 RADIUS -- radius of a particle
+MIN_STEP, MAX_STEP_GROWTH -- limits on adaptive time steps
 POSITIVE_COLOR -- color of a particle with a positive (>0) charge
 NEUTRAL_COLOR -- color of a particle with a netural (=0) charge
 NEGATIVE_COLOR -- color of a particle with a negative (<0) charge
@@ -24,6 +25,11 @@ POSITIVE_COLOR = pygame.Color(25, 100, 230)
 NEUTRAL_COLOR = pygame.Color(144, 144, 144)
 NEGATIVE_COLOR = pygame.Color(204, 29, 6)
 
+# adaptive steps never shrink below this many frames, or grow by more than
+# this factor at once
+MIN_STEP = 1e-3
+MAX_STEP_GROWTH = 5
+
 class ChargedParticle():
     """A class to represent a charged particle.
 
@@ -34,15 +40,20 @@ class ChargedParticle():
     _velocity -- (x, y) velocity of the particle
     _pos -- (x, y) position of the particle
     _stopped -- whether the particle is stopped
+    _step_size -- time step the next adaptive move will try first
+    _box -- collision box Rect, reused rather than made for every check
 
     Methods:
     move -- moves & accelerates the particle
+    move_adaptive -- moves & accelerates the particle with error control
     draw -- draws the particle on a Surface
     stop -- forces particle to stop moving (irreversible from outside)
     set_mass -- sets _mass to a new value
     set_charge -- sets _charge to a new value, also updating _color
     is_collision -- checks if the particle has collided with a Rect
+    is_stopped -- getter for _stopped
     get_pos -- getter for _pos
+    get_velocity -- getter for _velocity
     """
 
     def __init__(self, mass: int, charge: int, initial_x_velocity: int,
@@ -61,12 +72,17 @@ class ChargedParticle():
         self._velocity = (initial_x_velocity, 0)
         self._pos = pos
         self._stopped = False
+        self._step_size = 1
+        self._box = pygame.Rect(0, 0, RADIUS * 2, RADIUS * 2)
 
-    def move(self, e_field: int, mag_field: int) -> None:
+    def move(self, e_field: int, mag_field: int,
+             e_field_x: int = 0) -> None:
         """Move and accelerate the charged particle one frame's worth.
 
         e_field -- electric field strength, positive is down
         mag_field -- magnetic field strength, positive is out of page
+        e_field_x -- sideways electric field strength, positive is right
+                     default 0, as only field maps have one
         """
 
         # only move if allowed
@@ -78,7 +94,7 @@ class ChargedParticle():
             # calculate force on particle
             electric_force = e_field * self._charge
             magnetic_force = self._calc_mag_force(mag_field)
-            total_force = (magnetic_force[0],
+            total_force = (e_field_x * self._charge + magnetic_force[0],
                            electric_force + magnetic_force[1])
             # Newton's Second Law, a = F/m
             acceleration = (total_force[0] / self._mass,
@@ -88,6 +104,106 @@ class ChargedParticle():
             self._velocity = (self._velocity[0] + acceleration[0],
                                self._velocity[1] + acceleration[1])
 
+    def move_adaptive(self, fields, tolerance: float,
+                      max_distance: float) -> float:
+        """Move and accelerate the charged particle one adaptive time step.
+
+        Uses the embedded Bogacki-Shampine 3(2) Runge-Kutta pair: the step
+        is retried smaller until its estimated error is within tolerance,
+        and the next step grows or shrinks to match. Where the forces cancel
+        (the straight section) steps grow up to max_distance of travel; in
+        tight magnetic arcs they shrink.
+
+        fields -- function of an (x, y) position giving the
+                  (e_field, mag_field, e_field_x) there
+        tolerance -- largest error allowed per step, in pixels (and
+                     pixels per frame for velocity)
+        max_distance -- furthest the particle may travel in one step, so
+                        that it cannot jump over anything it should hit
+
+        Returns the time step taken, in frames (0 if stopped)
+        """
+
+        if self._stopped:
+            return 0
+
+        state = self._pos + self._velocity
+        derivative = self._derivative(state, fields)
+
+        while True:
+            speed = math.hypot(*self._velocity)
+            step = self._step_size
+            if speed > 0:
+                step = min(step, max_distance / speed)
+            step = max(step, MIN_STEP)
+
+            new_state, error = self._rk23_step(state, derivative, step,
+                                               fields)
+
+            # grow/shrink by the usual safety-factored order-3 rule
+            if error == 0:
+                factor = MAX_STEP_GROWTH
+            else:
+                factor = min(MAX_STEP_GROWTH,
+                             max(0.2, 0.9 * (tolerance / error) ** (1 / 3)))
+            self._step_size = step * factor
+
+            if error <= tolerance or step == MIN_STEP:
+                break
+
+        self._pos = new_state[:2]
+        self._velocity = new_state[2:]
+        return step
+
+    def _derivative(self, state: tuple, fields) -> tuple:
+        """Calculate the rate of change of (x, y, v_x, v_y).
+
+        state -- (x, y, v_x, v_y) of the particle
+        fields -- function of an (x, y) position giving the
+                  (e_field, mag_field, e_field_x) there
+
+        Returns (v_x, v_y, a_x, a_y)
+        """
+
+        x, y, v_x, v_y = state
+        e_field, mag_field, e_field_x = fields((x, y))
+        charge_to_mass = self._charge / self._mass
+
+        # same force as _calc_mag_force works out from angles, qvB
+        # perpendicular to velocity, written in components
+        return (v_x, v_y, charge_to_mass * (e_field_x - mag_field * v_y),
+                charge_to_mass * (e_field + mag_field * v_x))
+
+    def _rk23_step(self, state: tuple, derivative: tuple, step: float,
+                   fields) -> (tuple, float):
+        """Take one Bogacki-Shampine step.
+
+        state -- (x, y, v_x, v_y) at the start of the step
+        derivative -- _derivative of state
+        step -- time step, in frames
+        fields -- function of an (x, y) position giving the
+                  (e_field, mag_field, e_field_x) there
+
+        Returns (new state, estimated error of the step)
+        """
+
+        def advance(weights, ks):
+            return tuple(s + step * sum(w * k[i] for w, k in zip(weights, ks))
+                         for i, s in enumerate(state))
+
+        k1 = derivative
+        k2 = self._derivative(advance((1 / 2,), (k1,)), fields)
+        k3 = self._derivative(advance((3 / 4,), (k2,)), fields)
+        new_state = advance((2 / 9, 1 / 3, 4 / 9), (k1, k2, k3))
+        k4 = self._derivative(new_state, fields)
+
+        # difference between the 3rd and embedded 2nd order solutions
+        error = max(abs(step * (-5 / 72 * a + 1 / 12 * b + 1 / 9 * c -
+                                1 / 8 * d))
+                    for a, b, c, d in zip(k1, k2, k3, k4))
+
+        return new_state, error
+
     def _calc_mag_force(self, mag_field: int) -> (int, int):
         """Calculate magnetic force on charge
 
@@ -161,13 +277,23 @@ class ChargedParticle():
     def is_collision(self, rect: pygame.Rect) -> bool:
         """Check if particle collides with given rectangle."""
         
-        # check for collision between rect & particle's collision box
-        return rect.colliderect(
-            pygame.Rect(self._pos[0] - RADIUS, self._pos[1] - RADIUS,
-                        RADIUS * 2, RADIUS * 2)
-            )
+        # check for collision between rect & particle's collision box,
+        # moved into place (truncating as a new Rect would)
+        self._box.update(self._pos[0] - RADIUS, self._pos[1] - RADIUS,
+                         RADIUS * 2, RADIUS * 2)
+        return rect.colliderect(self._box)
+
+    def is_stopped(self) -> bool:
+        """Get whether the particle has stopped."""
+
+        return self._stopped
 
     def get_pos(self) -> (int, int):
         """Get current position."""
         
         return self._pos
+
+    def get_velocity(self) -> (int, int):
+        """Get current velocity."""
+
+        return self._velocity
@@ -0,0 +1,130 @@
+"""checkpoint.py: for periodically saving the state of long runs
+
+Snapshots are .npz files of named arrays. They are written to a temporary
+file beside the real one and renamed over it, so a snapshot on disk is
+always complete, even if the run is killed mid-write.
+
+Classes:
+Checkpointer -- saves snapshots in the background every so often
+
+Methods:
+save_snapshot -- atomically write a snapshot
+load_snapshot -- read a snapshot back
+
+Constants:
+CHECKPOINT_INTERVAL -- default seconds between snapshots
+"""
+
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+CHECKPOINT_INTERVAL = 30
+
+def save_snapshot(filename: str, state: dict) -> None:
+    """Atomically write a snapshot.
+
+    filename -- path of the snapshot, conventionally ending in .npz
+    state -- dict of name to array (or anything numpy can make one of)
+    """
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as file:
+        np.savez(file, **state)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+def load_snapshot(filename: str) -> dict:
+    """Read a snapshot written by save_snapshot.
+
+    filename -- path of the snapshot
+
+    Returns a dict of name to array
+    """
+
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+class Checkpointer():
+    """A class to represent periodic, non-blocking snapshot saving.
+
+    The run being checkpointed hands over a copy of its state, which is
+    written out on a background thread while the run carries on. If the
+    last snapshot is still being written when the next is due, the new one
+    is skipped rather than waited for.
+
+    Attributes:
+    filename -- path snapshots are written to
+    interval -- seconds between snapshots
+    _last_save -- time.monotonic() of the last snapshot taken
+    _writer -- single-thread executor snapshots are written on
+    _pending -- Future of the snapshot being written, or None
+
+    Methods:
+    maybe_save -- take a snapshot if one is due
+    save -- take a snapshot now
+    close -- wait for the last snapshot to be written
+    """
+
+    def __init__(self, filename: str,
+                 interval: float = CHECKPOINT_INTERVAL) -> None:
+        """Initialize a Checkpointer.
+
+        filename -- path snapshots are written to
+        interval -- seconds between snapshots, default CHECKPOINT_INTERVAL
+        """
+
+        self.filename = filename
+        self.interval = interval
+        self._last_save = time.monotonic()
+        self._writer = ThreadPoolExecutor(1)
+        self._pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def maybe_save(self, get_state) -> bool:
+        """Take a snapshot if one is due.
+
+        get_state -- function returning the state to save; it is only
+                     called if a snapshot is taken, and what it returns
+                     must not be changed afterwards (i.e. copy arrays)
+
+        Returns whether a snapshot was taken
+        """
+
+        if time.monotonic() - self._last_save < self.interval:
+            return False
+        return self.save(get_state())
+
+    def save(self, state: dict) -> bool:
+        """Start writing a snapshot in the background.
+
+        state -- dict of name to array, not to be changed afterwards
+
+        Returns whether the snapshot was taken (False if the last one is
+        still being written)
+        """
+
+        if self._pending is not None:
+            if not self._pending.done():
+                return False
+            # surface any error from the last write
+            self._pending.result()
+
+        self._last_save = time.monotonic()
+        self._pending = self._writer.submit(save_snapshot, self.filename,
+                                            state)
+        return True
+
+    def close(self) -> None:
+        """Wait for the last snapshot to be written."""
+
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+        self._writer.shutdown()
@@ -0,0 +1,175 @@
+"""density_map.py: for a DensityMap class
+
+Classes:
+DensityMap -- 2D histogram of where particles have been, drawn as a heatmap
+
+Constants:
+OVERLAY_ALPHA -- opacity of the heatmap overlay, out of 255
+HEAT_COLORS -- colors the heatmap runs through, from sparse to dense
+"""
+
+import pygame
+import numpy as np
+import particle_ensemble
+
+# required initialization step
+pygame.init()
+
+OVERLAY_ALPHA = 160
+HEAT_COLORS = (pygame.Color(20, 20, 120), pygame.Color(140, 30, 160),
+               pygame.Color(230, 60, 40), pygame.Color(255, 200, 40),
+               pygame.Color(255, 255, 220))
+
+# cells no particle has been in are this color, which is made transparent
+_COLOR_KEY = (0, 0, 0)
+
+def _build_colormap() -> np.ndarray:
+    """Spread HEAT_COLORS over 256 levels, level 0 being empty."""
+
+    stops = np.linspace(1, 255, len(HEAT_COLORS))
+    levels = np.arange(256)
+    colormap = np.stack([np.interp(levels, stops,
+                                   [color[channel] for color in HEAT_COLORS])
+                         for channel in range(3)], axis=-1)
+    colormap[0] = _COLOR_KEY
+    return colormap.astype(np.uint8)
+
+class DensityMap():
+    """A class to represent a running 2D histogram of particle positions.
+
+    Positions are binned with one bincount over just the span of cells
+    they touch. Only cells changed since the last draw are recolored, unless
+    the densest cell has grown (which rescales every color), so drawing
+    costs the same however long the run has been going.
+
+    Attributes:
+    _area -- Rect the histogram covers
+    _cell_size -- size of each histogram cell, in pixels
+    _counts -- (columns, rows) array of positions binned per cell, indexed
+               [x, y] as pygame.surfarray is
+    _max -- count of the densest cell when last drawn
+    _dirty -- (left, top, right, bottom) cells changed since last drawn,
+              right & bottom exclusive, or None
+    _colormap -- (256, 3) array of heatmap colors by level
+    _surface -- Surface of one pixel per cell, recolored incrementally
+
+    Methods:
+    add -- bin arrays of positions in
+    add_ensemble -- bin a ParticleEnsemble's current positions in
+    clear -- empty the histogram
+    get_counts -- copy of the histogram
+    draw -- draws the heatmap over the area on a Surface
+    """
+
+    def __init__(self, area: pygame.Rect, cell_size: int = 1) -> None:
+        """Initialize a DensityMap.
+
+        area -- Rect the histogram covers, e.g. a MassSpectrometer's area
+        cell_size -- size of each histogram cell in pixels, default 1
+        """
+
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+
+        self._area = pygame.Rect(area)
+        self._cell_size = cell_size
+        shape = (-(-self._area.width // cell_size),
+                 -(-self._area.height // cell_size))
+
+        self._counts = np.zeros(shape, np.int64)
+        self._colormap = _build_colormap()
+        self._surface = pygame.Surface(shape)
+        self._surface.set_colorkey(_COLOR_KEY)
+        self._surface.set_alpha(OVERLAY_ALPHA)
+        self.clear()
+
+    def clear(self) -> None:
+        """Empty the histogram."""
+
+        self._counts[:] = 0
+        self._max = 0
+        self._dirty = None
+        self._surface.fill(_COLOR_KEY)
+
+    def add(self, x: np.ndarray, y: np.ndarray) -> None:
+        """Bin arrays of positions in; positions outside the area are
+        ignored."""
+
+        columns, rows = self._counts.shape
+        column = np.floor((np.asarray(x) - self._area.left) /
+                          self._cell_size).astype(np.int64)
+        row = np.floor((np.asarray(y) - self._area.top) /
+                       self._cell_size).astype(np.int64)
+
+        inside = (column >= 0) & (column < columns) & \
+            (row >= 0) & (row < rows)
+        column = column[inside]
+        row = row[inside]
+        if not len(column):
+            return
+
+        # bincount only the span of cells touched, not the whole grid
+        cells = column * rows + row
+        first = cells.min()
+        binned = np.bincount(cells - first)
+        self._counts.ravel()[first:first + len(binned)] += binned
+
+        bounds = (column.min(), row.min(), column.max() + 1, row.max() + 1)
+        if self._dirty is not None:
+            bounds = (min(bounds[0], self._dirty[0]),
+                      min(bounds[1], self._dirty[1]),
+                      max(bounds[2], self._dirty[2]),
+                      max(bounds[3], self._dirty[3]))
+        self._dirty = bounds
+
+    def add_ensemble(self, ensemble: particle_ensemble.ParticleEnsemble
+                     ) -> None:
+        """Bin the positions of an ensemble's still-moving particles in.
+
+        Call once per step, so stopped particles don't pile up forever.
+        """
+
+        free = ensemble.get_free()
+        self.add(ensemble.x[free], ensemble.y[free])
+
+    def get_counts(self) -> np.ndarray:
+        """Get a copy of the histogram, indexed [x, y]."""
+
+        return self._counts.copy()
+
+    def _recolor(self, left: int, top: int, right: int,
+                 bottom: int) -> None:
+        """Recolor a block of cells on the surface."""
+
+        counts = self._counts[left:right, top:bottom]
+        # log scale, so sparse paths still show next to dense ones
+        levels = np.log1p(counts) * (254 / np.log1p(self._max))
+        levels = np.where(counts > 0, levels.astype(np.int64) + 1, 0)
+
+        block = self._surface.subsurface(left, top, right - left,
+                                         bottom - top)
+        pygame.surfarray.blit_array(block, self._colormap[levels])
+
+    def draw(self, screen: pygame.Surface) -> None:
+        """Draw the heatmap over its area on a given Surface."""
+
+        if self._dirty is not None:
+            left, top, right, bottom = self._dirty
+            densest = int(self._counts[left:right, top:bottom].max())
+            if densest > self._max:
+                # every color is relative to the densest cell
+                self._max = densest
+                self._recolor(0, 0, *self._counts.shape)
+            else:
+                self._recolor(left, top, right, bottom)
+            self._dirty = None
+
+        if self._cell_size == 1:
+            screen.blit(self._surface, self._area.topleft)
+        else:
+            # cells are a pixel each on the surface, so stretch to the area
+            overlay = pygame.transform.scale(
+                self._surface, (self._counts.shape[0] * self._cell_size,
+                                self._counts.shape[1] * self._cell_size))
+            screen.blit(overlay, self._area.topleft, ((0, 0),
+                                                      self._area.size))
@@ -0,0 +1,179 @@
+"""field_map.py: for a FieldMap class
+
+Classes:
+FieldMap -- non-uniform E and B fields sampled from a grid
+
+Methods:
+layout_field_map -- FieldMap of the usual "E in the left half" layout,
+                    optionally with fringe fields
+"""
+
+import hashlib
+import numpy as np
+
+class FieldMap():
+    """A class to represent electric and magnetic fields on a grid.
+
+    Grids are indexed [row, column], i.e. [y, x], with grid point (i, j) at
+    (origin_x + j * spacing, origin_y + i * spacing). Fields are bilinearly
+    interpolated between grid points and are zero outside the grid.
+
+    Attributes:
+    _grid -- (rows * columns, 3) array of (e_field, mag_field, e_field_x)
+             per grid point, flattened so sampling is a single gather
+    _shape -- (rows, columns) of the grid
+    _origin -- (x, y) position of grid point (0, 0)
+    _spacing -- distance between neighbouring grid points, in pixels
+
+    Methods:
+    load -- load a FieldMap from a .npy file (classmethod)
+    save -- save the FieldMap to a .npy file
+    sample -- fields at arrays of positions
+    sample_point -- fields at one position
+    get_digest -- hash of the fields, for caching results computed in them
+    """
+
+    def __init__(self, e_field_x: np.ndarray, e_field_y: np.ndarray,
+                 mag_field: np.ndarray, origin: (float, float) = (0, 0),
+                 spacing: float = 1) -> None:
+        """Initialize a FieldMap.
+
+        e_field_x -- 2D grid of electric field x component, positive is right
+        e_field_y -- 2D grid of electric field y component, positive is down
+        mag_field -- 2D grid of magnetic field, positive is out of page
+        origin -- (x, y) position of grid point (0, 0), default (0, 0)
+        spacing -- distance between neighbouring grid points, default 1
+        """
+
+        grids = [np.asarray(grid, np.float64)
+                 for grid in (e_field_y, mag_field, e_field_x)]
+        shape = grids[0].shape
+
+        if len(shape) != 2 or any(grid.shape != shape for grid in grids):
+            raise ValueError('Field grids must be 2D and the same shape')
+        if shape[0] < 2 or shape[1] < 2:
+            raise ValueError('Field grids need at least 2 rows and columns')
+        if spacing <= 0:
+            raise ValueError('Grid spacing must be positive')
+
+        # stored in the order ChargedParticle.move takes fields in
+        self._grid = np.stack(grids, axis=-1).reshape(-1, 3)
+        self._shape = shape
+        self._origin = origin
+        self._spacing = spacing
+
+    @classmethod
+    def load(cls, filename: str, origin: (float, float) = (0, 0),
+             spacing: float = 1):
+        """Load a FieldMap from a .npy file.
+
+        filename -- path of a .npy file holding a (3, rows, columns) array
+                    of (e_field_x, e_field_y, mag_field) grids
+        origin -- (x, y) position of grid point (0, 0), default (0, 0)
+        spacing -- distance between neighbouring grid points, default 1
+
+        Returns the loaded FieldMap
+        """
+
+        grids = np.load(filename)
+        if grids.ndim != 3 or len(grids) != 3:
+            raise ValueError('Field map file must hold a (3, rows, columns) '
+                             'array')
+        return cls(grids[0], grids[1], grids[2], origin, spacing)
+
+    def save(self, filename: str) -> None:
+        """Save the grids to a .npy file that load can read.
+
+        The origin and spacing are not saved, and must be given to load.
+
+        filename -- path of the .npy file
+        """
+
+        e_field_y, mag_field, e_field_x = np.moveaxis(
+            self._grid.reshape(*self._shape, 3), -1, 0)
+        np.save(filename, np.stack((e_field_x, e_field_y, mag_field)))
+
+    def sample(self, x, y) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Find the fields at arrays of positions.
+
+        Every position's four surrounding grid points are gathered in one
+        indexing operation, rather than a call per position.
+
+        x, y -- arrays of positions
+
+        Returns (e_field, mag_field, e_field_x) arrays, with e_field the
+        downwards component as everywhere else
+        """
+
+        rows, columns = self._shape
+        grid_x = (np.asarray(x, np.float64) - self._origin[0]) / self._spacing
+        grid_y = (np.asarray(y, np.float64) - self._origin[1]) / self._spacing
+
+        inside = ((grid_x >= 0) & (grid_x <= columns - 1) &
+                  (grid_y >= 0) & (grid_y <= rows - 1))
+
+        # clip so that the last row/column (and outside points) still have
+        # a cell to interpolate in
+        column = np.clip(np.floor(grid_x), 0, columns - 2).astype(np.int64)
+        row = np.clip(np.floor(grid_y), 0, rows - 2).astype(np.int64)
+        frac_x = np.clip(grid_x - column, 0, 1)[..., None]
+        frac_y = np.clip(grid_y - row, 0, 1)[..., None]
+
+        base = row * columns + column
+        corners = self._grid[np.stack((base, base + 1, base + columns,
+                                       base + columns + 1), axis=-1)]
+
+        fields = ((corners[..., 0, :] * (1 - frac_x) +
+                   corners[..., 1, :] * frac_x) * (1 - frac_y) +
+                  (corners[..., 2, :] * (1 - frac_x) +
+                   corners[..., 3, :] * frac_x) * frac_y)
+        fields *= inside[..., None]
+
+        return fields[..., 0], fields[..., 1], fields[..., 2]
+
+    def sample_point(self, pos: (float, float)) -> (float, float, float):
+        """Find the fields at one (x, y) position.
+
+        Returns (e_field, mag_field, e_field_x), as ChargedParticle.move
+        takes them
+        """
+
+        return tuple(float(field) for field in self.sample(pos[0], pos[1]))
+
+    def get_digest(self) -> str:
+        """Get a hex SHA-256 digest of the grids, origin and spacing, equal
+        for FieldMaps with equal fields."""
+
+        digest = hashlib.sha256(repr((self._shape, tuple(self._origin),
+                                      self._spacing)).encode())
+        digest.update(np.ascontiguousarray(self._grid).tobytes())
+        return digest.hexdigest()
+
+def layout_field_map(area, e_field: float, mag_field: float,
+                     spacing: float = 2, fringe: float = 0) -> FieldMap:
+    """Build a FieldMap of the usual layout: E only in the left half.
+
+    area -- Rect the mass spectrometer takes up
+    e_field -- electric field strength in the left half, positive is down
+    mag_field -- magnetic field strength everywhere, positive is out of page
+    spacing -- distance between grid points, default 2
+    fringe -- width in pixels over which E falls off at the middle, default
+              0 for a sharp edge like MassSpectrometer's own
+
+    Returns a FieldMap covering area
+    """
+
+    columns = int(np.ceil(area.width / spacing)) + 1
+    rows = int(np.ceil(area.height / spacing)) + 1
+    x = area.left + np.arange(columns) * spacing
+    middle = area.left + area.width / 2
+
+    if fringe > 0:
+        profile = 0.5 * (1 - np.tanh((x - middle) / fringe))
+    else:
+        profile = (x <= middle).astype(np.float64)
+
+    e_field_y = np.tile(e_field * profile, (rows, 1))
+    return FieldMap(np.zeros_like(e_field_y), e_field_y,
+                    np.full_like(e_field_y, mag_field),
+                    (area.left, area.top), spacing)
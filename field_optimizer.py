@@ -0,0 +1,250 @@
+"""field_optimizer.py: for finding field settings which separate species
+
+Given two or more species, searches the simulator's slider ranges of
+electric field, magnetic field and initial velocity (simulation's
+E_FIELD_RANGE, MAG_FIELD_RANGE and VELOCITY_RANGE) for the setting which
+lands them furthest apart on the detector. A setting only counts if every
+species gets through the straight section and lands on the detector, and
+still does with either field, the velocity or its mass off by MARGIN, so
+the setting found isn't one that a small change (or the resolving power's
+differencing) breaks.
+
+The search is a cross-entropy method: each round runs a batch of candidate
+settings, every species under every candidate, in one run_hits call, with
+a candidate given up on as soon as any of its species misses; the next
+batch is then drawn around the best candidates so far. Particles only pass
+the straight section near where the fields balance (E = -B * v0), so half
+the first batch is drawn along that balance.
+
+Run as a script to optimize for species given as mass:charge, e.g.
+    python field_optimizer.py 20:1 25:1
+
+Classes:
+FieldSettings -- an optimized setting and how well it separates species
+
+Methods:
+separations -- closest distance between species' hits, per candidate
+optimize_fields -- search for the setting separating species the most
+
+Constants:
+BATCH_SIZE -- default number of candidates run per round
+ROUNDS -- default number of rounds
+ELITE_FRACTION -- fraction of a batch the next is drawn around
+MARGIN -- default relative change every species must keep landing under
+"""
+
+import sys
+import numpy as np
+import sensitivity, simulation
+
+BATCH_SIZE = 1024
+ROUNDS = 10
+ELITE_FRACTION = 0.05
+
+# as large as the resolving power's differencing step, so its raised and
+# lowered runs land too
+MARGIN = sensitivity.RELATIVE_STEP
+
+# each round's spread is kept at least this fraction of each range, so a
+# search that has converged can still move
+_MIN_SPREAD = 1e-3
+
+class FieldSettings():
+    """A class to represent an optimized field setting.
+
+    Attributes:
+    e_field -- electric field strength, positive is down
+    mag_field -- magnetic field strength, positive is out of page
+    initial_x_velocity -- x velocity of the particles at launch
+    hit_y -- array of where each species lands on the detector
+    separation -- closest distance between two species' hits, in pixels
+    resolving_power -- array of each species' mass resolving power m / dm
+                       at the setting (see sensitivity.resolving_power),
+                       NaN where it couldn't be found
+    evaluated -- number of candidate settings run in the search
+    """
+
+    def __init__(self, e_field: float, mag_field: float,
+                 initial_x_velocity: float, hit_y: np.ndarray,
+                 separation: float, resolving_power: np.ndarray,
+                 evaluated: int) -> None:
+        """Initialize a FieldSettings; arguments are its attributes."""
+
+        self.e_field = e_field
+        self.mag_field = mag_field
+        self.initial_x_velocity = initial_x_velocity
+        self.hit_y = hit_y
+        self.separation = separation
+        self.resolving_power = resolving_power
+        self.evaluated = evaluated
+
+def _check_species(species) -> (np.ndarray, np.ndarray):
+    """Check species can be told apart, returning (mass, charge) arrays."""
+
+    mass, charge = np.asarray(species, np.float64).reshape(-1, 2).T
+    if len(mass) < 2:
+        raise ValueError('At least two species are needed')
+    if np.any(mass <= 0):
+        raise ValueError('Mass must be positive')
+    if np.any(charge == 0):
+        raise ValueError('Neutral species never reach the detector')
+    # particles move by charge / mass alone, so equal ratios fly together
+    if len(np.unique(charge / mass)) < len(mass):
+        raise ValueError('Species with equal charge / mass ratios cannot be '
+                         'separated')
+    return mass, charge
+
+def separations(species, candidates,
+                area: (float, float, float, float) = simulation.DEFAULT_AREA,
+                max_steps: int = simulation.MAX_STEPS,
+                margin: float = 0) -> (np.ndarray, np.ndarray):
+    """Run every species under every candidate setting, in one batch.
+
+    species -- sequence of (mass, charge) of each species
+    candidates -- (n, 3) array of (e_field, mag_field, initial_x_velocity)
+    area -- (left, top, width, height) the mass spectrometer takes up
+    max_steps -- number of frames before a run is given up on
+    margin -- if positive, each species is also run with the E field, mag
+              field, velocity and its mass each raised and lowered by this
+              fraction (of 1, for those which are 0), and a candidate only
+              counts if every run lands; default 0 runs the setting alone
+
+    Returns (hit y, separation) arrays of shape (n, species) and (n,);
+    separation is the closest distance between two species' hits at the
+    setting itself, NaN where any run missed the detector
+    """
+
+    mass, charge = _check_species(species)
+    candidates = np.asarray(candidates, np.float64).reshape(-1, 3)
+    if margin < 0:
+        raise ValueError('Margin must not be negative')
+
+    # (e_field, mag_field, initial_x_velocity, mass) of every run, as
+    # (candidate, variant, species): the setting, then each of the four
+    # raised and lowered in turn
+    base = np.empty((len(candidates), len(mass), 4))
+    base[..., :3] = candidates[:, None, :]
+    base[..., 3] = mass
+    varied = 4 if margin > 0 else 0
+    variants = np.repeat(base[:, None], 2 * varied + 1, axis=1)
+    steps = margin * np.where(base != 0, np.abs(base), 1)
+    for k in range(varied):
+        variants[:, 2 * k + 1, :, k] += steps[:, :, k]
+        variants[:, 2 * k + 2, :, k] -= steps[:, :, k]
+    e_field, mag_field, velocity, variant_mass = np.moveaxis(variants, -1, 0)
+
+    hits = simulation.run_hits(
+        e_field, mag_field, variant_mass, charge, velocity, area, max_steps,
+        groups=np.arange(len(candidates))[:, None, None])
+    # any miss makes its whole group NaN, so the setting's own hits show it
+    hits = hits[:, 0]
+
+    # NaN sorts last, so any miss makes the closest distance NaN
+    return hits, np.diff(np.sort(hits, axis=1), axis=1).min(axis=1)
+
+def optimize_fields(species, batch_size: int = BATCH_SIZE,
+                    rounds: int = ROUNDS, rng: np.random.Generator = None,
+                    area: (float, float, float, float) =
+                    simulation.DEFAULT_AREA,
+                    max_steps: int = simulation.MAX_STEPS,
+                    margin: float = MARGIN) -> FieldSettings:
+    """Search the sliders' ranges for the field setting which lands the
+    species furthest apart on the detector.
+
+    species -- sequence of (mass, charge) of each species, at least two
+    batch_size -- candidates run per round, default BATCH_SIZE
+    rounds -- number of rounds, default ROUNDS
+    rng -- numpy Generator candidates are drawn with, default a fresh one
+    area -- (left, top, width, height) the mass spectrometer takes up
+    max_steps -- number of frames before a run is given up on
+    margin -- relative change every species must keep landing under (see
+              separations), default MARGIN
+
+    Returns the best FieldSettings found
+
+    Raises ValueError if no setting landed every species
+    """
+
+    mass, charge = _check_species(species)
+    if batch_size < 2 or rounds < 1:
+        raise ValueError('Need a batch of at least 2 and at least 1 round')
+    if rng is None:
+        rng = np.random.default_rng()
+
+    low, high = np.array((simulation.E_FIELD_RANGE,
+                          simulation.MAG_FIELD_RANGE,
+                          simulation.VELOCITY_RANGE), np.float64).T
+    elite_size = max(2, int(ELITE_FRACTION * batch_size))
+
+    candidates = _first_batch(rng, batch_size, low, high)
+    elite = np.empty((0, 3))
+    elite_scores = np.empty(0)
+    evaluated = 0
+
+    for _ in range(rounds):
+        _, scores = separations(species, candidates, area, max_steps,
+                                margin)
+        evaluated += len(candidates)
+
+        # the best candidates from every round so far
+        feasible = ~np.isnan(scores)
+        elite = np.concatenate((elite, candidates[feasible]))
+        elite_scores = np.concatenate((elite_scores, scores[feasible]))
+        best = np.argsort(elite_scores)[::-1][:elite_size]
+        elite, elite_scores = elite[best], elite_scores[best]
+
+        if len(elite) < 2:
+            # nothing to draw around yet, so keep looking everywhere
+            candidates = _first_batch(rng, batch_size, low, high)
+            continue
+
+        spread = np.maximum(elite.std(axis=0), _MIN_SPREAD * (high - low))
+        candidates = np.clip(rng.normal(elite.mean(axis=0), spread,
+                                        (batch_size, 3)), low, high)
+
+    if not len(elite):
+        raise ValueError('No setting in range landed every species')
+
+    e_field, mag_field, velocity = elite[0]
+    hits, scores = separations(species, elite[:1], area, max_steps)
+    _, hit_by_mass = sensitivity.hit_derivative(
+        np.column_stack(np.broadcast_arrays(e_field, mag_field, mass, charge,
+                                            velocity)),
+        'mass', area=area, max_steps=max_steps)
+    power = sensitivity.resolving_power(mass, hit_by_mass)
+
+    return FieldSettings(float(e_field), float(mag_field), float(velocity),
+                         hits[0], float(scores[0]), power, evaluated)
+
+def _first_batch(rng: np.random.Generator, batch_size: int,
+                 low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Draw candidates from the whole range, half of them along the
+    balance E = -B * v0 where particles go straight."""
+
+    candidates = rng.uniform(low, high, (batch_size, 3))
+    balanced = candidates[:batch_size // 2]
+    balanced[:, 0] = np.clip(-balanced[:, 1] * balanced[:, 2],
+                             low[0], high[0])
+    return candidates
+
+def main() -> None:
+    """Optimize for species given on the command line as mass:charge."""
+
+    try:
+        species = [tuple(float(value) for value in arg.split(':'))
+                   for arg in sys.argv[1:]]
+        result = optimize_fields(species)
+    except ValueError as error:
+        sys.exit('Usage: python field_optimizer.py mass:charge mass:charge '
+                 '...\n' + str(error))
+
+    print('E field {:.3f}, mag field {:.3f}, initial velocity {:.3f}'.format(
+        result.e_field, result.mag_field, result.initial_x_velocity))
+    print('separation {:.1f} px, hits at {}'.format(
+        result.separation, np.round(result.hit_y, 1).tolist()))
+    print('resolving power', np.round(result.resolving_power, 1).tolist())
+    print(result.evaluated, 'settings evaluated')
+
+# optimize if running this script
+if __name__ == '__main__':
+    main()
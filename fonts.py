@@ -4,6 +4,10 @@ Fonts available:
 TITLE_FONT, SUBTITLE_FONT (both inkfree, subtitle is smaller and italicized)
 BUTTON_FONT (calibri)
 PARAGRAPH_FONT, NUMBER_FONT (both arial, number is smaller)
+
+Methods:
+make_font -- load a system font, remembering what it was loaded from
+get_font_key -- (font file, size) a font was loaded from, if known
 """
 
 import pygame
@@ -11,10 +15,39 @@ import pygame
 # required initialization step
 pygame.init()
 
-TITLE_FONT = pygame.font.SysFont('inkfree', 60)
-SUBTITLE_FONT = pygame.font.SysFont('inkfree', 20, False, True)
+# (font file, size) of every font made by make_font, by font
+_font_keys = {}
+
+def make_font(name: str, size: int, bold: bool = False,
+              italic: bool = False) -> pygame.font.Font:
+    """Load a system font, as pygame.font.SysFont does, remembering what it
+    was loaded from so that text rendered in it can be cached by value.
+
+    name -- name of the system font
+    size -- size of the font
+    bold, italic -- style of the font, default False
+
+    Returns the loaded Font
+    """
+
+    font = pygame.font.SysFont(name, size, bold, italic)
+    # SysFont falls back to the default font if there's no match
+    font_file = (pygame.font.match_font(name, bold, italic) or
+                 pygame.font.get_default_font())
+    _font_keys[font] = (font_file, size)
+    return font
+
+def get_font_key(font: pygame.font.Font) -> tuple:
+    """Get the (font file, size) a font was loaded from, or None for fonts
+    not made by make_font, which can only be told apart by identity.
+    """
+
+    return _font_keys.get(font)
+
+TITLE_FONT = make_font('inkfree', 60)
+SUBTITLE_FONT = make_font('inkfree', 20, False, True)
 
-BUTTON_FONT = pygame.font.SysFont('calibri', 35)
+BUTTON_FONT = make_font('calibri', 35)
 
-PARAGRAPH_FONT = pygame.font.SysFont('arial', 15)
-NUMBER_FONT = pygame.font.SysFont('arial', 10)
+PARAGRAPH_FONT = make_font('arial', 15)
+NUMBER_FONT = make_font('arial', 10)
@@ -0,0 +1,185 @@
+"""frame_export.py: for exporting simulator runs as PNG sequences
+
+Frames are drawn onto an off-screen Surface, so no window is needed, and
+encoded to PNG on a pool of worker processes. Simulation and drawing carry
+on while earlier frames are encoded, and nothing waits on a 30 FPS clock,
+so a run exports far faster than it plays.
+
+Run as a script to export the simulator's default particle:
+    python frame_export.py <directory>
+
+Classes:
+FrameExporter -- encodes Surfaces to numbered PNG files on a process pool
+
+Methods:
+export_run -- export every frame of a MassSpectrometer's run
+
+Constants:
+BACKGROUND_COLOR -- color behind exported frames, as in the simulator
+FRAME_PATTERN -- default file name of each frame, formatted with its number
+MAX_PENDING -- default most frames waiting to be encoded per worker
+"""
+
+import os, sys
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pygame
+import mass_spectrometer, simulation
+
+# required initialization step
+pygame.init()
+
+BACKGROUND_COLOR = pygame.Color(38, 228, 235)
+FRAME_PATTERN = 'frame_{:05d}.png'
+MAX_PENDING = 8
+
+def _encode_frame(filename: str, pixels: bytes, size: (int, int)) -> None:
+    """Body of a worker: encode one frame's RGB pixels to a PNG file."""
+
+    pygame.image.save(pygame.image.frombytes(pixels, size, 'RGB'), filename)
+
+class FrameExporter():
+    """A class to represent a PNG sequence being encoded in the background.
+
+    Frames are copied out of their Surface when added, so the Surface can
+    be drawn over straight away. At most max_pending frames per worker
+    wait to be encoded; adding more waits for the oldest, which bounds
+    memory if drawing outpaces encoding.
+
+    Attributes:
+    directory -- directory frames are written to
+    pattern -- file name of each frame, formatted with its number
+    _executor -- ProcessPoolExecutor frames are encoded on
+    _pending -- list of futures of frames not yet known to be written
+    _max_pending -- most frames waiting to be encoded at once
+    _count -- number of frames added
+
+    Methods:
+    add -- queue a Surface to be written as the next frame
+    close -- wait for every frame to be written and stop the workers
+    get_count -- getter for _count
+    """
+
+    def __init__(self, directory: str, workers: int = None,
+                 pattern: str = FRAME_PATTERN,
+                 max_pending: int = MAX_PENDING) -> None:
+        """Initialize a FrameExporter, starting its workers.
+
+        directory -- directory frames are written to, created if needed
+        workers -- number of encoding processes, default one per CPU
+        pattern -- file name of each frame, default FRAME_PATTERN
+        max_pending -- most frames waiting per worker, default MAX_PENDING
+        """
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.pattern = pattern
+        # spawn, so workers don't inherit a display
+        self._executor = ProcessPoolExecutor(
+            workers, multiprocessing.get_context('spawn'))
+        self._pending = []
+        self._max_pending = workers * max_pending
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def add(self, surface: pygame.Surface) -> str:
+        """Queue a Surface to be written as the next frame; returns once
+        it has been copied, not once it has been written.
+
+        Returns the file name the frame will be written to
+        """
+
+        # wait for the oldest frames if too many are waiting
+        while len(self._pending) >= self._max_pending:
+            self._pending.pop(0).result()
+
+        filename = os.path.join(self.directory,
+                                self.pattern.format(self._count))
+        self._pending.append(self._executor.submit(
+            _encode_frame, filename, pygame.image.tobytes(surface, 'RGB'),
+            surface.get_size()))
+        self._count += 1
+        return filename
+
+    def close(self) -> None:
+        """Wait for every frame to be written, then stop the workers.
+
+        Raises the first error any frame was written with
+        """
+
+        try:
+            for future in self._pending:
+                future.result()
+        finally:
+            self._pending = []
+            self._executor.shutdown()
+
+    def get_count(self) -> int:
+        """Get the number of frames added."""
+
+        return self._count
+
+def export_run(mass_spec: mass_spectrometer.MassSpectrometer, directory: str,
+               max_frames: int = simulation.MAX_STEPS, ensemble=None,
+               workers: int = None) -> int:
+    """Export every frame of a run, as the simulator screen draws them.
+
+    The run goes on until its particle (or every particle of the ensemble)
+    has stopped, and the frame it stopped on is included.
+
+    mass_spec -- MassSpectrometer to run, from its current state
+    directory -- directory frames are written to, as FRAME_PATTERN files
+    max_frames -- most frames exported, default simulation.MAX_STEPS
+    ensemble -- ParticleEnsemble to run instead of the single particle,
+                default None
+    workers -- number of encoding processes, default one per CPU
+
+    Returns the number of frames exported
+    """
+
+    screen = pygame.Surface(mass_spec.get_area().size)
+
+    with FrameExporter(directory, workers) as exporter:
+        for _ in range(max_frames):
+            # erase, then draw (which also stops whatever has hit a wall)
+            screen.fill(BACKGROUND_COLOR)
+            if ensemble is None:
+                mass_spec.draw(screen)
+            else:
+                mass_spec.draw_ensemble(screen, ensemble)
+            exporter.add(screen)
+
+            if ensemble is None:
+                if mass_spec.get_particle().is_stopped():
+                    break
+                mass_spec.move()
+            else:
+                if not ensemble.get_free().any():
+                    break
+                mass_spec.move_ensemble(ensemble)
+
+    return exporter.get_count()
+
+def main() -> None:
+    """Export the simulator's default particle to the given directory."""
+
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python frame_export.py <directory>')
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        5, -1, 20, 1, 5, pygame.Rect(simulation.DEFAULT_AREA))
+    print(export_run(mass_spec, sys.argv[1]), 'frames exported')
+
+# export if running this script
+if __name__ == '__main__':
+    main()
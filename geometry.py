@@ -0,0 +1,255 @@
+"""geometry.py: for instrument geometries (walls, slits, detector plates)
+
+Geometry files are JSON, e.g.
+    {"relative": true, "cell_size": 32,
+     "obstacles": [{"name": "upper_slit", "kind": "slit",
+                    "rect": [0.3, 0.0, 0.02, 0.48]}, ...]}
+where each rect is [left, top, width, height], in pixels, or in fractions
+of the mass spectrometer's area if "relative" is true.
+
+Classes:
+Obstacle -- one named rectangle which stops particles
+Geometry -- every obstacle, indexed by a uniform grid for fast collisions
+
+Methods:
+load_geometry -- load a Geometry from a JSON file
+
+Constants:
+WALL, SLIT, DETECTOR -- kinds of obstacle
+CELL_SIZE -- default size of the collision grid's cells, in pixels
+"""
+
+import hashlib, json
+import pygame
+import numpy as np
+import charged_particle
+
+# required initialization step
+pygame.init()
+
+WALL = 'wall'
+SLIT = 'slit'
+DETECTOR = 'detector'
+
+CELL_SIZE = 32
+
+# a truncated collision box can reach this far past its particle's center
+_REACH = charged_particle.RADIUS + 1
+
+class Obstacle():
+    """A class to represent a rectangle which stops particles.
+
+    Attributes:
+    name -- name reported when a particle stops on it
+    kind -- WALL, SLIT or DETECTOR
+    rect -- Rect it takes up
+    """
+
+    def __init__(self, name: str, kind: str, rect: pygame.Rect) -> None:
+        """Initialize an Obstacle.
+
+        name -- name reported when a particle stops on it
+        kind -- WALL, SLIT or DETECTOR
+        rect -- Rect it takes up
+        """
+
+        if kind not in (WALL, SLIT, DETECTOR):
+            raise ValueError('Obstacle kind must be wall, slit or detector')
+
+        self.name = name
+        self.kind = kind
+        self.rect = pygame.Rect(rect)
+
+class Geometry():
+    """A class to represent every obstacle in an instrument.
+
+    Obstacles are binned into a uniform grid of cells, each obstacle going
+    into every cell a particle touching it could be centered in. Finding
+    what a particle hit then only checks the obstacles in its own cell, so
+    collision cost doesn't grow with the number of obstacles.
+
+    Attributes:
+    _obstacles -- tuple of Obstacles, earlier ones win ties
+    _cell_size -- size of the grid's cells, in pixels
+    _origin -- (x, y) position of the grid's top-left corner
+    _cells -- (columns, rows) of the grid
+    _cell_starts -- where each cell's obstacle indices begin in
+                    _cell_items, with a final entry for the end
+    _cell_items -- obstacle indices of every cell, one after another
+    _bounds -- (n, 4) array of each obstacle's (left, top, right, bottom)
+
+    Methods:
+    get_obstacles -- getter for _obstacles
+    get_names -- names of every obstacle, in order
+    find_collision -- first obstacle a ChargedParticle is hitting
+    find_collisions -- first obstacle each of many particles is hitting
+    get_digest -- hash of the obstacles, for caching results computed in them
+    """
+
+    def __init__(self, obstacles: list, cell_size: float = CELL_SIZE
+                 ) -> None:
+        """Initialize a Geometry.
+
+        obstacles -- list of Obstacles, earlier ones win ties
+        cell_size -- size of the grid's cells, default CELL_SIZE
+        """
+
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+        names = [obstacle.name for obstacle in obstacles]
+        if len(set(names)) != len(names):
+            raise ValueError('Obstacle names must be unique')
+
+        self._obstacles = tuple(obstacles)
+        self._cell_size = cell_size
+        self._bounds = np.array([(obstacle.rect.left, obstacle.rect.top,
+                                  obstacle.rect.right, obstacle.rect.bottom)
+                                 for obstacle in obstacles],
+                                np.float64).reshape(-1, 4)
+        self._build_grid()
+
+    def _build_grid(self) -> None:
+        """Bin every obstacle into the cells it could be hit from."""
+
+        if not self._obstacles:
+            self._origin = (0, 0)
+            self._cells = (0, 0)
+            self._cell_starts = np.zeros(1, np.int64)
+            self._cell_items = np.empty(0, np.int64)
+            return
+
+        # grow each obstacle by how far a particle's box reaches
+        reach = self._bounds + (-_REACH, -_REACH, _REACH, _REACH)
+        self._origin = (reach[:, 0].min(), reach[:, 1].min())
+        self._cells = (
+            int((reach[:, 2].max() - self._origin[0]) // self._cell_size) + 1,
+            int((reach[:, 3].max() - self._origin[1]) // self._cell_size) + 1)
+
+        cell_ids = []
+        items = []
+        for index, (left, top, right, bottom) in enumerate(reach):
+            first_x, first_y = self._cell_of(left, top)
+            last_x, last_y = self._cell_of(right, bottom)
+            columns, rows = np.meshgrid(np.arange(first_x, last_x + 1),
+                                        np.arange(first_y, last_y + 1))
+            cell_ids.append((columns * self._cells[1] + rows).ravel())
+            items.append(np.full(columns.size, index))
+
+        cell_ids = np.concatenate(cell_ids)
+        # stable, so each cell's obstacles stay in tie-breaking order
+        order = np.argsort(cell_ids, kind='stable')
+        self._cell_items = np.concatenate(items)[order]
+        self._cell_starts = np.concatenate((
+            [0], np.cumsum(np.bincount(cell_ids,
+                                       minlength=np.prod(self._cells)))))
+
+    def _cell_of(self, x, y):
+        """Get the (column, row) of the cell a position is in."""
+
+        return ((np.asarray(x) - self._origin[0]) // self._cell_size
+                ).astype(np.int64), \
+            ((np.asarray(y) - self._origin[1]) // self._cell_size
+             ).astype(np.int64)
+
+    def get_obstacles(self) -> tuple:
+        """Get every Obstacle, in order."""
+
+        return self._obstacles
+
+    def get_names(self) -> tuple:
+        """Get the name of every Obstacle, in order."""
+
+        return tuple(obstacle.name for obstacle in self._obstacles)
+
+    def get_digest(self) -> str:
+        """Get a hex SHA-256 digest of every obstacle's name, kind and Rect,
+        in order, equal for Geometries which stop particles alike."""
+
+        return hashlib.sha256(json.dumps(
+            [(obstacle.name, obstacle.kind, tuple(obstacle.rect))
+             for obstacle in self._obstacles]).encode()).hexdigest()
+
+    def find_collision(self, particle: charged_particle.ChargedParticle
+                       ) -> Obstacle:
+        """Find the first obstacle a particle is hitting.
+
+        particle -- ChargedParticle to check
+
+        Returns the Obstacle, or None if it isn't hitting anything
+        """
+
+        column, row = self._cell_of(*particle.get_pos())
+        if not (0 <= column < self._cells[0] and 0 <= row < self._cells[1]):
+            return None
+
+        cell = column * self._cells[1] + row
+        for index in self._cell_items[self._cell_starts[cell]:
+                                      self._cell_starts[cell + 1]]:
+            if particle.is_collision(self._obstacles[index].rect):
+                return self._obstacles[index]
+
+        return None
+
+    def find_collisions(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Find the first obstacle each of many particles is hitting.
+
+        Uses the same collision box as ChargedParticle.is_collision.
+
+        x, y -- arrays of particle positions
+
+        Returns an array of obstacle indices, -1 where nothing is hit
+        """
+
+        hits = np.full(len(x), len(self._obstacles), np.int64)
+
+        column, row = self._cell_of(x, y)
+        in_grid = np.flatnonzero((column >= 0) & (column < self._cells[0]) &
+                                 (row >= 0) & (row < self._cells[1]))
+        cell = column[in_grid] * self._cells[1] + row[in_grid]
+
+        # pair every particle with every obstacle in its cell
+        starts = self._cell_starts[cell]
+        counts = self._cell_starts[cell + 1] - starts
+        particles = np.repeat(in_grid, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) -
+                                                      counts, counts)
+        candidates = self._cell_items[np.repeat(starts, counts) + offsets]
+
+        # collision box is truncated towards zero, as pygame does
+        size = 2 * charged_particle.RADIUS
+        left = np.trunc(x[particles] - charged_particle.RADIUS)
+        top = np.trunc(y[particles] - charged_particle.RADIUS)
+        bounds = self._bounds[candidates]
+        hit = ((left < bounds[:, 2]) & (bounds[:, 0] < left + size) &
+               (top < bounds[:, 3]) & (bounds[:, 1] < top + size))
+
+        # earliest obstacle wins
+        np.minimum.at(hits, particles[hit], candidates[hit])
+        hits[hits == len(self._obstacles)] = -1
+        return hits
+
+def load_geometry(filename: str, area: pygame.Rect) -> Geometry:
+    """Load a Geometry from a JSON file (format in module docstring).
+
+    filename -- string with file path
+    area -- Rect the mass spectrometer takes up, for relative rects
+
+    Returns the loaded Geometry
+    """
+
+    with open(filename, encoding='utf8') as file:
+        config = json.load(file)
+
+    obstacles = []
+    for obstacle in config['obstacles']:
+        left, top, width, height = obstacle['rect']
+        if config.get('relative', False):
+            left = area.left + left * area.width
+            top = area.top + top * area.height
+            width *= area.width
+            height *= area.height
+        obstacles.append(Obstacle(obstacle['name'],
+                                  obstacle.get('kind', WALL),
+                                  pygame.Rect(left, top, width, height)))
+
+    return Geometry(obstacles, config.get('cell_size', CELL_SIZE))
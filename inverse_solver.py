@@ -0,0 +1,312 @@
+"""inverse_solver.py: for recovering mass/charge from a detector hit
+
+The simulator goes from mass and charge to where a particle lands. For
+fixed fields and launch velocity, landing position depends only on m/q and
+is monotone in it, so running the simulator over a range of m/q once gives
+a lookup table which can be interpolated backwards.
+
+Particles move in whole frames, so a hit is not quite a smooth function of
+m/q: the straight step across the detector sags from the curved path, and
+the hit jumps when the number of frames changes. Calibration samples
+between its knots can line up with (or miss) that, so the error bound kept
+for each interval takes the worst of its neighbours too, adds how far hits
+may be off from moving in whole frames, and multiplies by
+ERROR_SAFETY_FACTOR.
+
+Classes:
+MassChargeCalibration -- monotone hit position -> m/q lookup table
+
+Constants:
+CALIBRATION_POINTS -- default number of m/q values simulated
+ERROR_SAFETY_FACTOR -- factor error bounds are widened by
+"""
+
+import numpy as np
+import simulation
+
+CALIBRATION_POINTS = 256
+ERROR_SAFETY_FACTOR = 2
+
+class MassChargeCalibration():
+    """A class to represent a calibrated hit position -> m/q table.
+
+    m/q here is mass over the size of the charge; the sign of the charge is
+    fixed per calibration, since opposite charges land on opposite walls.
+
+    Attributes:
+    e_field, mag_field, initial_x_velocity -- settings calibrated for
+    charge_sign -- sign of the charge calibrated for, 1 or -1
+    _hits -- increasing detector hit y positions, the table's knots
+    _mass_to_charge -- m/q which lands at each knot
+    _errors -- bound on the m/q error of a hit inverted within each
+               interval between knots
+
+    Methods:
+    calibrate -- build a calibration by running the simulator (classmethod)
+    load -- load a saved calibration (classmethod)
+    save -- save the calibration to a .npz file
+    get_hit_range -- (min, max) detector hit y which has been calibrated
+    get_mass_to_charge_range -- (min, max) m/q which has been calibrated
+    invert -- estimate m/q for an array of detector hits
+    """
+
+    def __init__(self, hits: np.ndarray, mass_to_charge: np.ndarray,
+                 errors: np.ndarray, e_field: float, mag_field: float,
+                 initial_x_velocity: float, charge_sign: int = 1) -> None:
+        """Initialize a MassChargeCalibration from a finished table.
+
+        hits -- strictly increasing detector hit y positions
+        mass_to_charge -- m/q which lands at each hit, monotone
+        errors -- bound on the m/q error within each of the
+                  len(hits) - 1 intervals between hits
+        e_field, mag_field, initial_x_velocity -- settings calibrated for
+        charge_sign -- sign of the charge calibrated for, default 1
+        """
+
+        hits = np.asarray(hits, np.float64)
+        if len(hits) < 2:
+            raise ValueError('Calibration needs at least two points')
+        if np.any(np.diff(hits) <= 0):
+            raise ValueError('Calibration hits must be strictly increasing')
+        if len(errors) != len(hits) - 1:
+            raise ValueError('Need one error per interval between hits')
+
+        self._hits = hits
+        self._mass_to_charge = np.asarray(mass_to_charge, np.float64)
+        self._errors = np.asarray(errors, np.float64)
+        self.e_field = e_field
+        self.mag_field = mag_field
+        self.initial_x_velocity = initial_x_velocity
+        self.charge_sign = charge_sign
+
+    @classmethod
+    def calibrate(cls, e_field: float, mag_field: float,
+                  initial_x_velocity: float,
+                  mass_to_charge_range: (float, float),
+                  points: int = CALIBRATION_POINTS, charge_sign: int = 1,
+                  area: (float, float, float, float) =
+                  simulation.DEFAULT_AREA,
+                  max_steps: int = simulation.MAX_STEPS):
+        """Build a calibration by running the simulator over a range of m/q.
+
+        m/q values whose particles miss the detector are left out, so the
+        calibrated range may be narrower than the one asked for. Each
+        interval is also simulated at its midpoint, and how far the table
+        is off there, together with how far hits may be off from moving in
+        whole frames, gives that interval's error bound.
+
+        e_field -- electric field strength, positive is down
+        mag_field -- magnetic field strength, positive is out of page
+        initial_x_velocity -- x velocity of particles at launch
+        mass_to_charge_range -- (min, max) m/q to calibrate over
+        points -- number of m/q values simulated, default CALIBRATION_POINTS
+        charge_sign -- sign of the charge to calibrate for, default 1
+        area -- (left, top, width, height) the mass spectrometer takes up
+        max_steps -- number of frames before a run is given up on
+
+        Returns a MassChargeCalibration
+        """
+
+        if charge_sign not in (1, -1):
+            raise ValueError('Charge sign must be 1 or -1')
+        if not 0 < mass_to_charge_range[0] < mass_to_charge_range[1]:
+            raise ValueError('m/q range must be positive and increasing')
+
+        # knots are at even indices, interval midpoints at odd ones
+        mass_to_charge = np.linspace(*mass_to_charge_range, 2 * points - 1)
+        hits, sags = np.array([_run_hit(e_field, mag_field, value,
+                                        charge_sign, initial_x_velocity,
+                                        area, max_steps)
+                               for value in mass_to_charge]).T
+
+        knots = _monotone_knots(hits[::2])
+        if len(knots) < 2:
+            raise ValueError('Too few particles in the m/q range land on '
+                             'the detector')
+
+        knot_hits = hits[::2][knots]
+        knot_values = mass_to_charge[::2][knots]
+        errors = np.zeros(len(knots) - 1)
+        slopes = np.abs(np.diff(knot_values) / np.diff(knot_hits))
+
+        for i in range(len(knots) - 1):
+            mid_value = mass_to_charge[2 * knots[i] + 1]
+            mid_hit = hits[2 * knots[i] + 1]
+            between = (min(knot_hits[i], knot_hits[i + 1]) <= mid_hit <=
+                       max(knot_hits[i], knot_hits[i + 1]))
+
+            if between:
+                estimate = knot_values[i] + (
+                    (mid_hit - knot_hits[i]) *
+                    (knot_values[i + 1] - knot_values[i]) /
+                    (knot_hits[i + 1] - knot_hits[i]))
+                errors[i] = abs(estimate - mid_value)
+            else:
+                # midpoint missed or landed outside, so all that is known
+                # is that the answer is somewhere in the interval
+                errors[i] = abs(knot_values[i + 1] - knot_values[i])
+
+        # knots are consecutive, so samples 2i to 2i + 2 of the run are
+        # interval i's knots and midpoint
+        run = hits[2 * knots[0]:2 * knots[-1] + 1]
+        # how far each sample is off its neighbours' mean shows the jumps
+        # between numbers of frames
+        jumps = np.zeros(len(run))
+        jumps[1:-1] = np.nan_to_num(np.abs(run[1:-1] -
+                                           (run[:-2] + run[2:]) / 2))
+        jitter = np.maximum(sags[2 * knots[0]:2 * knots[-1] + 1], jumps)
+        jitter = np.maximum(np.maximum(jitter[:-2:2], jitter[1:-1:2]),
+                            jitter[2::2])
+
+        # a hit and the knots it is interpolated between may each be off by
+        # the jitter, and the midpoints only sample the table's error, so
+        # take the worst of each interval and its neighbours
+        errors = ERROR_SAFETY_FACTOR * (
+            _with_neighbours(errors) +
+            2 * _with_neighbours(slopes) * _with_neighbours(jitter))
+
+        # table is stored with hits increasing
+        if knot_hits[0] > knot_hits[-1]:
+            knot_hits = knot_hits[::-1]
+            knot_values = knot_values[::-1]
+            errors = errors[::-1]
+
+        return cls(knot_hits, knot_values, errors, e_field, mag_field,
+                   initial_x_velocity, charge_sign)
+
+    @classmethod
+    def load(cls, filename: str):
+        """Load a calibration saved with save.
+
+        filename -- path of the .npz file
+
+        Returns a MassChargeCalibration
+        """
+
+        with np.load(filename) as data:
+            return cls(data['hits'], data['mass_to_charge'], data['errors'],
+                       *(float(value) for value in data['settings'][:3]),
+                       int(data['settings'][3]))
+
+    def save(self, filename: str) -> None:
+        """Save the calibration to a .npz file.
+
+        filename -- path of the .npz file
+        """
+
+        np.savez(filename, hits=self._hits,
+                 mass_to_charge=self._mass_to_charge, errors=self._errors,
+                 settings=np.array([self.e_field, self.mag_field,
+                                    self.initial_x_velocity,
+                                    self.charge_sign], np.float64))
+
+    def get_hit_range(self) -> (float, float):
+        """Get the (min, max) detector hit y which has been calibrated."""
+
+        return self._hits[0], self._hits[-1]
+
+    def get_mass_to_charge_range(self) -> (float, float):
+        """Get the (min, max) m/q which has been calibrated."""
+
+        return self._mass_to_charge.min(), self._mass_to_charge.max()
+
+    def invert(self, hit_y, hit_error: float = 0
+               ) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Estimate m/q for an array of detector hits.
+
+        hit_y -- detector hit y positions, any shape
+        hit_error -- uncertainty of the hit positions themselves, default 0
+                     carried through to m/q using the table's slope
+
+        Returns (m/q, error bound, in range) arrays of hit_y's shape
+        m/q and error are NaN where the hit is outside the calibrated range
+        """
+
+        hit_y = np.asarray(hit_y, np.float64)
+        in_range = (hit_y >= self._hits[0]) & (hit_y <= self._hits[-1])
+
+        # interval each hit falls in, clipped so out of range hits still
+        # index safely (they are blanked out afterwards)
+        interval = np.clip(np.searchsorted(self._hits, hit_y, 'right') - 1,
+                           0, len(self._hits) - 2)
+
+        left_hit = self._hits[interval]
+        slope = ((self._mass_to_charge[interval + 1] -
+                  self._mass_to_charge[interval]) /
+                 (self._hits[interval + 1] - left_hit))
+
+        mass_to_charge = (self._mass_to_charge[interval] +
+                          slope * (hit_y - left_hit))
+        error = self._errors[interval] + np.abs(slope) * hit_error
+
+        mass_to_charge[~in_range] = np.nan
+        error[~in_range] = np.nan
+
+        return mass_to_charge, error, in_range
+
+def _run_hit(e_field: float, mag_field: float, mass_to_charge: float,
+             charge_sign: int, initial_x_velocity: float,
+             area: (float, float, float, float), max_steps: int
+             ) -> (float, float):
+    """Run one particle, returning (detector hit y, how far the hit may be
+    off a smooth path from the last step being straight), or (NaN, 0) if
+    it missed."""
+
+    # the motion only depends on m/q, so a charge of +-1 stands in for all
+    trajectory = simulation.run_trajectory(
+        e_field, mag_field, mass_to_charge, charge_sign, initial_x_velocity,
+        area, max_steps, record=True)
+    if trajectory.hit_y is None:
+        return np.nan, 0.0
+    if len(trajectory.points) < 3:
+        return trajectory.hit_y, 0.0
+
+    # a straight step sags from the curved path by up to an eighth of its
+    # change in velocity, which is stretched along the detector by how
+    # slanted the step is
+    before, prev, last = np.asarray(trajectory.points[-3:])
+    step = last - prev
+    if step[0] == 0:
+        return trajectory.hit_y, 0.0
+    sag = (np.hypot(*(step - (prev - before))) / 8 *
+           np.hypot(*step) / abs(step[0]))
+    return trajectory.hit_y, sag
+
+def _with_neighbours(values: np.ndarray) -> np.ndarray:
+    """Get the largest of each value and the ones either side of it."""
+
+    padded = np.pad(values, 1, mode='edge')
+    return np.maximum(np.maximum(padded[:-2], padded[1:-1]), padded[2:])
+
+def _monotone_knots(hits: np.ndarray) -> np.ndarray:
+    """Pick out the longest strictly monotone run of detector hits.
+
+    hits -- detector hit y per m/q value, NaN where the detector was missed
+
+    Returns indices of the chosen hits, in m/q order
+    """
+
+    best = np.empty(0, np.int64)
+    start = 0
+
+    while start < len(hits):
+        if np.isnan(hits[start]):
+            start += 1
+            continue
+
+        # grow a strictly monotone run in whichever direction it starts in
+        end = start + 1
+        direction = 0
+        while end < len(hits) and not np.isnan(hits[end]):
+            step = np.sign(hits[end] - hits[end - 1])
+            if step == 0 or (direction and step != direction):
+                break
+            direction = step
+            end += 1
+
+        if end - start > len(best):
+            best = np.arange(start, end)
+        # a run which turned around may share its last hit with the next
+        start = end - 1 if end > start + 1 else start + 1
+
+    return best
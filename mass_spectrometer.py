@@ -6,10 +6,14 @@ MassSpectromter -- representing a mass spectrometer
 Constants:
 WALL_THICKNESS -- thickness of walls, in pixels
 WALL_COLOR -- color of walls
+WALL_NAMES -- names of the walls, in the order they are generated
+TOP_EDGE, BOTTOM_EDGE -- names of the top and bottom edges of the area
+MAX_STEP_DISTANCE -- furthest a particle may go in one adaptive step
 """
 
 import pygame
-import charged_particle
+import numpy as np
+import charged_particle, particle_ensemble, particle_renderer, geometry
 
 # required initialization step
 pygame.init()
@@ -17,31 +21,62 @@ pygame.init()
 # wall constants
 WALL_THICKNESS = 10
 WALL_COLOR = pygame.Color(148, 134, 106)
+WALL_NAMES = ('upper_horizontal', 'lower_horizontal',
+              'upper_vertical', 'lower_vertical')
+
+# an adaptive step shorter than a wall plus a particle can't skip past one
+MAX_STEP_DISTANCE = WALL_THICKNESS + 2 * charged_particle.RADIUS - 1
+
+# names of the area's edges, for reporting what stopped a particle
+TOP_EDGE = 'top_edge'
+BOTTOM_EDGE = 'bottom_edge'
 
 class MassSpectrometer():
     """A class to represent a mass spectrometer.
 
     Attributes:
-    e_field -- electric field strength, positive is down
-    mag_field -- magnetic field strength, positive is out of page
+    e_field -- electric field strength, positive is down; when moving
+               ensembles, may be an array with one per particle
+    mag_field -- magnetic field strength, positive is out of page; likewise
+    tolerance -- per-step position error allowed when moving adaptively,
+                 or None to move one whole frame at a time
+    field_map -- FieldMap to take fields from instead of e_field and
+                 mag_field, or None for the usual uniform layout
     _mass -- mass of charged particle
     _charge -- charge of charged particle
     _initial_x_velocity -- x velocity of charged particles at launch
     _area -- rectangular area that mass spectrometer takes up
     _particle -- current charged particle in mass spectrometer
+    _geometry -- Geometry of the walls, slits and detector plates
     _walls -- list of Rects which are the walls of the mass spectrometer
+    _renderer -- ParticleRenderer ensembles are drawn with
 
     Methods:
-    move -- move particle a frame
+    move -- move particle a frame, or an adaptive step
+    check_collisions -- stops the particle if it has hit something
     draw -- draws the mass spectrometer on a Surface
+    draw_ensemble -- draws the mass spectrometer with an ensemble's particles
     reset_particle -- reset the charged particle back to start
     set_mass -- sets _mass to a new value
     set_charge -- sets _charge to a new value
     set_initial_x_velocity -- sets initial x velocity to a new value
+    get_particle -- getter for _particle
+    get_area -- getter for _area
+    get_geometry -- getter for _geometry
+    get_detector_names -- names of the detector plates
+    get_detector_x -- x a particle is at when it lands on the detector
+    get_start_pos -- (x, y) position particles are launched from
+    get_slit_exit_x -- x past which a particle has left the straight section
+    get_stop_reasons -- names of everything that can stop a particle
+    launch_ensemble -- create a ParticleEnsemble at the start position
+    move_ensemble -- move every particle of an ensemble a frame
+    check_ensemble_collisions -- stop ensemble particles which hit something
     """
 
     def __init__(self, e_field: int, mag_field: int, mass: int, charge: int,
-                 initial_x_velocity: int, area: pygame.Rect):
+                 initial_x_velocity: int, area: pygame.Rect,
+                 tolerance: float = None, field_map=None,
+                 instrument: geometry.Geometry = None):
         """Initialize a MassSpectrometer.
 
         e_field -- electric field strength, positive is down
@@ -50,10 +85,19 @@ class MassSpectrometer():
         charge -- charge of charged particle
         initial_x_velocity -- x velocity of charged particles at launch
         area -- rectangular area that mass spectrometer takes up
+        tolerance -- per-step position error allowed, in pixels, to move
+                     with adaptive time steps; default None moves one
+                     frame at a time
+        field_map -- FieldMap of non-uniform fields to use instead of
+                     e_field and mag_field, default None
+        instrument -- Geometry of walls, slits and detector plates, default
+                      None for the usual four walls
         """
 
         self.e_field = e_field
         self.mag_field = mag_field
+        self.tolerance = tolerance
+        self.field_map = field_map
 
         # save information about particle
         self._mass = mass
@@ -64,7 +108,28 @@ class MassSpectrometer():
 
         # generate new particle
         self.reset_particle()
-        self._walls = self._generate_walls(area)
+        if instrument is None:
+            instrument = self._generate_geometry(area)
+        self._geometry = instrument
+        self._walls = tuple(obstacle.rect
+                            for obstacle in instrument.get_obstacles())
+        self._renderer = particle_renderer.ParticleRenderer()
+
+    def _generate_geometry(self, area: pygame.Rect) -> geometry.Geometry:
+        """Create the usual geometry out of properly-placed walls.
+
+        The vertical walls are where particles land, so are the detector.
+
+        area -- rectangular area that the mass spectrometer may take up
+
+        Returns a Geometry, obstacles named as in WALL_NAMES
+        """
+
+        kinds = (geometry.WALL, geometry.WALL,
+                 geometry.DETECTOR, geometry.DETECTOR)
+        return geometry.Geometry(
+            [geometry.Obstacle(name, kind, wall) for name, kind, wall
+             in zip(WALL_NAMES, kinds, self._generate_walls(area))])
 
     def _generate_walls(self, area: pygame.Rect) -> (pygame.Rect, pygame.Rect,
                                                      pygame.Rect, pygame.Rect):
@@ -95,15 +160,53 @@ class MassSpectrometer():
         return (upper_horizontal, lower_horizontal,
                 upper_vertical, lower_vertical)
 
-    def move(self):
-        """Move particle one frame."""
-        
+    def move(self) -> float:
+        """Move particle one frame, or one adaptive step if tolerance is set.
+
+        Returns the time moved, in frames
+        """
+
+        if self.tolerance is not None:
+            return self._particle.move_adaptive(
+                self._fields_at, self.tolerance, MAX_STEP_DISTANCE)
+
+        self._particle.move(*self._fields_at(self._particle.get_pos()))
+        return 1
+
+    def _fields_at(self, pos: (float, float)) -> (int, int, int):
+        """Get the (e_field, mag_field, e_field_x) strengths at a position."""
+
+        if self.field_map is not None:
+            return self.field_map.sample_point(pos)
+
         # electric field only works in first half (horizontal section)
-        if (self._particle.get_pos()[0] >
-            self._area.left + (self._area.width / 2)):
-            self._particle.move(0, self.mag_field)
-        else:
-            self._particle.move(self.e_field, self.mag_field)
+        if pos[0] > self._area.left + (self._area.width / 2):
+            return 0, self.mag_field, 0
+        return self.e_field, self.mag_field, 0
+
+    def check_collisions(self) -> str:
+        """Stop the particle if it has hit a wall or left the area.
+
+        Returns the name of what was hit (an obstacle's name, TOP_EDGE or
+        BOTTOM_EDGE), or None if the particle is still free
+        """
+
+        # particle stops if it hits a wall
+        obstacle = self._geometry.find_collision(self._particle)
+        if obstacle is not None:
+            self._particle.stop()
+            return obstacle.name
+
+        # particle stops if it hits the top or bottom edge
+        particle_y = self._particle.get_pos()[1]
+        if particle_y < self._area.top:
+            self._particle.stop()
+            return TOP_EDGE
+        if particle_y > self._area.top + self._area.height:
+            self._particle.stop()
+            return BOTTOM_EDGE
+
+        return None
 
     def draw(self, screen: pygame.Surface):
         """Draw mass spectrometer onto a given Surface."""
@@ -114,22 +217,29 @@ class MassSpectrometer():
         # draw each wall
         for wall in self._walls:
             pygame.draw.rect(screen, WALL_COLOR, wall)
-            # particle stops if it hits a wall
-            if self._particle.is_collision(wall):
-                self._particle.stop()
 
-        # particle stops if it hits the top or bottom edge
-        particle_y = self._particle.get_pos()[1]
-        if (particle_y < self._area.top or
-            particle_y > self._area.top + self._area.height):
-            self._particle.stop()
+        self.check_collisions()
+
+    def draw_ensemble(self, screen: pygame.Surface,
+                      ensemble: particle_ensemble.ParticleEnsemble):
+        """Draw mass spectrometer onto a given Surface, with every
+        particle of an ensemble in place of its own particle."""
+
+        # draw every particle in one batch
+        self._renderer.draw_ensemble(screen, ensemble)
+
+        # draw each wall
+        for wall in self._walls:
+            pygame.draw.rect(screen, WALL_COLOR, wall)
+
+        self.check_ensemble_collisions(ensemble)
 
     def reset_particle(self):
         """Reset particle back to start position."""
         
         self._particle = charged_particle.ChargedParticle(
             self._mass, self._charge, self._initial_x_velocity,
-            (charged_particle.RADIUS, self._area.height / 2))
+            self.get_start_pos())
 
     def set_mass(self, new_mass: int):
         """Update mass."""
@@ -152,3 +262,132 @@ class MassSpectrometer():
             self._initial_x_velocity = new_initial_x_velocity
         else:
             raise ValueError("Initial x velocity must be positive")
+
+    def get_particle(self) -> charged_particle.ChargedParticle:
+        """Get the current charged particle."""
+
+        return self._particle
+
+    def get_area(self) -> pygame.Rect:
+        """Get the rectangular area the mass spectrometer takes up."""
+
+        return self._area
+
+    def get_geometry(self) -> geometry.Geometry:
+        """Get the Geometry of walls, slits and detector plates."""
+
+        return self._geometry
+
+    def get_detector_names(self) -> tuple:
+        """Get the names of every detector plate."""
+
+        return tuple(obstacle.name
+                     for obstacle in self._geometry.get_obstacles()
+                     if obstacle.kind == geometry.DETECTOR)
+
+    def get_detector_x(self, name: str = None) -> float:
+        """Get the x position a particle is at when it lands on the detector.
+
+        The detector is the right-hand face of a detector plate (normally
+        the vertical walls), which particles reach after curving around in
+        the magnetic-only half.
+
+        name -- name of the detector plate, default None for the first one
+        """
+
+        for obstacle in self._geometry.get_obstacles():
+            if (obstacle.kind == geometry.DETECTOR and
+                name in (None, obstacle.name)):
+                return obstacle.rect.right + charged_particle.RADIUS
+
+        raise ValueError('No such detector plate')
+
+    def get_start_pos(self) -> (float, float):
+        """Get the (x, y) position particles are launched from."""
+
+        return (charged_particle.RADIUS, self._area.height / 2)
+
+    def get_slit_exit_x(self) -> float:
+        """Get the x past which a particle has left the straight section."""
+
+        return self._area.left + (self._area.width / 2)
+
+    def get_stop_reasons(self) -> tuple:
+        """Get the names of everything that can stop a particle.
+
+        An ensemble's stop reason codes are indices into this tuple.
+        """
+
+        return self._geometry.get_names() + (TOP_EDGE, BOTTOM_EDGE)
+
+    def launch_ensemble(self, mass, charge, initial_x_velocity, y_offset=0,
+                        initial_y_velocity=0
+                        ) -> particle_ensemble.ParticleEnsemble:
+        """Create a ParticleEnsemble at the start position.
+
+        Every argument is an array or a single value shared by every
+        particle, as for ParticleEnsemble.
+
+        mass -- masses of the particles
+        charge -- charges of the particles
+        initial_x_velocity -- x velocities of the particles at launch
+        y_offset -- offsets from the start position's y, default 0
+        initial_y_velocity -- y velocities of the particles at launch,
+                              default 0 as for a single particle
+
+        Returns the new ParticleEnsemble
+        """
+
+        start_x, start_y = self.get_start_pos()
+        return particle_ensemble.ParticleEnsemble(
+            mass, charge, start_x, np.add(start_y, y_offset),
+            initial_x_velocity, initial_y_velocity)
+
+    def move_ensemble(self, ensemble: particle_ensemble.ParticleEnsemble,
+                      space_charge=None) -> None:
+        """Move every free particle of an ensemble one frame.
+
+        ensemble -- ParticleEnsemble to move
+        space_charge -- optional SpaceCharge for forces between the free
+                        particles, default None for no interaction
+        """
+
+        if self.field_map is not None:
+            # one gather for every particle's fields
+            e_field, mag_field, e_field_x = self.field_map.sample(
+                ensemble.x, ensemble.y)
+        else:
+            # electric field only works in first half (horizontal section)
+            e_field = np.where(
+                ensemble.x > self._area.left + (self._area.width / 2),
+                0, self.e_field)
+            mag_field, e_field_x = self.mag_field, 0
+
+        extra_force = None
+        if space_charge is not None:
+            free = ensemble.get_free()
+            extra_force = (np.zeros(len(ensemble)), np.zeros(len(ensemble)))
+            extra_force[0][free], extra_force[1][free] = space_charge.forces(
+                ensemble.x[free], ensemble.y[free], ensemble.charge[free])
+
+        ensemble.move(e_field, mag_field, extra_force, e_field_x)
+
+    def check_ensemble_collisions(
+            self, ensemble: particle_ensemble.ParticleEnsemble) -> None:
+        """Stop ensemble particles which hit a wall or left the area.
+
+        Stop reasons are recorded as indices into get_stop_reasons().
+
+        ensemble -- ParticleEnsemble to check
+        """
+
+        # obstacle indices are also their stop reason codes
+        free = np.flatnonzero(ensemble.get_free())
+        hits = self._geometry.find_collisions(ensemble.x[free],
+                                              ensemble.y[free])
+        ensemble.stop(free[hits >= 0], hits[hits >= 0])
+
+        reasons = self.get_stop_reasons()
+        ensemble.stop(ensemble.y < self._area.top, reasons.index(TOP_EDGE))
+        ensemble.stop(ensemble.y > self._area.top + self._area.height,
+                      reasons.index(BOTTOM_EDGE))
@@ -0,0 +1,136 @@
+"""particle_ensemble.py: for a ParticleEnsemble class
+
+Classes:
+ParticleEnsemble -- many charged particles, moved together as arrays
+
+Constants:
+FREE -- stop reason code of a particle which has not stopped
+"""
+
+import numpy as np
+
+# stop reason codes index into the stopping MassSpectrometer's reasons
+FREE = -1
+
+class ParticleEnsemble():
+    """A class to represent many charged particles at once.
+
+    Moves exactly like ChargedParticle.move does, but for every particle in
+    one go, so large numbers of particles cost a few array operations per
+    frame rather than a Python call each.
+
+    Attributes:
+    mass -- array of particle masses
+    charge -- array of particle charges
+    x, y -- arrays of particle positions
+    v_x, v_y -- arrays of particle velocities
+    stop_reason -- array of stop reason codes, FREE if still moving
+    steps -- array of the number of frames each particle has moved for
+
+    Methods:
+    move -- moves & accelerates every free particle one frame
+    stop -- stops some particles, recording why
+    get_free -- mask of particles which are still moving
+    take -- a new ParticleEnsemble of some of the particles
+    __len__ -- number of particles
+    """
+
+    def __init__(self, mass, charge, x, y, v_x, v_y=0) -> None:
+        """Initialize a ParticleEnsemble.
+
+        Every argument is an array or a single value shared by every
+        particle; they are broadcast together.
+
+        mass -- masses of the particles, must be positive
+        charge -- charges of the particles
+        x, y -- initial positions of the particles
+        v_x, v_y -- initial velocities of the particles, v_y default 0
+        """
+
+        arrays = np.broadcast_arrays(*(np.asarray(value, np.float64)
+                                       for value in (mass, charge, x, y,
+                                                     v_x, v_y)))
+        # copy, so particles don't share memory with broadcast inputs
+        self.mass, self.charge, self.x, self.y, self.v_x, self.v_y = \
+            (np.array(array, ndmin=1) for array in arrays)
+
+        if np.any(self.mass <= 0):
+            raise ValueError("Mass must be positive")
+
+        self.stop_reason = np.full(len(self.mass), FREE, np.int16)
+        self.steps = np.zeros(len(self.mass), np.int64)
+
+    def __len__(self) -> int:
+        """Get the number of particles."""
+
+        return len(self.mass)
+
+    def get_free(self) -> np.ndarray:
+        """Get a mask of the particles which are still moving."""
+
+        return self.stop_reason == FREE
+
+    def take(self, mask: np.ndarray):
+        """Make a new ParticleEnsemble of some of the particles.
+
+        mask -- mask or indices of the particles to take
+
+        Returns the new ParticleEnsemble, sharing no memory with this one
+        """
+
+        taken = ParticleEnsemble.__new__(ParticleEnsemble)
+        for name in ('mass', 'charge', 'x', 'y', 'v_x', 'v_y',
+                     'stop_reason', 'steps'):
+            setattr(taken, name, getattr(self, name)[mask].copy())
+        return taken
+
+    def stop(self, mask: np.ndarray, reason: int) -> None:
+        """Stop particles which are still moving (irreversible).
+
+        mask -- mask or indices of the particles to stop
+        reason -- stop reason code to record, or an array of codes with
+                  one per particle to stop, in index order
+        """
+
+        selected = np.zeros(len(self), bool)
+        selected[mask] = True
+        self.stop_reason[selected & self.get_free()] = reason
+
+    def move(self, e_field, mag_field, extra_force=None,
+             e_field_x=0) -> None:
+        """Move and accelerate every free particle one frame's worth.
+
+        e_field -- electric field strength, positive is down; one value,
+                   or an array with one per particle
+        mag_field -- magnetic field strength, positive is out of page; one
+                     value, or an array with one per particle
+        extra_force -- optional (f_x, f_y) arrays of any other force on
+                       each particle, e.g. from space charge
+        e_field_x -- sideways electric field strength, positive is right;
+                     one value or an array, default 0
+        """
+
+        free = self.get_free()
+        v_x = self.v_x[free]
+        v_y = self.v_y[free]
+        charge = self.charge[free]
+
+        # move with current velocity
+        self.x[free] += v_x
+        self.y[free] += v_y
+
+        e_field = np.broadcast_to(e_field, free.shape)[free]
+        mag_field = np.broadcast_to(mag_field, free.shape)[free]
+        e_field_x = np.broadcast_to(e_field_x, free.shape)[free]
+
+        # F_E = qE, F_M = qvB perpendicular to velocity (in components)
+        force_x = charge * (e_field_x - mag_field * v_y)
+        force_y = charge * (e_field + mag_field * v_x)
+        if extra_force is not None:
+            force_x += extra_force[0][free]
+            force_y += extra_force[1][free]
+
+        # Newton's Second Law, a = F/m
+        self.v_x[free] += force_x / self.mass[free]
+        self.v_y[free] += force_y / self.mass[free]
+        self.steps[free] += 1
@@ -0,0 +1,94 @@
+"""particle_renderer.py: for a ParticleRenderer class
+
+Classes:
+ParticleRenderer -- draws a whole array of particles in one pass
+"""
+
+import pygame
+import numpy as np
+import charged_particle, particle_ensemble
+
+# required initialization step
+pygame.init()
+
+# transparent color of sprites, which no particle is drawn in
+_COLOR_KEY = pygame.Color(255, 0, 255)
+
+class ParticleRenderer():
+    """A class to represent a batched drawer of many particles.
+
+    Each charge color's particle is drawn once onto a color-keyed,
+    run-length encoded sprite, and every particle is then a copy of its
+    sprite, all handed to Surface.blits in a single call instead of a
+    pygame.draw.circle call each.
+
+    Attributes:
+    _sprites -- sprites for negative, neutral & positive particles, in order
+    _converted -- whether sprites have been converted to the display format
+
+    Methods:
+    draw -- draws particles at arrays of positions onto a Surface
+    draw_ensemble -- draws a ParticleEnsemble onto a Surface
+    """
+
+    def __init__(self) -> None:
+        """Initialize a ParticleRenderer."""
+
+        size = 2 * charged_particle.RADIUS + 1
+        self._sprites = []
+        for color in (charged_particle.NEGATIVE_COLOR,
+                      charged_particle.NEUTRAL_COLOR,
+                      charged_particle.POSITIVE_COLOR):
+            sprite = pygame.Surface((size, size))
+            sprite.fill(_COLOR_KEY)
+            pygame.draw.circle(sprite, color, (charged_particle.RADIUS,
+                                               charged_particle.RADIUS),
+                               charged_particle.RADIUS)
+            sprite.set_colorkey(_COLOR_KEY, pygame.RLEACCEL)
+            self._sprites.append(sprite)
+        self._converted = False
+
+    def _convert_sprites(self) -> None:
+        """Convert sprites to the display's format, for faster blitting."""
+
+        # converting needs a display, which may not exist yet at init
+        if not self._converted and pygame.display.get_surface() is not None:
+            self._sprites = [sprite.convert() for sprite in self._sprites]
+            # converting can drop RLE acceleration, so set the colorkey after
+            for sprite in self._sprites:
+                sprite.set_colorkey(_COLOR_KEY, pygame.RLEACCEL)
+            self._converted = True
+
+    def draw(self, screen: pygame.Surface, x: np.ndarray, y: np.ndarray,
+             charge: np.ndarray) -> None:
+        """Draw particles onto a given Surface.
+
+        x, y -- arrays of particle centers
+        charge -- array of particle charges, which pick their colors
+        """
+
+        self._convert_sprites()
+
+        # sign is -1, 0 or 1, so shifting it indexes the sprites
+        sprites = np.sign(charge).astype(np.int64) + 1
+        left = (np.asarray(x) - charged_particle.RADIUS).astype(np.int64)
+        top = (np.asarray(y) - charged_particle.RADIUS).astype(np.int64)
+
+        screen.blits(zip(map(self._sprites.__getitem__, sprites.tolist()),
+                         zip(left.tolist(), top.tolist())),
+                     doreturn=False)
+
+    def draw_ensemble(self, screen: pygame.Surface,
+                      ensemble: particle_ensemble.ParticleEnsemble,
+                      free_only: bool = False) -> None:
+        """Draw every particle of a ParticleEnsemble onto a given Surface.
+
+        free_only -- whether to skip stopped particles, default False
+        """
+
+        if free_only:
+            free = ensemble.get_free()
+            self.draw(screen, ensemble.x[free], ensemble.y[free],
+                      ensemble.charge[free])
+        else:
+            self.draw(screen, ensemble.x, ensemble.y, ensemble.charge)
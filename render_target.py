@@ -0,0 +1,154 @@
+"""render_target.py: for drawing at a fixed resolution in a resizable window
+
+Everything is drawn onto a canvas at the internal resolution, in the same
+coordinates whatever the window's size, so Buttons, Sliders and Texts are
+never rebuilt when the window is resized; the canvas is scaled to the
+window once per frame, keeping its aspect ratio, with bars either side.
+Drawing costs the same in a large window as a small one: only the one
+scale grows with the window.
+
+Where it can, SDL does the scaling on the graphics card (pygame.SCALED),
+and maps mouse positions back to the canvas itself. Otherwise the canvas
+is an off-screen Surface, scaled into the window in software.
+
+Classes:
+RenderTarget -- a canvas scaled to fit a resizable window
+
+Constants:
+BORDER_COLOR -- default color of the bars beside the scaled canvas
+"""
+
+import pygame
+
+# required initialization step
+pygame.init()
+
+BORDER_COLOR = pygame.Color(0, 0, 0)
+
+class RenderTarget():
+    """A class to represent a canvas shown scaled in a resizable window.
+
+    Attributes:
+    canvas -- Surface everything is drawn onto, of the internal resolution
+    window -- the display Surface
+    smooth -- whether software scaling is filtered (slower) rather than
+              nearest-neighbour
+    border_color -- color of the bars beside the scaled canvas
+    _hardware -- whether SDL scales the canvas itself
+    _viewport -- Rect of the window the canvas is shown in
+    _view -- subsurface of the window covering _viewport
+
+    Methods:
+    resize -- fit the canvas to the window's new size
+    present -- show the canvas in the window
+    to_canvas -- map a window position to canvas coordinates
+    get_mouse_pos -- the mouse position in canvas coordinates
+    get_viewport -- getter for _viewport
+    is_hardware -- getter for _hardware
+    """
+
+    def __init__(self, internal_size: (int, int),
+                 window_size: (int, int) = None, hardware: bool = True,
+                 smooth: bool = False,
+                 border_color: pygame.Color = BORDER_COLOR) -> None:
+        """Initialize a RenderTarget, opening its window.
+
+        internal_size -- (width, height) everything is drawn at
+        window_size -- (width, height) of the window in software scaling,
+                       default internal_size
+        hardware -- whether to let SDL scale on the graphics card where it
+                    can, default True
+        smooth -- whether software scaling is filtered, default False
+        border_color -- color of the bars, default BORDER_COLOR
+        """
+
+        self.smooth = smooth
+        self.border_color = border_color
+        self._hardware = False
+
+        if hardware:
+            try:
+                self.window = pygame.display.set_mode(
+                    internal_size, pygame.SCALED | pygame.RESIZABLE)
+                self._hardware = True
+            except pygame.error:
+                # no renderer to scale with, so scale in software
+                pass
+
+        if self._hardware:
+            self.canvas = self.window
+        else:
+            self.window = pygame.display.set_mode(
+                window_size or internal_size, pygame.RESIZABLE)
+            self.canvas = pygame.Surface(internal_size).convert()
+        self.resize()
+
+    def resize(self) -> None:
+        """Fit the canvas to the window's current size, after it has been
+        resized (a pygame.VIDEORESIZE event)."""
+
+        if self._hardware:
+            self._viewport = self.canvas.get_rect()
+            return
+
+        self.window = pygame.display.get_surface()
+        window_width, window_height = self.window.get_size()
+        width, height = self.canvas.get_size()
+        scale = min(window_width / width, window_height / height)
+
+        self._viewport = pygame.Rect(0, 0, max(1, round(width * scale)),
+                                     max(1, round(height * scale)))
+        self._viewport.center = self.window.get_rect().center
+        self._view = self.window.subsurface(
+            self._viewport.clip(self.window.get_rect()))
+
+        # the bars are never drawn over, so only need filling once
+        self.window.fill(self.border_color)
+
+    def present(self) -> None:
+        """Show the canvas in the window, scaled to fit."""
+
+        if not self._hardware:
+            if self._view.get_size() == self.canvas.get_size():
+                self._view.blit(self.canvas, (0, 0))
+            elif self.smooth:
+                pygame.transform.smoothscale(
+                    self.canvas, self._view.get_size(), self._view)
+            else:
+                # straight into the window, so no Surface is allocated
+                pygame.transform.scale(self.canvas, self._view.get_size(),
+                                       self._view)
+        pygame.display.flip()
+
+    def to_canvas(self, pos: (int, int)) -> (int, int):
+        """Map a position in the window to canvas coordinates.
+
+        pos -- (x, y) in the window, e.g. of a mouse event
+
+        Returns (x, y) on the canvas, which may be off the canvas if pos
+        was on a bar
+        """
+
+        if self._hardware:
+            # SDL already maps positions to the canvas
+            return pos
+
+        width, height = self.canvas.get_size()
+        return ((pos[0] - self._viewport.x) * width // self._viewport.width,
+                (pos[1] - self._viewport.y) * height
+                // self._viewport.height)
+
+    def get_mouse_pos(self) -> (int, int):
+        """Get the mouse position in canvas coordinates."""
+
+        return self.to_canvas(pygame.mouse.get_pos())
+
+    def get_viewport(self) -> pygame.Rect:
+        """Getter for the Rect of the window the canvas is shown in."""
+
+        return self._viewport
+
+    def is_hardware(self) -> bool:
+        """Getter for whether SDL scales the canvas itself."""
+
+        return self._hardware
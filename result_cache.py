@@ -0,0 +1,332 @@
+"""result_cache.py: for a persistent cache of simulation results
+
+Every run is keyed by a SHA-256 hash of everything that decides its result:
+its parameters, the area, the walls, the fields, the integrator and its
+step size, the step limit and simulation.CODE_VERSION. So an overlapping
+sweep only computes the runs it hasn't done before, and a change to any
+of those (e.g. new physics, with CODE_VERSION bumped) never reuses a stale
+result.
+
+Directory layout:
+<first two hex digits of key>/<key>.npz -- one entry per run, holding its
+                                           Trajectory
+
+Entries are written to a temporary file beside the real one and renamed
+over it, so readers only ever see whole entries, and any number of
+processes may share a cache directory: two computing the same run just
+write the same entry twice. Caches with different tolerances may share a
+directory too: each entry notes the tolerance its points were stored to,
+and a cache never takes points looser than its own tolerance (nor
+compressed points at all, if it stores them exactly). Reading an entry refreshes its modification
+time, and once the cache grows past its size limit, the least recently
+used entries are removed.
+
+Classes:
+ResultCache -- size-bounded, content-addressed cache of Trajectories
+
+Methods:
+make_key -- key of a run
+
+Constants:
+MAX_BYTES -- default most bytes of entries a cache keeps
+EVICT_TO -- fraction of its limit a cache shrinks to when it goes over
+RESCAN_FRACTION -- fraction of its limit a cache writes between rescans
+STALE_TEMP_AGE -- seconds after which a leftover temporary file is removed
+"""
+
+import functools, hashlib, json, os, time, uuid
+import numpy as np
+import simulation, trajectory_codec
+
+MAX_BYTES = 256 * 1024 * 1024
+EVICT_TO = 0.9
+
+# other processes' writes are only seen by rescanning, so a shared cache
+# can go over its limit by about this much per process
+RESCAN_FRACTION = 0.05
+
+# a temporary file this old is from a writer that died mid-write
+STALE_TEMP_AGE = 3600
+
+def make_key(e_field: float, mag_field: float, mass: float, charge: float,
+             initial_x_velocity: float,
+             area: (float, float, float, float) = simulation.DEFAULT_AREA,
+             max_steps: int = simulation.MAX_STEPS, record: bool = False,
+             tolerance: float = None, field_map=None,
+             instrument=None) -> str:
+    """Get the key of a run, given as for simulation.run_trajectory.
+
+    Returns the hex SHA-256 digest of everything deciding the run's result
+    """
+
+    description = {
+        'params': [float(value) for value in
+                   (e_field, mag_field, mass, charge, initial_x_velocity)],
+        'area': [float(value) for value in area],
+        # fixed frames, or adaptive steps held to a per-step error
+        'integrator': 'euler' if tolerance is None else 'rk23',
+        'step': 1 if tolerance is None else float(tolerance),
+        'max_steps': int(max_steps),
+        'record': bool(record),
+        'field_map': None if field_map is None else field_map.get_digest(),
+        'instrument': None if instrument is None
+                      else instrument.get_digest(),
+        'code_version': simulation.CODE_VERSION}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()
+                          ).hexdigest()
+
+class ResultCache():
+    """A class to represent a persistent cache of simulation results.
+
+    Attributes:
+    directory -- directory the entries live in
+    max_bytes -- most bytes of entries kept
+    tolerance -- most a stored trajectory point may be from the original,
+                 or None to store points exactly; entries stored more
+                 loosely are treated as missing
+    hits -- number of runs found in the cache
+    misses -- number of runs which had to be computed
+    evicted -- number of entries this cache has removed
+    _size -- estimated bytes of entries, corrected by each rescan
+    _written -- bytes of entries written since the last rescan
+
+    Methods:
+    get -- a run's cached Trajectory, if there is one
+    put -- cache a run's Trajectory
+    run_trajectory -- simulation.run_trajectory, through the cache
+    run_many -- many runs, computing only those not cached
+    get_stats -- dict of cache statistics
+    evict -- remove least recently used entries until under the limit
+    clear -- remove every entry
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES,
+                 tolerance: float = None) -> None:
+        """Initialize a ResultCache, creating its directory if needed.
+
+        directory -- directory the entries live in, may be shared
+        max_bytes -- most bytes of entries kept, default MAX_BYTES
+        tolerance -- most a stored trajectory point may be from the
+                     original, default None to store points exactly
+        """
+
+        if max_bytes <= 0:
+            raise ValueError('max_bytes must be positive')
+        if tolerance is not None and tolerance <= 0:
+            raise ValueError('Tolerance must be positive')
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._size = sum(size for _, size, _ in self._scan())
+        self._written = 0
+
+    def _entry_path(self, key: str) -> str:
+        """Get the path of a key's entry."""
+
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def _scan(self) -> list:
+        """List every entry as (path, size, modification time), removing
+        stale temporary files on the way."""
+
+        entries = []
+        now = time.time()
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                try:
+                    stat = entry.stat()
+                    if entry.name.endswith('.npz'):
+                        entries.append((entry.path, stat.st_size,
+                                        stat.st_mtime))
+                    elif now - stat.st_mtime > STALE_TEMP_AGE:
+                        os.remove(entry.path)
+                except OSError:
+                    # another process removed or replaced it meanwhile
+                    continue
+        return entries
+
+    def get(self, key: str) -> simulation.Trajectory:
+        """Get a run's cached Trajectory.
+
+        key -- the run's key, from make_key
+
+        Returns the Trajectory, or None if it isn't cached, or its points
+        were stored more loosely than this cache's tolerance
+        """
+
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as data:
+                entry = {name: data[name] for name in data.files}
+            # reading counts as use, for least recently used eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # missing, evicted while reading, or cut short by a crash
+            return None
+
+        if 'codes' in entry:
+            # entries from before tolerances were noted count as loose
+            entry_tolerance = float(entry.get('tolerance', np.inf))
+            if self.tolerance is None or entry_tolerance > self.tolerance:
+                return None
+            points = trajectory_codec.CompressedTrajectory.from_array(
+                entry['codes'], float(entry['quantum'])).decompress()
+        else:
+            points = entry.get('points')
+        if points is not None:
+            points = [tuple(point) for point in points.tolist()]
+
+        hit_y = float(entry['hit_y'])
+        return simulation.Trajectory(
+            tuple(entry['stop_pos'].tolist()), str(entry['stop_reason']),
+            int(entry['steps']), points, None if np.isnan(hit_y) else hit_y,
+            float(entry['time']))
+
+    def put(self, key: str, trajectory: simulation.Trajectory) -> None:
+        """Atomically cache a run's Trajectory, evicting old entries if the
+        cache has grown past its limit.
+
+        key -- the run's key, from make_key
+        trajectory -- the run's result
+        """
+
+        entry = {'stop_pos': np.asarray(trajectory.stop_pos, np.float64),
+                 'stop_reason': trajectory.stop_reason,
+                 'steps': trajectory.steps, 'time': trajectory.time,
+                 'hit_y': np.nan if trajectory.hit_y is None
+                          else trajectory.hit_y}
+        if trajectory.points is not None and self.tolerance is not None:
+            compressed = trajectory_codec.compress(trajectory.points,
+                                                   self.tolerance)
+            entry['codes'] = compressed.to_array()
+            entry['quantum'] = compressed.quantum
+            entry['tolerance'] = self.tolerance
+        elif trajectory.points is not None:
+            entry['points'] = np.asarray(trajectory.points,
+                                         np.float64).reshape(-1, 2)
+
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique, so concurrent writers never share a temporary file
+        temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as file:
+            np.savez(file, **entry)
+            file.flush()
+            os.fsync(file.fileno())
+        size = os.path.getsize(temp_path)
+        try:
+            os.replace(temp_path, path)
+        except PermissionError:
+            # Windows can't replace a file being read, but whoever wrote
+            # it wrote the same result
+            os.remove(temp_path)
+            return
+
+        self._size += size
+        self._written += size
+        if self._written > RESCAN_FRACTION * self.max_bytes:
+            self._size = sum(size for _, size, _ in self._scan())
+            self._written = 0
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache is back
+        under EVICT_TO of its limit."""
+
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        target = EVICT_TO * self.max_bytes
+
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                # another process already removed it, or is reading it
+                pass
+            size -= entry_size
+        self._size = size
+        self._written = 0
+
+    def run_trajectory(self, *params, **kwargs) -> simulation.Trajectory:
+        """Run a particle as simulation.run_trajectory does, taking the
+        result from the cache if it has been run before.
+
+        Arguments are as for simulation.run_trajectory
+
+        Returns the Trajectory
+        """
+
+        key = make_key(*params, **kwargs)
+        trajectory = self.get(key)
+        if trajectory is not None:
+            self.hits += 1
+            return trajectory
+
+        self.misses += 1
+        trajectory = simulation.run_trajectory(*params, **kwargs)
+        self.put(key, trajectory)
+        return trajectory
+
+    def run_many(self, runs, executor=None, **kwargs) -> list:
+        """Run many particles, computing only the runs not cached.
+
+        runs -- iterable of (e_field, mag_field, mass, charge,
+                initial_x_velocity) tuples
+        executor -- concurrent.futures executor to compute missing runs
+                    on, default None computes them here
+        kwargs -- other arguments as for simulation.run_trajectory,
+                  shared by every run
+
+        Returns a list of Trajectories, one per run, in order
+        """
+
+        runs = [tuple(params) for params in runs]
+        keys = [make_key(*params, **kwargs) for params in runs]
+        results = [self.get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        self.hits += len(runs) - len(missing)
+        self.misses += len(missing)
+
+        compute = functools.partial(_run_params, kwargs)
+        missing_runs = [runs[i] for i in missing]
+        computed = (map(compute, missing_runs) if executor is None
+                    else executor.map(compute, missing_runs))
+        for i, trajectory in zip(missing, computed):
+            self.put(keys[i], trajectory)
+            results[i] = trajectory
+
+        return results
+
+    def get_stats(self) -> dict:
+        """Get a dict of hits, misses, evicted and size (estimated bytes)."""
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'evicted': self.evicted, 'size': self._size}
+
+    def clear(self) -> None:
+        """Remove every entry."""
+
+        for path, _, _ in self._scan():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+
+def _run_params(kwargs: dict, params: tuple) -> simulation.Trajectory:
+    """Run one set of parameters, for executors (which need a top-level
+    function to pickle)."""
+
+    return simulation.run_trajectory(*params, **kwargs)
@@ -0,0 +1,412 @@
+"""result_store.py: for a ResultStore class
+
+Runs are stored column by column as raw fixed-dtype files in a directory,
+and read back with numpy.memmap, so sweeps far bigger than memory can be
+sliced and filtered without loading them.
+
+Directory layout:
+meta.json -- committed run/point counts, the stop reason vocabulary, the
+             sweep cursor and the compression tolerance
+<column>.bin -- one file per column in RUN_COLUMNS
+points.bin -- every recorded trajectory point, (x, y) float64 pairs
+codes.bin -- instead of points.bin in a store made with a tolerance, every
+             recorded trajectory compressed (see trajectory_codec) into
+             int32 codes
+
+Classes:
+ResultStore -- append-only, memory-mapped store of runs and trajectories
+
+Methods:
+record_runs -- run a batch of particles and append them to a store
+
+Constants:
+RUN_COLUMNS -- (name, dtype) of every per-run column
+POINT_DTYPE -- dtype of a trajectory point's coordinates
+CODE_DTYPE -- dtype of a compressed trajectory's codes
+FILTER_CHUNK -- number of runs filtered at a time
+"""
+
+import itertools, json, os
+import numpy as np
+import simulation, trajectory_codec
+
+RUN_COLUMNS = (('mass', np.float64), ('charge', np.float64),
+               ('initial_x_velocity', np.float64), ('e_field', np.float64),
+               ('mag_field', np.float64), ('stop_x', np.float64),
+               ('stop_y', np.float64), ('stop_reason', np.uint8),
+               ('steps', np.int64),
+               # where this run's points (or codes) are in points.bin
+               # (or codes.bin)
+               ('points_start', np.int64), ('points_count', np.int64))
+POINT_DTYPE = np.float64
+CODE_DTYPE = np.int32
+
+# filtering looks at this many runs at once, to bound memory use
+FILTER_CHUNK = 1 << 20
+
+class ResultStore():
+    """A class to represent an append-only store of simulation runs.
+
+    Runs are only visible to readers once committed by flush (or close),
+    which rewrites meta.json atomically. Anything written after the last
+    commit is discarded when the store is next opened.
+
+    A store made with a tolerance keeps trajectories compressed to within
+    it, at a fraction of the size; they are decompressed when read.
+
+    Attributes:
+    _path -- directory the store lives in
+    _writable -- whether runs may be appended
+    _count -- number of committed runs
+    _point_count -- number of committed trajectory points (or codes)
+    _tolerance -- most a stored point may be from the original, or None
+                  if points are stored exactly
+    _points_name -- name of the file trajectories are stored in
+    _stop_reasons -- list of stop reason names, indexed by stop_reason code
+    _cursor -- committed position in the sweep being recorded
+    _pending_cursor -- cursor to commit with the next flush
+    _pending -- number of runs appended but not yet committed
+    _pending_points -- number of points (or codes) appended but not yet
+                       committed
+    _files -- dict of open append-mode files, by column name
+    _maps -- dict of cached memmaps, by column name
+
+    Methods:
+    append -- append one run
+    flush -- commit appended runs
+    close -- commit appended runs and close files
+    column -- memory-mapped view of one column
+    stop_reason_code -- code a stop reason is stored as
+    find -- indices of runs matching the given conditions
+    trajectory -- one run's points
+    get_tolerance -- getter for _tolerance
+    set_cursor -- set the sweep cursor to commit with the next flush
+    get_cursor -- getter for _cursor
+    """
+
+    def __init__(self, path: str, writable: bool = True,
+                 tolerance: float = None) -> None:
+        """Open a ResultStore, creating it if needed.
+
+        path -- directory the store lives in
+        writable -- whether runs may be appended, default True
+        tolerance -- if creating the store, most a stored trajectory point
+                     may be from the original, default None to store them
+                     exactly; an existing store keeps its own
+        """
+
+        if tolerance is not None and tolerance <= 0:
+            raise ValueError('Tolerance must be positive')
+
+        self._path = path
+        self._writable = writable
+        self._maps = {}
+        self._files = {}
+        self._pending = 0
+        self._pending_points = 0
+
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf8') as file:
+                meta = json.load(file)
+            self._count = meta['count']
+            self._point_count = meta['point_count']
+            self._stop_reasons = meta['stop_reasons']
+            self._cursor = meta.get('cursor', self._count)
+            self._tolerance = meta.get('tolerance')
+        elif writable:
+            os.makedirs(path, exist_ok=True)
+            self._count = 0
+            self._point_count = 0
+            self._stop_reasons = []
+            self._cursor = 0
+            self._tolerance = tolerance
+            self._write_meta()
+        else:
+            raise FileNotFoundError('No result store at ' + path)
+
+        self._pending_cursor = self._cursor
+        self._points_name = 'points' if self._tolerance is None else 'codes'
+
+        if writable:
+            self._open_files()
+
+    def __len__(self) -> int:
+        """Get the number of committed runs."""
+
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _open_files(self) -> None:
+        """Open every column for appending, dropping uncommitted data."""
+
+        sizes = [(name, self._count * np.dtype(dtype).itemsize)
+                 for name, dtype in RUN_COLUMNS]
+        if self._tolerance is None:
+            sizes.append(('points', self._point_count * 2 *
+                          np.dtype(POINT_DTYPE).itemsize))
+        else:
+            sizes.append(('codes', self._point_count *
+                          np.dtype(CODE_DTYPE).itemsize))
+
+        for name, size in sizes:
+            file = open(self._file_path(name), 'ab')
+            # anything past the committed size is from an interrupted run
+            file.truncate(size)
+            self._files[name] = file
+
+    def _file_path(self, name: str) -> str:
+        """Get the path of a column's file."""
+
+        return os.path.join(self._path, name + '.bin')
+
+    def _write_meta(self) -> None:
+        """Atomically replace meta.json with the current counts."""
+
+        meta_path = os.path.join(self._path, 'meta.json')
+        with open(meta_path + '.tmp', 'w', encoding='utf8') as file:
+            json.dump({'count': self._count,
+                       'point_count': self._point_count,
+                       'stop_reasons': self._stop_reasons,
+                       'cursor': self._cursor,
+                       'tolerance': self._tolerance}, file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def stop_reason_code(self, stop_reason: str) -> int:
+        """Get the code a stop reason is stored as.
+
+        stop_reason -- name of what stopped a particle
+
+        Returns its code, or -1 if no run has stopped for that reason
+        """
+
+        if stop_reason in self._stop_reasons:
+            return self._stop_reasons.index(stop_reason)
+        return -1
+
+    def set_cursor(self, cursor: int) -> None:
+        """Set the sweep cursor, committed along with the next flush.
+
+        The cursor is how far through its sweep the store has got, so an
+        interrupted sweep can carry on from the last commit.
+
+        cursor -- number of the sweep's runs done once flushed
+        """
+
+        self._pending_cursor = cursor
+
+    def get_cursor(self) -> int:
+        """Get the committed sweep cursor."""
+
+        return self._cursor
+
+    def get_tolerance(self) -> float:
+        """Get the compression tolerance, None if points are exact."""
+
+        return self._tolerance
+
+    def append(self, trajectory: simulation.Trajectory, e_field: float,
+               mag_field: float, mass: float, charge: float,
+               initial_x_velocity: float) -> None:
+        """Append one run, which is visible once flushed.
+
+        trajectory -- result of the run, points are stored if recorded
+        e_field, mag_field, mass, charge, initial_x_velocity -- parameters
+                                                                of the run
+        """
+
+        if not self._writable:
+            raise ValueError('Result store was opened read-only')
+
+        if trajectory.stop_reason not in self._stop_reasons:
+            if len(self._stop_reasons) == np.iinfo(np.uint8).max:
+                raise ValueError('Too many distinct stop reasons')
+            self._stop_reasons.append(trajectory.stop_reason)
+
+        points = trajectory.points if trajectory.points is not None else []
+        if points and self._tolerance is not None:
+            data = trajectory_codec.compress(points, self._tolerance
+                                             ).to_array(CODE_DTYPE)
+        else:
+            data = np.asarray(points, POINT_DTYPE)
+        values = {'mass': mass, 'charge': charge,
+                  'initial_x_velocity': initial_x_velocity,
+                  'e_field': e_field, 'mag_field': mag_field,
+                  'stop_x': trajectory.stop_pos[0],
+                  'stop_y': trajectory.stop_pos[1],
+                  'stop_reason': self._stop_reasons.index(
+                      trajectory.stop_reason),
+                  'steps': trajectory.steps,
+                  'points_start': self._point_count + self._pending_points,
+                  'points_count': len(data)}
+
+        for name, dtype in RUN_COLUMNS:
+            self._files[name].write(np.array(values[name], dtype).tobytes())
+        if len(data):
+            self._files[self._points_name].write(data.tobytes())
+
+        self._pending += 1
+        self._pending_points += len(data)
+
+    def flush(self) -> None:
+        """Commit every appended run, making them visible to readers."""
+
+        if not self._writable or not (self._pending or
+                                      self._pending_cursor != self._cursor):
+            return
+
+        for file in self._files.values():
+            file.flush()
+            os.fsync(file.fileno())
+
+        self._count += self._pending
+        self._point_count += self._pending_points
+        self._pending = 0
+        self._pending_points = 0
+        self._cursor = self._pending_cursor
+        self._write_meta()
+        # old maps are too short now
+        self._maps = {}
+
+    def close(self) -> None:
+        """Commit appended runs and close every file."""
+
+        self.flush()
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+    def column(self, name: str) -> np.ndarray:
+        """Get a read-only, memory-mapped view of one column.
+
+        name -- name of a column in RUN_COLUMNS, or 'points' for every
+                trajectory point as an (n, 2) array, or 'codes' for every
+                compressed trajectory's codes in a store with a tolerance
+
+        Returns an array backed by the file, without reading it
+        """
+
+        if name in ('points', 'codes') and name != self._points_name:
+            raise ValueError('Trajectories are stored in ' +
+                             self._points_name + ', not ' + name)
+
+        if name not in self._maps:
+            if name == 'points':
+                dtype, shape = POINT_DTYPE, (self._point_count, 2)
+            elif name == 'codes':
+                dtype, shape = CODE_DTYPE, (self._point_count,)
+            else:
+                dtype, shape = dict(RUN_COLUMNS)[name], (self._count,)
+
+            # numpy cannot map an empty file
+            if shape[0] == 0:
+                self._maps[name] = np.empty(shape, dtype)
+            else:
+                self._maps[name] = np.memmap(self._file_path(name), dtype,
+                                             'r', shape=shape)
+
+        return self._maps[name]
+
+    def find(self, start: int = 0, stop: int = None, **conditions
+             ) -> np.ndarray:
+        """Find runs matching every given condition.
+
+        Runs are filtered FILTER_CHUNK at a time, so only the conditioned
+        columns are read, and never all at once.
+
+        start, stop -- range of runs to search, default all of them
+        conditions -- column name to required value, or to a tuple of
+                      allowed values; stop_reason is given by name
+                      e.g. charge=2, stop_reason=('lower_horizontal',
+                                                  'lower_vertical')
+
+        Returns an array of matching run indices
+        """
+
+        stop = self._count if stop is None else min(stop, self._count)
+
+        allowed = {}
+        for name, value in conditions.items():
+            values = value if isinstance(value, (tuple, list)) else (value,)
+            if name == 'stop_reason':
+                # a reason no run has stopped for cannot match anything
+                codes = [self.stop_reason_code(reason) for reason in values]
+                values = [code for code in codes if code >= 0]
+            allowed[name] = np.asarray(values, dict(RUN_COLUMNS)[name])
+
+        matches = []
+        for chunk_start in range(start, stop, FILTER_CHUNK):
+            chunk = slice(chunk_start, min(chunk_start + FILTER_CHUNK, stop))
+            mask = np.ones(chunk.stop - chunk.start, bool)
+
+            for name, values in allowed.items():
+                mask &= np.isin(self.column(name)[chunk], values)
+
+            matches.append(np.flatnonzero(mask) + chunk_start)
+
+        if not matches:
+            return np.empty(0, np.int64)
+        return np.concatenate(matches)
+
+    def trajectory(self, index: int) -> np.ndarray:
+        """Get one run's points, as a memory-mapped view if stored
+        exactly, or decompressed if stored with a tolerance.
+
+        index -- index of the run
+
+        Returns an (n, 2) array of (x, y), empty if it was not recorded
+        """
+
+        if not -self._count <= index < self._count:
+            raise IndexError('Run index out of range')
+
+        start = int(self.column('points_start')[index])
+        count = int(self.column('points_count')[index])
+        if self._tolerance is None:
+            return self.column('points')[start:start + count]
+        if count == 0:
+            return np.empty((0, 2), POINT_DTYPE)
+        return trajectory_codec.CompressedTrajectory.from_array(
+            self.column('codes')[start:start + count],
+            trajectory_codec.get_quantum(self._tolerance)).decompress()
+
+def record_runs(store: ResultStore, runs, record: bool = True,
+                max_steps: int = simulation.MAX_STEPS,
+                flush_every: int = 1000, resume: bool = False,
+                cache=None) -> None:
+    """Run every set of parameters given and append the results.
+
+    The sweep cursor is committed with each flush, so if the sweep is
+    interrupted, calling again with the same runs and resume=True carries
+    on after the last committed run.
+
+    store -- ResultStore to append to
+    runs -- iterable of (e_field, mag_field, mass, charge,
+            initial_x_velocity) tuples, the same each time if resuming
+    record -- whether to store trajectory points, default True
+    max_steps -- number of frames before a run is given up on
+    flush_every -- number of runs between commits, default 1000
+    resume -- whether to skip runs already committed, default False
+    cache -- ResultCache to take runs done before from, and add new runs
+             to, default None computes every run
+    """
+
+    start = store.get_cursor() if resume else 0
+    store.set_cursor(start)
+
+    for i, params in enumerate(itertools.islice(runs, start, None),
+                               start + 1):
+        run = simulation.run_trajectory if cache is None \
+            else cache.run_trajectory
+        trajectory = run(*params, max_steps=max_steps, record=record)
+        store.append(trajectory, *params)
+        store.set_cursor(i)
+        if i % flush_every == 0:
+            store.flush()
+
+    store.flush()
@@ -7,7 +7,8 @@ Info has several sub-screens with information.
 """
 
 import pygame, sys, random
-import button, text, fonts, info_section, mass_spectrometer, slider
+import button, text, text_cache, fonts, info_section, mass_spectrometer, slider
+import simulation, simulation_worker, alloc_profile, render_target, density_map
 
 # required initialization step
 pygame.init()
@@ -25,9 +26,13 @@ BACKGROUND_COLOR = pygame.Color(38, 228, 235)
 BACK_COLOR = pygame.Color(235, 91, 91)
 MOVE_FURTHER_COLOR = pygame.Color(79, 240, 146)
 
-# set up the display screen
+# size of the display screen
 WINDOW_SIZE = (1000, 600)
-window = pygame.display.set_mode(WINDOW_SIZE)
+
+# launch spreads of the particles in ensemble mode
+ENSEMBLE_Y_SPREAD = 20
+ENSEMBLE_SPEED_SPREAD = 0.2
+ENSEMBLE_ANGLE_SPREAD = 0.03
 
 def random_corman_pos() -> (int, int):
     """Generate a random valid position for the Corman image."""
@@ -36,8 +41,30 @@ def random_corman_pos() -> (int, int):
     return (random.randrange(0, WINDOW_SIZE[0] - width),
             random.randrange(0, WINDOW_SIZE[1] - height))
 
-def main() -> None:
-    """Main runner function. Implements high-level logic."""
+def main(ensemble_size: int = 0, profile: bool = False) -> None:
+    """Main runner function. Implements high-level logic.
+
+    ensemble_size -- if positive, simulate this many particles at once, with
+                     the physics in a separate worker process; default 0
+                     simulates one particle as usual
+    profile -- whether to measure allocations & GC pauses of simulator
+               frames, reported on exit; default False
+    """
+
+    # set up the display screen (here rather than at import, so worker
+    # processes importing this module don't open windows); everything is
+    # drawn at WINDOW_SIZE and scaled to the window, whatever its size
+    target = render_target.RenderTarget(WINDOW_SIZE,
+                                        border_color=BACKGROUND_COLOR)
+    window = target.canvas
+
+    # labels rendered on earlier runs needn't be rendered again
+    text_cache.CACHE.load()
+
+    # measures nothing unless started
+    profiler = alloc_profile.AllocationProfiler()
+    if profile:
+        profiler.start()
 
     # flags used to indicate current screen
     START = 1
@@ -77,9 +104,16 @@ def main() -> None:
     start_screen_elems = (exit_button, sim_button, info_button, title, subtitle)
 
     # simulation screen elements
-    mass_spec = mass_spectrometer.MassSpectrometer(
-        5, -1, 20, 1, 5, pygame.Rect(0, 0, 2 * WINDOW_SIZE[0] / 3,
-                                     WINDOW_SIZE[1]))
+    mass_spec_area = pygame.Rect(0, 0, 2 * WINDOW_SIZE[0] / 3,
+                                 WINDOW_SIZE[1])
+    if ensemble_size > 0:
+        # stands in for a MassSpectrometer, so the loop below is unchanged
+        mass_spec = simulation_worker.SimulationWorker(
+            5, -1, 20, 1, 5, mass_spec_area, ensemble_size,
+            ENSEMBLE_Y_SPREAD, ENSEMBLE_SPEED_SPREAD, ENSEMBLE_ANGLE_SPREAD)
+    else:
+        mass_spec = mass_spectrometer.MassSpectrometer(5, -1, 20, 1, 5,
+                                                       mass_spec_area)
     reset_button = button.Button('Reset', pygame.Rect(50, 50, 100, 50),
                                  MOVE_FURTHER_COLOR)
     back_button = button.Button('Back', pygame.Rect(450, 500, 100, 50),
@@ -88,6 +122,12 @@ def main() -> None:
                                  BACK_COLOR)
     unpause_button = button.Button('Go', pygame.Rect(50, 175, 100, 50),
                                    MOVE_FURTHER_COLOR)
+    # heatmap of where the ensemble has been, toggled in ensemble mode
+    show_heat_button = button.Button('Heatmap',
+                                     pygame.Rect(50, 300, 100, 50),
+                                     MOVE_FURTHER_COLOR)
+    hide_heat_button = button.Button('Hide', pygame.Rect(50, 300, 100, 50),
+                                     BACK_COLOR)
     # set up sliders
     slider_area = pygame.Rect(WINDOW_SIZE[0] - 200, 0, 150, WINDOW_SIZE[1] / 5)
     charge_slider = slider.DiscreteSlider('Charge', (-2, 2), 1, slider_area,
@@ -96,14 +136,16 @@ def main() -> None:
     mass_slider = slider.Slider('Mass', (10, 50), 20, slider_area,
                                 BACKGROUND_COLOR)
     slider_area.top += slider_area.height
-    velocity_slider = slider.Slider('i. Velocity', (2, 10), 5, slider_area,
-                                    BACKGROUND_COLOR)
+    velocity_slider = slider.Slider('i. Velocity',
+                                    simulation.VELOCITY_RANGE, 5,
+                                    slider_area, BACKGROUND_COLOR)
     slider_area.top += slider_area.height
-    e_field_slider = slider.Slider('E Field', (-5, 5), 5, slider_area,
-                                   BACKGROUND_COLOR)
+    e_field_slider = slider.Slider('E Field', simulation.E_FIELD_RANGE, 5,
+                                   slider_area, BACKGROUND_COLOR)
     slider_area.top += slider_area.height
-    mag_field_slider = slider.Slider('Mag Field', (-5, 5), -1, slider_area,
-                                     BACKGROUND_COLOR)
+    mag_field_slider = slider.Slider('Mag Field',
+                                     simulation.MAG_FIELD_RANGE, -1,
+                                     slider_area, BACKGROUND_COLOR)
                                    
     simulator_screen_elems = (back_button, mass_spec, reset_button,
                               charge_slider, mass_slider,
@@ -154,9 +196,35 @@ def main() -> None:
     source_area = pygame.Rect(200, 450, 600, 50)
 
     info_subscreen_elems = [back_button, info_subscreen_title]
+    # elements of subscreens already visited, by subscreen number
+    built_subscreens = {}
+
+    def build_info_subscreen(subscreen_num: int) -> list:
+        """Build the elements of an info subscreen."""
+
+        # set up title
+        info_subscreen_title = text.Text(
+            info_subscreens[subscreen_num].title, fonts.TITLE_FONT,
+            pygame.Rect(0, 0, WINDOW_SIZE[0], WINDOW_SIZE[1] / 4),
+            BACKGROUND_COLOR)
+        elems = [back_button, info_subscreen_title]
+
+        # add info paragraph lines to elems
+        elems.extend(text.paragraphs_to_lines(
+            info_subscreens[subscreen_num].info, fonts.PARAGRAPH_FONT,
+            info_area, BACKGROUND_COLOR))
+        # add source line to elems
+        elems.append(text.Text(info_subscreens[subscreen_num].source,
+                               fonts.PARAGRAPH_FONT, source_area,
+                               BACKGROUND_COLOR))
+        return elems
    
     # game loop
     while True:
+        # a resized window only changes how the canvas is scaled
+        if pygame.event.get(pygame.VIDEORESIZE):
+            target.resize()
+
         if screen == START:
             pygame.display.set_caption('Start')
 
@@ -181,10 +249,16 @@ def main() -> None:
                         corman_name_index = 0
                         
                 elif event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_x, mouse_y = pygame.mouse.get_pos()
+                    mouse_x, mouse_y = target.get_mouse_pos()
 
                     # exit button quits simulation
                     if exit_button.is_clicked(mouse_x, mouse_y):
+                        text_cache.CACHE.save()
+                        if profile:
+                            profiler.stop()
+                            print(profiler.report())
+                        if ensemble_size > 0:
+                            mass_spec.close()
                         # must do both to exit properly
                         pygame.quit()
                         sys.exit()
@@ -203,21 +277,31 @@ def main() -> None:
         elif screen == SIMULATOR:
             pygame.display.set_caption('Simulator')
 
-            # erase before drawing, so that particle doesn't drag when moving
-            window.fill(BACKGROUND_COLOR)
+            with profiler.phase('draw'):
+                # erase before drawing, so particle doesn't drag when moving
+                window.fill(BACKGROUND_COLOR)
 
-            for elem in simulator_screen_elems:
-                elem.draw(window)
+                for elem in simulator_screen_elems:
+                    elem.draw(window)
 
             if paused:
                 unpause_button.draw(window)
             else:
                 pause_button.draw(window)
-                mass_spec.move()
+                with profiler.phase('physics'):
+                    mass_spec.move()
+
+            if ensemble_size > 0:
+                if mass_spec.get_density_map() is None:
+                    show_heat_button.draw(window)
+                else:
+                    hide_heat_button.draw(window)
+
+            profiler.end_frame()
 
             for event in pygame.event.get():
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_x, mouse_y = pygame.mouse.get_pos()
+                    mouse_x, mouse_y = target.get_mouse_pos()
 
                     # back button goes to start screen
                     if back_button.is_clicked(mouse_x, mouse_y):
@@ -232,6 +316,15 @@ def main() -> None:
                     elif pause_button.is_clicked(mouse_x, mouse_y):
                         paused = not paused
 
+                    # heatmap buttons in same spot, only in ensemble mode
+                    elif ensemble_size > 0 and \
+                            show_heat_button.is_clicked(mouse_x, mouse_y):
+                        if mass_spec.get_density_map() is None:
+                            mass_spec.set_density_map(
+                                density_map.DensityMap(mass_spec_area))
+                        else:
+                            mass_spec.set_density_map(None)
+
                     # handle slider clicks
                     elif charge_slider.is_clicked(mouse_x, mouse_y):
                         mass_spec.set_charge(
@@ -262,7 +355,7 @@ def main() -> None:
 
             for event in pygame.event.get():
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_x, mouse_y = pygame.mouse.get_pos()
+                    mouse_x, mouse_y = target.get_mouse_pos()
 
                     # back button goes to start screen
                     if back_button.is_clicked(mouse_x, mouse_y):
@@ -276,26 +369,13 @@ def main() -> None:
 
                     # if a subscreen has been set, set it up 
                     if subscreen_num != -1:
-                        # set up title
-                        info_subscreen_title = text.Text(
-                            info_subscreens[subscreen_num].title,
-                            fonts.TITLE_FONT,
-                            pygame.Rect(0, 0, WINDOW_SIZE[0],
-                                        WINDOW_SIZE[1] / 4), BACKGROUND_COLOR)
-                        info_subscreen_elems = [back_button,
-                                                info_subscreen_title]
-
-                        # add info paragraph lines to elems
-                        for line in text.paragraphs_to_lines(
-                            info_subscreens[subscreen_num].info,
-                            fonts.PARAGRAPH_FONT, info_area, BACKGROUND_COLOR):
-                            info_subscreen_elems.append(line)
-                        # add source line to elems
-                        info_subscreen_elems.append(text.Text(
-                                     info_subscreens[subscreen_num].source,
-                                     fonts.PARAGRAPH_FONT, source_area,
-                                     BACKGROUND_COLOR))
-                            
+                        # each subscreen's elements are only built once
+                        if subscreen_num not in built_subscreens:
+                            built_subscreens[subscreen_num] = \
+                                build_info_subscreen(subscreen_num)
+                        info_subscreen_elems = \
+                            built_subscreens[subscreen_num]
+
                         screen = INFO_SUBSCREEN
                         window.fill(BACKGROUND_COLOR)
                         
@@ -308,7 +388,7 @@ def main() -> None:
 
             for event in pygame.event.get():
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    mouse_x, mouse_y = pygame.mouse.get_pos()
+                    mouse_x, mouse_y = target.get_mouse_pos()
 
                     # back button goes to info screen
                     if back_button.is_clicked(mouse_x, mouse_y):
@@ -318,10 +398,13 @@ def main() -> None:
             
                         
         # update screen & tick clock
-        pygame.display.update()
+        target.present()
         game_clock.tick(FPS)
     
 
 # call the "main" function if running this script
 if __name__ == "__main__":
-    main()
+    # optional arguments: number of particles for ensemble mode, and
+    # --profile to report allocations on exit
+    arguments = [arg for arg in sys.argv[1:] if arg != '--profile']
+    main(int(arguments[0]) if arguments else 0, '--profile' in sys.argv)
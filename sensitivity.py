@@ -0,0 +1,137 @@
+"""sensitivity.py: for how detector hits depend on the simulation parameters
+
+Derivatives are taken by central differences: each base point is run
+alongside a raised and a lowered copy per parameter, all in one batch.
+
+The simulator moves in whole frames, and the electric field switches off
+at the middle on whichever frame a particle passes it, so hit position has
+small steps in it. Differencing steps much smaller than the default end up
+measuring those steps rather than the trend.
+
+Methods:
+landing_sensitivity -- hit y & its Jacobian over PARAMETERS, per base point
+hit_derivative -- hit y & its derivative by one parameter, per base point
+resolving_power -- m / dm resolvable from a hit y derivative
+
+Constants:
+PARAMETERS -- names of the parameters, in the order points give them
+RELATIVE_STEP -- default differencing step, relative to each parameter
+HIT_WIDTH -- default width of a detector hit, in pixels
+"""
+
+import numpy as np
+import charged_particle, simulation
+
+PARAMETERS = ('e_field', 'mag_field', 'mass', 'charge',
+              'initial_x_velocity')
+RELATIVE_STEP = 1e-2
+
+# a particle's hit is as wide as the particle
+HIT_WIDTH = 2 * charged_particle.RADIUS
+
+def landing_sensitivity(points, relative_step: float = RELATIVE_STEP,
+                        area: (float, float, float, float) =
+                        simulation.DEFAULT_AREA,
+                        max_steps: int = simulation.MAX_STEPS
+                        ) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Find detector hit y and its derivative by every parameter, for many
+    base points at once.
+
+    points -- (n, 5) array of base points, each (e_field, mag_field, mass,
+              charge, initial_x_velocity) as in PARAMETERS, or one point
+    relative_step -- differencing step as a fraction of each parameter
+                     (of 1, for parameters which are 0), default
+                     RELATIVE_STEP
+    area -- (left, top, width, height) the mass spectrometer takes up
+    max_steps -- number of frames before a run is given up on
+
+    Returns (hit y, Jacobian, valid): arrays of shape (n,), (n, 5) and
+    (n,), the Jacobian's columns in PARAMETERS order; valid is False where
+    the base point or a perturbed copy missed the detector, leaving NaNs
+    """
+
+    points = np.asarray(points, np.float64).reshape(-1, len(PARAMETERS))
+    if not 0 < relative_step < 1:
+        raise ValueError('Relative step must be between 0 and 1')
+
+    # stepping by a fraction of the parameter keeps lowered mass positive
+    steps = relative_step * np.where(points != 0, np.abs(points), 1)
+
+    # each base point, then each parameter raised & lowered in turn
+    variants = np.repeat(points[:, None, :], 2 * len(PARAMETERS) + 1,
+                         axis=1)
+    for k in range(len(PARAMETERS)):
+        variants[:, 2 * k + 1, k] += steps[:, k]
+        variants[:, 2 * k + 2, k] -= steps[:, k]
+
+    hits = simulation.run_hits(*np.moveaxis(variants, -1, 0), area=area,
+                               max_steps=max_steps)
+
+    jacobian = (hits[:, 1::2] - hits[:, 2::2]) / (2 * steps)
+    valid = ~np.isnan(hits).any(axis=1)
+    return hits[:, 0], jacobian, valid
+
+def hit_derivative(points, parameter: str,
+                   relative_step: float = RELATIVE_STEP,
+                   area: (float, float, float, float) =
+                   simulation.DEFAULT_AREA,
+                   max_steps: int = simulation.MAX_STEPS
+                   ) -> (np.ndarray, np.ndarray):
+    """Find detector hit y and its derivative by one parameter, for many
+    base points at once.
+
+    Only the one parameter is differenced, so a base point near the edge
+    of where particles land isn't lost to another parameter's copy
+    missing; where just one of its raised and lowered copies lands, a
+    one-sided difference is taken instead of the central one.
+
+    points -- (n, 5) array of base points as for landing_sensitivity
+    parameter -- name of the parameter, one of PARAMETERS
+    relative_step -- differencing step as for landing_sensitivity
+    area -- (left, top, width, height) the mass spectrometer takes up
+    max_steps -- number of frames before a run is given up on
+
+    Returns (hit y, derivative): arrays of shape (n,), the derivative NaN
+    where the base point or both copies missed the detector
+    """
+
+    if parameter not in PARAMETERS:
+        raise ValueError('Unknown parameter ' + str(parameter))
+    points = np.asarray(points, np.float64).reshape(-1, len(PARAMETERS))
+    if not 0 < relative_step < 1:
+        raise ValueError('Relative step must be between 0 and 1')
+
+    k = PARAMETERS.index(parameter)
+    step = relative_step * np.where(points[:, k] != 0,
+                                    np.abs(points[:, k]), 1)
+
+    # each base point, then the parameter raised & lowered
+    variants = np.repeat(points[:, None, :], 3, axis=1)
+    variants[:, 1, k] += step
+    variants[:, 2, k] -= step
+
+    hits = simulation.run_hits(*np.moveaxis(variants, -1, 0), area=area,
+                               max_steps=max_steps)
+    base, raised, lowered = hits.T
+
+    derivative = (raised - lowered) / (2 * step)
+    derivative = np.where(np.isnan(lowered), (raised - base) / step,
+                          derivative)
+    derivative = np.where(np.isnan(raised), (base - lowered) / step,
+                          derivative)
+    return base, np.where(np.isnan(base), np.nan, derivative)
+
+def resolving_power(mass, hit_by_mass, hit_width: float = HIT_WIDTH):
+    """Find the mass resolving power m / dm, where dm is the mass change
+    which moves the hit by one hit width.
+
+    mass -- masses, any shape
+    hit_by_mass -- derivative of hit y by mass at each mass, e.g. the mass
+                   column of a landing_sensitivity Jacobian
+    hit_width -- hit y difference which can be told apart, default
+                 HIT_WIDTH
+
+    Returns the resolving power at each mass
+    """
+
+    return np.asarray(mass) * np.abs(hit_by_mass) / hit_width
@@ -0,0 +1,379 @@
+"""simulation.py: for running MassSpectrometer physics without drawing
+
+Classes:
+Trajectory -- result of running one particle through a mass spectrometer
+TrajectoryStream -- a particle's states, produced chunk by chunk
+
+Methods:
+run_trajectory -- run a single particle until it stops
+iter_trajectory -- stream a single particle's states until it stops
+run_hits -- run many particles at once, returning where each hit the detector
+
+Constants:
+DEFAULT_AREA -- (left, top, width, height) of the simulator's spectrometer
+E_FIELD_RANGE, MAG_FIELD_RANGE, VELOCITY_RANGE -- (min, max) of the
+    simulator's sliders
+MAX_STEPS -- default number of frames before a run is given up on
+TIMEOUT -- stop reason for a particle which never stopped
+CHUNK_SIZE -- default number of states in each streamed chunk
+STATE_COLUMNS -- names of the columns of each streamed chunk
+CODE_VERSION -- version of the physics, part of every cached result's key
+"""
+
+import pygame
+import numpy as np
+import mass_spectrometer
+
+# required initialization step
+pygame.init()
+
+# same area the simulator screen gives its mass spectrometer
+DEFAULT_AREA = (0, 0, 2 * 1000 / 3, 600)
+
+# ranges of the simulator screen's field & velocity sliders
+E_FIELD_RANGE = (-5, 5)
+MAG_FIELD_RANGE = (-5, 5)
+VELOCITY_RANGE = (2, 10)
+
+# a particle caught in a closed orbit would otherwise never stop
+MAX_STEPS = 10000
+TIMEOUT = 'timeout'
+
+CHUNK_SIZE = 1024
+STATE_COLUMNS = ('t', 'x', 'y', 'v_x', 'v_y')
+
+# bump whenever a change makes runs give different results, so results
+# cached by earlier versions are not used
+CODE_VERSION = 1
+
+class Trajectory():
+    """A class to represent the result of one particle's run.
+
+    Attributes:
+    stop_pos -- (x, y) position the particle stopped at
+    stop_reason -- name of what stopped the particle (see mass_spectrometer)
+                   or TIMEOUT
+    steps -- number of steps the particle moved for
+    time -- time the particle moved for, in frames (same as steps unless
+            moving adaptively)
+    points -- list of (x, y) positions, one per step, or None if the
+              trajectory was not recorded
+    hit_y -- y position the particle crossed the detector at, interpolated
+             between frames, or None if it did not land on the detector
+    """
+
+    def __init__(self, stop_pos: (float, float), stop_reason: str,
+                 steps: int, points: list = None,
+                 hit_y: float = None, time: float = None) -> None:
+        """Initialize a Trajectory.
+
+        stop_pos -- (x, y) position the particle stopped at
+        stop_reason -- name of what stopped the particle
+        steps -- number of steps the particle moved for
+        points -- list of (x, y) positions, or None if not recorded
+        hit_y -- y position the particle crossed the detector at, or None
+        time -- time the particle moved for, default None means steps
+        """
+
+        self.stop_pos = stop_pos
+        self.stop_reason = stop_reason
+        self.steps = steps
+        self.points = points
+        self.hit_y = hit_y
+        self.time = steps if time is None else time
+
+def run_trajectory(e_field: float, mag_field: float, mass: float,
+                   charge: float, initial_x_velocity: float,
+                   area: (float, float, float, float) = DEFAULT_AREA,
+                   max_steps: int = MAX_STEPS,
+                   record: bool = False,
+                   tolerance: float = None,
+                   field_map=None, instrument=None) -> Trajectory:
+    """Run a particle through a mass spectrometer until it stops.
+
+    Frames are run exactly as the simulator screen runs them, minus drawing.
+
+    e_field -- electric field strength, positive is down
+    mag_field -- magnetic field strength, positive is out of page
+    mass -- mass of charged particle
+    charge -- charge of charged particle
+    initial_x_velocity -- x velocity of charged particle at launch
+    area -- (left, top, width, height) the mass spectrometer takes up
+            plain tuple rather than a Rect so the call can be pickled
+    max_steps -- number of steps before giving up, default MAX_STEPS
+    record -- whether to keep every position, default False
+    tolerance -- per-step position error allowed, in pixels, to move with
+                 adaptive time steps; default None moves a frame per step
+    field_map -- FieldMap to take fields from instead of e_field and
+                 mag_field, default None
+    instrument -- Geometry of walls, slits and detector plates, default
+                  None for the usual four walls
+
+    Returns a Trajectory describing where and why the particle stopped
+    """
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        e_field, mag_field, mass, charge, initial_x_velocity,
+        pygame.Rect(area), tolerance, field_map, instrument)
+    particle = mass_spec.get_particle()
+
+    points = [particle.get_pos()] if record else None
+    prev_pos = particle.get_pos()
+    stop_reason = mass_spec.check_collisions()
+    steps = 0
+    time = 0
+
+    while stop_reason is None and steps < max_steps:
+        prev_pos = particle.get_pos()
+        time += mass_spec.move()
+        steps += 1
+        if record:
+            points.append(particle.get_pos())
+        stop_reason = mass_spec.check_collisions()
+
+    if stop_reason is None:
+        stop_reason = TIMEOUT
+
+    return Trajectory(particle.get_pos(), stop_reason, steps, points,
+                      _find_hit_y(mass_spec, stop_reason, prev_pos), time)
+
+class TrajectoryStream():
+    """A class to represent one particle's run, produced lazily.
+
+    Iterating runs the particle a chunk at a time, yielding (n, 5) float64
+    arrays with a row per state and columns STATE_COLUMNS, i.e. (t, x, y,
+    v_x, v_y). The first row is the launch state and the last the state it
+    stopped in; every chunk but the last has chunk rows. Only one chunk is
+    held at a time, so any length of run takes bounded memory.
+
+    Attributes:
+    stop -- Trajectory of where, when and why the particle stopped (without
+            points), or None until iteration has finished
+    _mass_spec -- MassSpectrometer the particle is run in
+    _chunk -- number of states per chunk
+    _max_steps -- number of steps before giving up
+    _started -- whether iteration has begun (a stream runs only once)
+    """
+
+    def __init__(self, mass_spec: mass_spectrometer.MassSpectrometer,
+                 chunk: int, max_steps: int) -> None:
+        """Initialize a TrajectoryStream; use iter_trajectory instead.
+
+        mass_spec -- MassSpectrometer with the particle at its start
+        chunk -- number of states per chunk
+        max_steps -- number of steps before giving up
+        """
+
+        if chunk < 1:
+            raise ValueError('Chunk size must be at least 1')
+
+        self.stop = None
+        self._mass_spec = mass_spec
+        self._chunk = chunk
+        self._max_steps = max_steps
+        self._started = False
+
+    def __iter__(self):
+        """Run the particle, yielding chunks of its states."""
+
+        if self._started:
+            raise RuntimeError('A trajectory stream can only be run once')
+        self._started = True
+
+        mass_spec = self._mass_spec
+        particle = mass_spec.get_particle()
+        buffer = np.empty((self._chunk, len(STATE_COLUMNS)))
+        filled = 0
+
+        prev_pos = particle.get_pos()
+        stop_reason = mass_spec.check_collisions()
+        steps = 0
+        time = 0
+
+        while True:
+            buffer[filled] = (time, *particle.get_pos(),
+                              *particle.get_velocity())
+            filled += 1
+
+            if stop_reason is not None or steps >= self._max_steps:
+                break
+
+            if filled == self._chunk:
+                # a fresh buffer, so consumers may keep the chunk
+                yield buffer
+                buffer = np.empty_like(buffer)
+                filled = 0
+
+            prev_pos = particle.get_pos()
+            time += mass_spec.move()
+            steps += 1
+            stop_reason = mass_spec.check_collisions()
+
+        if stop_reason is None:
+            stop_reason = TIMEOUT
+        self.stop = Trajectory(particle.get_pos(), stop_reason, steps, None,
+                               _find_hit_y(mass_spec, stop_reason, prev_pos),
+                               time)
+        yield buffer[:filled]
+
+def iter_trajectory(e_field: float, mag_field: float, mass: float,
+                    charge: float, initial_x_velocity: float,
+                    chunk: int = CHUNK_SIZE,
+                    area: (float, float, float, float) = DEFAULT_AREA,
+                    max_steps: int = MAX_STEPS, tolerance: float = None,
+                    field_map=None, instrument=None) -> TrajectoryStream:
+    """Stream a particle's run through a mass spectrometer, chunk by chunk,
+    without drawing or keeping the whole run.
+
+    e.g.
+        stream = iter_trajectory(5, -1, 20, 1, 5, chunk=256)
+        for states in stream:
+            writer.write(states)
+        print(stream.stop.stop_reason, stream.stop.hit_y)
+
+    chunk -- number of states per chunk, default CHUNK_SIZE
+    other arguments -- as for run_trajectory, which runs identically
+
+    Returns a TrajectoryStream, which runs as it is iterated over
+    """
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        e_field, mag_field, mass, charge, initial_x_velocity,
+        pygame.Rect(area), tolerance, field_map, instrument)
+    return TrajectoryStream(mass_spec, chunk, max_steps)
+
+def run_hits(e_field, mag_field, mass, charge, initial_x_velocity,
+             area: (float, float, float, float) = DEFAULT_AREA,
+             max_steps: int = MAX_STEPS, groups=None) -> np.ndarray:
+    """Run many particles at once, each with its own parameters, and find
+    where each crossed the detector.
+
+    Every particle moves as run_trajectory would move it alone, so results
+    match its hit_y (to rounding). Once most particles have stopped, the
+    rest are moved on their own, so a few long runs don't hold up the
+    frame cost.
+
+    e_field, mag_field, mass, charge, initial_x_velocity -- arrays (or
+        single values) of each particle's parameters, broadcast together
+    area -- (left, top, width, height) the mass spectrometer takes up
+    max_steps -- number of steps before giving up, default MAX_STEPS
+    groups -- optional array of group labels, broadcast with the
+              parameters, for particles which are only of use if they all
+              land (e.g. several species under one candidate setting);
+              once one misses, the rest of its group are given up on
+              straight away, and every hit in the group is NaN
+
+    Returns an array of detector hit y positions, of the parameters'
+    broadcast shape, NaN where a particle didn't land on the detector
+    """
+
+    params = np.broadcast_arrays(*(np.asarray(value, np.float64)
+                                   for value in (e_field, mag_field, mass,
+                                                 charge, initial_x_velocity)))
+    shape = params[0].shape
+    e_field, mag_field, mass, charge, initial_x_velocity = (
+        param.ravel() for param in params)
+
+    if groups is not None:
+        # relabel as 0 to k - 1, so group failures index an array
+        _, groups = np.unique(np.broadcast_to(groups, shape),
+                              return_inverse=True)
+        groups = groups.ravel()
+        failed = np.zeros(groups.max(initial=-1) + 1, bool)
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        0, 0, 1, 1, 1, pygame.Rect(area))
+    ensemble = mass_spec.launch_ensemble(mass, charge, initial_x_velocity)
+    # which particle (of the flattened parameters) each ensemble entry is
+    index = np.arange(len(ensemble))
+
+    # detector x of each stop reason code, NaN if it isn't a detector; one
+    # past the last reason is for particles given up on with their group
+    reasons = mass_spec.get_stop_reasons()
+    detector_x = np.full(len(reasons) + 1, np.nan)
+    for name in mass_spec.get_detector_names():
+        detector_x[reasons.index(name)] = mass_spec.get_detector_x(name)
+
+    hit_y = np.full(len(ensemble), np.nan)
+    mass_spec.check_ensemble_collisions(ensemble)
+    if groups is not None:
+        failed[groups[~ensemble.get_free()]] = True
+
+    for _ in range(max_steps):
+        free = ensemble.get_free()
+        if not free.any():
+            break
+        if 2 * free.sum() <= len(ensemble):
+            ensemble = ensemble.take(free)
+            index = index[free]
+            free = ensemble.get_free()
+
+        # fields may be arrays, with one value per particle
+        mass_spec.e_field = e_field[index]
+        mass_spec.mag_field = mag_field[index]
+        prev_x = ensemble.x.copy()
+        prev_y = ensemble.y.copy()
+        mass_spec.move_ensemble(ensemble)
+        mass_spec.check_ensemble_collisions(ensemble)
+
+        # only count particles coming back onto the detector face from the
+        # right, as run_trajectory does
+        stopped = np.flatnonzero(free & ~ensemble.get_free())
+        hit_x = detector_x[ensemble.stop_reason[stopped]]
+        landed = stopped[prev_x[stopped] >= hit_x]
+        hit_x = hit_x[prev_x[stopped] >= hit_x]
+
+        start_x, end_x = prev_x[landed], ensemble.x[landed]
+        moved = start_x != end_x
+        fraction = np.clip((start_x - hit_x) /
+                           np.where(moved, start_x - end_x, 1), 0, 1)
+        hit_y[index[landed]] = np.where(
+            moved, prev_y[landed] + fraction * (ensemble.y[landed] -
+                                                prev_y[landed]),
+            ensemble.y[landed])
+
+        if groups is not None:
+            # give up on every particle whose group has one which missed
+            missed = stopped[~(prev_x[stopped] >= detector_x[
+                ensemble.stop_reason[stopped]])]
+            failed[groups[index[missed]]] = True
+            ensemble.stop(failed[groups[index]], len(reasons))
+
+    if groups is not None:
+        hit_y[failed[groups]] = np.nan
+    return hit_y.reshape(shape)
+
+def _find_hit_y(mass_spec: mass_spectrometer.MassSpectrometer,
+                stop_reason: str, prev_pos: (float, float)) -> float:
+    """Find where a stopped particle crossed the detector.
+
+    mass_spec -- MassSpectrometer the particle stopped in
+    stop_reason -- name of what stopped it
+    prev_pos -- (x, y) position a step before it stopped
+
+    Returns the y position of the crossing, or None if it didn't land on
+    the detector
+    """
+
+    # only count particles coming back onto the detector face from the right
+    if (stop_reason in mass_spec.get_detector_names() and
+        prev_pos[0] >= mass_spec.get_detector_x(stop_reason)):
+        return _crossing_y(prev_pos, mass_spec.get_particle().get_pos(),
+                           mass_spec.get_detector_x(stop_reason))
+    return None
+
+def _crossing_y(start: (float, float), end: (float, float),
+                x: float) -> float:
+    """Find where a straight step crosses a vertical line.
+
+    start, end -- (x, y) positions at either end of the step
+    x -- x position of the vertical line
+
+    Returns the y position of the crossing, clamped onto the step
+    """
+
+    if start[0] == end[0]:
+        return end[1]
+
+    fraction = min(max((start[0] - x) / (start[0] - end[0]), 0), 1)
+    return start[1] + fraction * (end[1] - start[1])
@@ -0,0 +1,404 @@
+"""simulation_service.py: for querying the simulator over a local socket
+
+Other tools can send batches of particle/field parameters and get back
+where (and optionally how) each particle travelled, without the pygame UI.
+
+Protocol is JSON lines. Each request line looks like
+    {"id": 1, "runs": [{"e_field": 5, "mag_field": -1, "mass": 20,
+                        "charge": 1, "initial_x_velocity": 5}, ...],
+     "trajectory": false, "max_steps": 10000, "tolerance": null}
+and is answered by one line per run, in order,
+    {"id": 1, "index": 0, "stop_pos": [x, y], "stop_reason": "...",
+     "steps": n, "hit_y": y or null, "trajectory": [[x, y], ...]}
+followed by {"id": 1, "done": true, "count": n}. A bad request is answered
+with {"id": 1, "error": "..."} instead.
+
+If a request gives a tolerance, each trajectory is sent compressed to
+within it (see trajectory_codec), as "trajectory_codes": [...] and
+"quantum": q instead of "trajectory"; SimulationClient decompresses them.
+
+Classes:
+SimulationServer -- asyncio server running requests on an executor
+SimulationClient -- asyncio client for a SimulationServer
+
+Methods:
+main -- serve on DEFAULT_HOST:DEFAULT_PORT until interrupted
+
+Constants:
+DEFAULT_HOST, DEFAULT_PORT -- where the service listens by default
+MAX_CONCURRENCY -- default number of runs simulated at once
+QUEUE_SIZE -- default length of each connection's bounded queues
+RUN_PARAMS -- parameters every run must give
+"""
+
+import asyncio, functools, json, math
+import simulation, trajectory_codec
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+MAX_CONCURRENCY = 4
+QUEUE_SIZE = 64
+
+RUN_PARAMS = ('e_field', 'mag_field', 'mass', 'charge', 'initial_x_velocity')
+
+# marks the end of a connection's queues
+_END = None
+
+class SimulationServer():
+    """A class to represent the simulation service.
+
+    Each connection gets a bounded request queue and a bounded result queue,
+    so a client which sends faster than it reads is eventually stopped from
+    sending. Across all connections at most max_concurrency runs are on the
+    executor at once; each run is formatted (and compressed) there too, so
+    the event loop only writes finished responses.
+
+    Attributes:
+    _host, _port -- TCP address to listen on, if not using a Unix socket
+    _path -- Unix socket path to listen on, or None for TCP
+    _queue_size -- length of each connection's bounded queues
+    _executor -- executor runs are simulated on, None for the loop's default
+    _semaphore -- limits how many runs are on the executor at once
+    _server -- underlying asyncio Server, once started
+
+    Methods:
+    start -- start listening
+    close -- stop listening and wait for the server to shut down
+    get_address -- getter for the address actually listened on
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 path: str = None, max_concurrency: int = MAX_CONCURRENCY,
+                 queue_size: int = QUEUE_SIZE, executor=None) -> None:
+        """Initialize a SimulationServer.
+
+        host, port -- TCP address to listen on, port 0 picks a free one
+        path -- Unix socket path to listen on instead of TCP, default None
+        max_concurrency -- number of runs simulated at once
+        queue_size -- length of each connection's bounded queues
+        executor -- concurrent.futures executor to simulate on
+                    default None uses the event loop's default executor
+        """
+
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1')
+        if queue_size < 1:
+            raise ValueError('queue_size must be at least 1')
+
+        self._host = host
+        self._port = port
+        self._path = path
+        self._queue_size = queue_size
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._server = None
+
+    async def start(self) -> None:
+        """Start listening for connections."""
+
+        if self._path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, self._path)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, self._host, self._port)
+
+    async def close(self) -> None:
+        """Stop listening and wait for the server to shut down."""
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def get_address(self):
+        """Get the address listened on: (host, port) or a socket path."""
+
+        if self._path is not None:
+            return self._path
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        """Serve one client connection until it closes.
+
+        reader, writer -- streams for the connection
+        """
+
+        requests = asyncio.Queue(self._queue_size)
+        results = asyncio.Queue(self._queue_size)
+
+        dispatcher = asyncio.ensure_future(
+            self._dispatch(requests, results))
+        sender = asyncio.ensure_future(self._send(results, writer))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # blocks once the queue is full, which stops reading the
+                # socket and so pushes back on the client
+                await requests.put(line)
+            await requests.put(_END)
+            await asyncio.gather(dispatcher, sender)
+        except ConnectionError:
+            # the client has gone, so there is no one left to answer
+            pass
+        finally:
+            # also reached on cancellation, which then carries on up
+            dispatcher.cancel()
+            sender.cancel()
+            writer.close()
+
+    async def _dispatch(self, requests: asyncio.Queue,
+                        results: asyncio.Queue) -> None:
+        """Turn request lines into runs on the executor, in order.
+
+        requests -- queue of raw request lines
+        results -- queue of responses, or futures which will give them
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            line = await requests.get()
+            if line is _END:
+                await results.put(_END)
+                return
+
+            try:
+                request_id, runs, record, max_steps, tolerance = \
+                    _parse_request(line)
+            except (ValueError, TypeError, KeyError) as error:
+                await results.put({'id': _request_id(line),
+                                   'error': str(error)})
+                continue
+
+            for index, run in enumerate(runs):
+                # at most max_concurrency runs are on the executor at once
+                await self._semaphore.acquire()
+                future = loop.run_in_executor(
+                    self._executor, functools.partial(
+                        _run_and_format, request_id, index, run, max_steps,
+                        record, tolerance))
+                future.add_done_callback(
+                    lambda _: self._semaphore.release())
+                await results.put((request_id, index, future))
+
+            await results.put({'id': request_id, 'done': True,
+                               'count': len(runs)})
+
+    async def _send(self, results: asyncio.Queue,
+                    writer: asyncio.StreamWriter) -> None:
+        """Write responses to the client as they become ready, in order.
+
+        results -- queue of responses, or futures which will give them
+        writer -- stream to write to
+        """
+
+        while True:
+            result = await results.get()
+            if result is _END:
+                return
+
+            if isinstance(result, tuple):
+                request_id, index, future = result
+                try:
+                    result = await future
+                except Exception as error:
+                    result = {'id': request_id, 'index': index,
+                              'error': str(error)}
+
+            writer.write(json.dumps(result).encode() + b'\n')
+            # waits for a slow client to catch up
+            await writer.drain()
+
+class SimulationClient():
+    """A class to represent a connection to a SimulationServer.
+
+    Attributes:
+    _reader, _writer -- streams for the connection
+    _next_id -- id to give the next request
+
+    Methods:
+    connect -- open a connection (classmethod, awaitable)
+    simulate -- send one batch, yielding results as they arrive
+    close -- close the connection
+    """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        """Initialize a SimulationClient; use connect instead.
+
+        reader, writer -- streams for an open connection
+        """
+
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+
+    @classmethod
+    async def connect(cls, host: str = DEFAULT_HOST,
+                      port: int = DEFAULT_PORT, path: str = None):
+        """Open a connection to a SimulationServer.
+
+        host, port -- TCP address of the server
+        path -- Unix socket path of the server instead, default None
+
+        Returns a connected SimulationClient
+        """
+
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def simulate(self, runs: list, trajectory: bool = False,
+                       max_steps: int = simulation.MAX_STEPS,
+                       tolerance: float = None):
+        """Send one batch of runs, yielding each result as it arrives.
+
+        runs -- list of dicts, each giving every parameter in RUN_PARAMS
+        trajectory -- whether to also get every position, default False
+        max_steps -- number of frames before a run is given up on
+        tolerance -- most a received position may be from the simulated
+                     one, trading accuracy for a much smaller response;
+                     default None sends positions exactly
+
+        Yields one result dict per run, in order
+        """
+
+        request_id = self._next_id
+        self._next_id += 1
+
+        request = {'id': request_id, 'runs': runs,
+                   'trajectory': trajectory, 'max_steps': max_steps,
+                   'tolerance': tolerance}
+        self._writer.write(json.dumps(request).encode() + b'\n')
+        await self._writer.drain()
+
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                raise ConnectionError('Server closed the connection')
+
+            response = json.loads(line)
+            if 'error' in response and 'index' not in response:
+                raise ValueError(response['error'])
+            if response.get('done'):
+                return
+            if 'trajectory_codes' in response:
+                response['trajectory'] = \
+                    trajectory_codec.CompressedTrajectory.from_array(
+                        response.pop('trajectory_codes'),
+                        response.pop('quantum')).decompress().tolist()
+            yield response
+
+    async def close(self) -> None:
+        """Close the connection."""
+
+        self._writer.close()
+        await self._writer.wait_closed()
+
+def _parse_request(line: bytes) -> (object, list, bool, int, float):
+    """Parse and check a request line.
+
+    line -- raw request line
+
+    Returns (id, runs, whether to record, max steps, tolerance or None)
+    """
+
+    request = json.loads(line)
+    runs = request['runs']
+
+    if not isinstance(runs, list):
+        raise TypeError('runs must be a list')
+    for run in runs:
+        for param in RUN_PARAMS:
+            if param not in run:
+                raise ValueError('Missing run parameter ' + param)
+            if not _is_number(run[param]):
+                raise TypeError(param + ' must be a number')
+        if run['mass'] <= 0:
+            raise ValueError('Mass must be positive')
+        if run['initial_x_velocity'] <= 0:
+            raise ValueError('Initial x velocity must be positive')
+
+    tolerance = request.get('tolerance')
+    if tolerance is not None:
+        if not _is_number(tolerance):
+            raise TypeError('tolerance must be a number')
+        # json reads NaN and Infinity, which no tolerance can be
+        if not math.isfinite(tolerance) or tolerance <= 0:
+            raise ValueError('Tolerance must be positive and finite')
+
+    return (request.get('id'), runs, bool(request.get('trajectory', False)),
+            int(request.get('max_steps', simulation.MAX_STEPS)), tolerance)
+
+def _is_number(value) -> bool:
+    """Check a parsed JSON value is a number, and not true or false."""
+
+    return (isinstance(value, (int, float)) and
+            not isinstance(value, bool))
+
+def _request_id(line: bytes):
+    """Find a request's id, if possible, to report an error with."""
+
+    try:
+        return json.loads(line).get('id')
+    except (ValueError, AttributeError):
+        return None
+
+def _run_and_format(request_id, index: int, run: dict, max_steps: int,
+                    record: bool, tolerance: float = None) -> dict:
+    """Simulate one run and convert it into a response dict, on the
+    executor."""
+
+    trajectory = simulation.run_trajectory(
+        *(run[param] for param in RUN_PARAMS), max_steps=max_steps,
+        record=record)
+    return _format_trajectory(request_id, index, trajectory, tolerance)
+
+def _format_trajectory(request_id, index: int,
+                       trajectory: simulation.Trajectory,
+                       tolerance: float = None) -> dict:
+    """Convert a Trajectory into a response dict, compressing its points
+    if given a tolerance."""
+
+    result = {'id': request_id, 'index': index,
+              'stop_pos': list(trajectory.stop_pos),
+              'stop_reason': trajectory.stop_reason,
+              'steps': trajectory.steps, 'hit_y': trajectory.hit_y}
+    if trajectory.points is not None and tolerance is not None:
+        compressed = trajectory_codec.compress(trajectory.points, tolerance)
+        result['trajectory_codes'] = compressed.to_array().tolist()
+        result['quantum'] = compressed.quantum
+    elif trajectory.points is not None:
+        result['trajectory'] = [list(point) for point in trajectory.points]
+    return result
+
+async def _serve_forever(host: str, port: int) -> None:
+    """Serve on the given address until cancelled."""
+
+    server = SimulationServer(host, port)
+    await server.start()
+    print('Serving on', server.get_address())
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+def main() -> None:
+    """Serve on DEFAULT_HOST:DEFAULT_PORT until interrupted."""
+
+    try:
+        asyncio.run(_serve_forever(DEFAULT_HOST, DEFAULT_PORT))
+    except KeyboardInterrupt:
+        pass
+
+# serve if running this script
+if __name__ == "__main__":
+    main()
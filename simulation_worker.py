@@ -0,0 +1,383 @@
+"""simulation_worker.py: for running ensemble physics in another process
+
+The worker process moves a ParticleEnsemble and publishes particle
+positions into a double-buffered shared memory block. The UI process draws
+straight from that block, without copying or pickling, so slow physics
+never stalls input handling or drawing.
+
+Shared memory layout:
+header -- HEADER_SIZE int64s, indexed by the _FRONT etc. constants
+buffers -- two (4, capacity) float64 arrays of (x, y, charge, free) rows,
+           free being 1 for particles still moving; the worker writes the
+           back one while the UI reads the front one
+
+Classes:
+SimulationWorker -- UI-side handle on a physics worker process, used like
+                    a MassSpectrometer
+
+Constants:
+HEADER_SIZE -- number of int64s before the buffers
+MAX_LAG -- most frames the worker may fall behind before skipping ahead
+"""
+
+import multiprocessing, queue
+from multiprocessing import shared_memory
+import pygame
+import numpy as np
+import mass_spectrometer, particle_renderer, beam_study, density_map
+
+# required initialization step
+pygame.init()
+
+HEADER_SIZE = 8
+MAX_LAG = 30
+
+# header entries: buffer the UI should read, buffer the UI is reading (-1
+# for none), frames published, frames requested by the UI, particle count
+# in each buffer
+_FRONT = 0
+_READING = 1
+_PUBLISHED = 2
+_REQUESTED = 3
+_COUNTS = 4
+
+# rows of each buffer: x, y, charge, free
+_ROWS = 4
+
+# seconds the worker waits for a command when it has nothing to do
+_IDLE_WAIT = 0.002
+
+def _map_block(block: shared_memory.SharedMemory, capacity: int
+               ) -> (np.ndarray, np.ndarray):
+    """Get (header, buffers) views of a shared memory block."""
+
+    header = np.ndarray(HEADER_SIZE, np.int64, block.buf)
+    buffers = np.ndarray((2, _ROWS, capacity), np.float64, block.buf,
+                         HEADER_SIZE * np.dtype(np.int64).itemsize)
+    return header, buffers
+
+def _launch(mass_spec: mass_spectrometer.MassSpectrometer, settings: dict,
+            rng: np.random.Generator, count: int):
+    """Launch a fresh ensemble with the current settings."""
+
+    distribution = beam_study.BeamDistribution(
+        settings['mass'], settings['charge'],
+        settings['initial_x_velocity'], settings['speed_spread'],
+        settings['y_spread'], settings['angle_spread'])
+    mass, charge, y_offset, v_x, v_y = distribution.sample(rng, count)
+    return mass_spec.launch_ensemble(mass, charge, v_x, y_offset, v_y)
+
+def _publish(header: np.ndarray, buffers: np.ndarray, lock,
+             ensemble) -> bool:
+    """Write an ensemble's positions to the back buffer and flip it to
+    the front, unless the UI is still reading it from before the last flip.
+
+    Returns whether the positions were published
+    """
+
+    with lock:
+        back = 1 - header[_FRONT]
+        if header[_READING] == back:
+            return False
+
+    # the UI only reads the front buffer, so this needs no lock
+    buffers[back, 0, :len(ensemble)] = ensemble.x
+    buffers[back, 1, :len(ensemble)] = ensemble.y
+    buffers[back, 2, :len(ensemble)] = ensemble.charge
+    buffers[back, 3, :len(ensemble)] = ensemble.get_free()
+
+    with lock:
+        header[_COUNTS + back] = len(ensemble)
+        header[_FRONT] = back
+        header[_PUBLISHED] += 1
+    return True
+
+def _run_worker(block_name: str, capacity: int, lock, commands,
+                area: tuple, settings: dict) -> None:
+    """Body of the worker process: move the ensemble a frame for every
+    frame the UI requests, publishing positions after each.
+
+    block_name -- name of the shared memory block
+    capacity -- number of particles
+    lock -- Lock guarding the header's _FRONT and _READING
+    commands -- Queue of (command, value) tuples from the UI
+    area -- (left, top, width, height) of the mass spectrometer
+    settings -- dict of starting fields, particle parameters and spreads
+    """
+
+    block = shared_memory.SharedMemory(block_name)
+    header, buffers = _map_block(block, capacity)
+
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        settings['e_field'], settings['mag_field'], settings['mass'],
+        settings['charge'], settings['initial_x_velocity'],
+        pygame.Rect(area))
+    rng = np.random.default_rng()
+    ensemble = _launch(mass_spec, settings, rng, capacity)
+    _publish(header, buffers, lock, ensemble)
+    done = header[_REQUESTED]
+
+    while True:
+        # wait for a command only when there are no frames to move
+        try:
+            if done >= header[_REQUESTED]:
+                command, value = commands.get(timeout=_IDLE_WAIT)
+            else:
+                command, value = commands.get_nowait()
+        except queue.Empty:
+            command = None
+
+        if command == 'stop':
+            break
+        elif command == 'reset':
+            ensemble = _launch(mass_spec, settings, rng, capacity)
+        elif command in ('e_field', 'mag_field'):
+            setattr(mass_spec, command, value)
+        elif command is not None:
+            settings[command] = value
+            # mass & charge apply to particles already flying too
+            if command == 'mass':
+                ensemble.mass[:] = value
+            elif command == 'charge':
+                ensemble.charge[:] = value
+
+        if command is None and done < header[_REQUESTED]:
+            # if physics can't keep up, skip ahead rather than fall behind
+            done = max(done + 1, header[_REQUESTED] - MAX_LAG)
+            mass_spec.move_ensemble(ensemble)
+            mass_spec.check_ensemble_collisions(ensemble)
+            _publish(header, buffers, lock, ensemble)
+        elif command == 'reset':
+            _publish(header, buffers, lock, ensemble)
+
+    del header, buffers
+    block.close()
+
+class SimulationWorker():
+    """A class to represent a physics worker process, driven by the UI.
+
+    Stands in for a MassSpectrometer in runner: move, draw, reset_particle
+    and the setters work the same, but for a whole ensemble of particles
+    moved in another process. Setters travel over a command queue; move
+    just asks for one more frame, so the UI never waits on physics.
+
+    Attributes:
+    _block -- SharedMemory block shared with the worker
+    _header -- int64 view of the block's header
+    _buffers -- float64 view of the block's two position buffers
+    _lock -- Lock guarding the header's front and reading entries
+    _commands -- Queue of commands to the worker
+    _process -- the worker Process
+    _mass_spec -- local MassSpectrometer, for the walls
+    _renderer -- ParticleRenderer particles are drawn with
+    _e_field, _mag_field -- last field strengths sent to the worker
+    _density_map -- DensityMap published frames are binned into and drawn
+                    over the particles, or None for no heatmap
+    _binned -- published frame count when the map was last binned into
+
+    Methods:
+    move -- ask the worker for one more frame
+    draw -- draws the walls, the latest published particles and heatmap
+    reset_particle -- relaunch every particle, clearing any heatmap
+    set_density_map, get_density_map -- setter & getter for _density_map
+    set_mass, set_charge, set_initial_x_velocity -- update parameters
+    e_field, mag_field -- field strengths, sent to the worker when set
+    get_published -- number of frames published so far
+    read_positions -- context manager giving (x, y, charge, free) views
+    close -- stop the worker and free the shared memory
+    """
+
+    def __init__(self, e_field: int, mag_field: int, mass: int,
+                 charge: int, initial_x_velocity: int, area: pygame.Rect,
+                 count: int, y_spread: float = 0, speed_spread: float = 0,
+                 angle_spread: float = 0) -> None:
+        """Initialize a SimulationWorker, starting its process.
+
+        e_field, mag_field, mass, charge, initial_x_velocity, area -- as
+            for MassSpectrometer
+        count -- number of particles launched at once
+        y_spread, speed_spread, angle_spread -- spreads of the launch as
+            for BeamDistribution, default 0
+        """
+
+        if count <= 0:
+            raise ValueError('Particle count must be positive')
+
+        self._mass_spec = mass_spectrometer.MassSpectrometer(
+            e_field, mag_field, mass, charge, initial_x_velocity, area)
+        self._renderer = particle_renderer.ParticleRenderer()
+        self._e_field = e_field
+        self._mag_field = mag_field
+        self._density_map = None
+        self._binned = -1
+
+        size = (HEADER_SIZE * np.dtype(np.int64).itemsize +
+                2 * _ROWS * count * np.dtype(np.float64).itemsize)
+        self._block = shared_memory.SharedMemory(create=True, size=size)
+        self._header, self._buffers = _map_block(self._block, count)
+        self._header[:] = 0
+        self._header[_READING] = -1
+
+        # spawn, so the worker doesn't inherit the UI's display
+        context = multiprocessing.get_context('spawn')
+        self._lock = context.Lock()
+        self._commands = context.Queue()
+        settings = {'e_field': e_field, 'mag_field': mag_field,
+                    'mass': mass, 'charge': charge,
+                    'initial_x_velocity': initial_x_velocity,
+                    'y_spread': y_spread, 'speed_spread': speed_spread,
+                    'angle_spread': angle_spread}
+        self._process = context.Process(
+            target=_run_worker, daemon=True,
+            args=(self._block.name, count, self._lock, self._commands,
+                  tuple(area), settings))
+        self._process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def move(self) -> None:
+        """Ask the worker for one more frame; returns immediately."""
+
+        # only the UI writes this entry, so no lock is needed
+        self._header[_REQUESTED] += 1
+
+    def read_positions(self):
+        """Context manager giving (x, y, charge, free) views of the latest
+        published particles, valid until it exits; its published attribute
+        is then the number of frames published up to them.
+
+        The worker won't write the buffer being read, so hold it briefly.
+        """
+
+        return _PositionReader(self)
+
+    def draw(self, screen: pygame.Surface) -> None:
+        """Draw the walls, the latest published particles and the heatmap,
+        if any, onto a given Surface."""
+
+        reader = self.read_positions()
+        with reader as (x, y, charge, free):
+            self._renderer.draw(screen, x, y, charge)
+            # each frame is binned once, however often it's drawn, as
+            # DensityMap.add_ensemble would bin it
+            if self._density_map is not None and \
+                    reader.published != self._binned:
+                moving = free > 0
+                self._density_map.add(x[moving], y[moving])
+                self._binned = reader.published
+
+        if self._density_map is not None:
+            self._density_map.draw(screen)
+
+        # draw each wall
+        for obstacle in self._mass_spec.get_geometry().get_obstacles():
+            pygame.draw.rect(screen, mass_spectrometer.WALL_COLOR,
+                             obstacle.rect)
+
+    def reset_particle(self) -> None:
+        """Relaunch every particle from the start position."""
+
+        self._commands.put(('reset', None))
+        if self._density_map is not None:
+            self._density_map.clear()
+
+    def set_density_map(self, new_density_map: density_map.DensityMap
+                        ) -> None:
+        """Set the DensityMap frames are binned into from now on and drawn
+        over the particles, or None to stop."""
+
+        self._density_map = new_density_map
+        # the frame on screen now is binned at the next draw
+        self._binned = -1
+
+    def get_density_map(self) -> density_map.DensityMap:
+        """Getter for the DensityMap frames are binned into, or None."""
+
+        return self._density_map
+
+    def set_mass(self, new_mass: int) -> None:
+        """Update mass."""
+
+        if new_mass <= 0:
+            raise ValueError("Mass must be positive")
+        self._commands.put(('mass', new_mass))
+
+    def set_charge(self, new_charge: int) -> None:
+        """Update charge."""
+
+        self._commands.put(('charge', new_charge))
+
+    def set_initial_x_velocity(self, new_initial_x_velocity: int) -> None:
+        """Update initial x velocity, used from the next reset."""
+
+        if new_initial_x_velocity <= 0:
+            raise ValueError("Initial x velocity must be positive")
+        self._commands.put(('initial_x_velocity', new_initial_x_velocity))
+
+    @property
+    def e_field(self) -> int:
+        """Electric field strength, positive is down."""
+
+        return self._e_field
+
+    @e_field.setter
+    def e_field(self, new_e_field: int) -> None:
+        self._e_field = new_e_field
+        self._commands.put(('e_field', new_e_field))
+
+    @property
+    def mag_field(self) -> int:
+        """Magnetic field strength, positive is out of page."""
+
+        return self._mag_field
+
+    @mag_field.setter
+    def mag_field(self, new_mag_field: int) -> None:
+        self._mag_field = new_mag_field
+        self._commands.put(('mag_field', new_mag_field))
+
+    def get_published(self) -> int:
+        """Get the number of frames the worker has published."""
+
+        return int(self._header[_PUBLISHED])
+
+    def close(self) -> None:
+        """Stop the worker and free the shared memory."""
+
+        if self._process is None:
+            return
+
+        self._commands.put(('stop', None))
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+        del self._header, self._buffers
+        self._block.close()
+        self._block.unlink()
+
+class _PositionReader():
+    """Context manager marking the front buffer as being read."""
+
+    def __init__(self, worker: SimulationWorker) -> None:
+        self._worker = worker
+        self.published = None
+
+    def __enter__(self) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        worker = self._worker
+        with worker._lock:
+            front = int(worker._header[_FRONT])
+            worker._header[_READING] = front
+            count = int(worker._header[_COUNTS + front])
+            # flipped with the front buffer, so always matches it
+            self.published = int(worker._header[_PUBLISHED])
+        return tuple(worker._buffers[front, :, :count])
+
+    def __exit__(self, *exc_info) -> None:
+        with self._worker._lock:
+            self._worker._header[_READING] = -1
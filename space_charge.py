@@ -0,0 +1,184 @@
+"""space_charge.py: for a SpaceCharge class
+
+Particles push and pull on each other with the Coulomb force,
+F = k q1 q2 r / (r^2 + eps^2)^(3/2), softened by eps so that two particles
+passing through each other (as they can, moving a whole frame at a time)
+don't fling each other off.
+
+Classes:
+SpaceCharge -- Coulomb forces between every particle in an ensemble
+
+Constants:
+PAIRWISE -- method name for exact O(N^2) pairwise sums
+MESH -- method name for the O(N + G log G) particle-mesh solver
+CELL_SIZE -- default mesh cell size, in pixels
+MAX_MESH_CELLS -- largest number of cells along either side of the mesh
+PAIRWISE_CHUNK -- number of particles summed over at once in PAIRWISE mode
+"""
+
+import numpy as np
+
+PAIRWISE = 'pairwise'
+MESH = 'mesh'
+
+CELL_SIZE = 4
+MAX_MESH_CELLS = 1024
+PAIRWISE_CHUNK = 1024
+
+class SpaceCharge():
+    """A class to represent Coulomb interaction between particles.
+
+    The mesh method spreads charge onto a grid (cloud-in-cell), convolves it
+    with the softened Coulomb force by FFT, padded so the grid doesn't wrap
+    around, and reads the field back at each particle the same way. Cost
+    is linear in particles plus G log G in grid cells, and it is accurate
+    to within a cell or so; smaller cells are more accurate but slower.
+    The pairwise method sums every pair exactly, as a reference.
+
+    Attributes:
+    method -- PAIRWISE or MESH
+    cell_size -- mesh cell size, in pixels; the accuracy knob for MESH
+    softening -- softening length eps, in pixels
+    coulomb_constant -- k, strength of the interaction
+
+    Methods:
+    forces -- (f_x, f_y) on every particle from every other particle
+    """
+
+    def __init__(self, method: str = MESH, cell_size: float = CELL_SIZE,
+                 softening: float = None,
+                 coulomb_constant: float = 1) -> None:
+        """Initialize a SpaceCharge.
+
+        method -- PAIRWISE or MESH, default MESH
+        cell_size -- mesh cell size in pixels, default CELL_SIZE
+        softening -- softening length in pixels, default None uses
+                     cell_size, below which the mesh can't resolve anyway
+        coulomb_constant -- k, strength of the interaction, default 1
+        """
+
+        if method not in (PAIRWISE, MESH):
+            raise ValueError('Method must be PAIRWISE or MESH')
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+
+        self.method = method
+        self.cell_size = cell_size
+        self.softening = cell_size if softening is None else softening
+        self.coulomb_constant = coulomb_constant
+
+    def forces(self, x: np.ndarray, y: np.ndarray,
+               charge: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Calculate the force on every particle from every other one.
+
+        x, y -- arrays of particle positions
+        charge -- array of particle charges
+
+        Returns (f_x, f_y) arrays, one force per particle
+        """
+
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        charge = np.asarray(charge, np.float64)
+
+        if len(x) < 2:
+            return np.zeros(len(x)), np.zeros(len(x))
+
+        if self.method == PAIRWISE:
+            field_x, field_y = self._pairwise_field(x, y, charge)
+        else:
+            field_x, field_y = self._mesh_field(x, y, charge)
+
+        return charge * field_x, charge * field_y
+
+    def _kernel(self, d_x: np.ndarray, d_y: np.ndarray
+                ) -> (np.ndarray, np.ndarray):
+        """Get the field at offset (d_x, d_y) from a unit charge."""
+
+        distance_sq = d_x * d_x + d_y * d_y + self.softening ** 2
+        scale = self.coulomb_constant / (distance_sq * np.sqrt(distance_sq))
+        return d_x * scale, d_y * scale
+
+    def _pairwise_field(self, x: np.ndarray, y: np.ndarray,
+                        charge: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Sum the field at every particle exactly, PAIRWISE_CHUNK at a time.
+
+        A particle's field on itself is zero since its offset is (0, 0).
+        """
+
+        field_x = np.zeros(len(x))
+        field_y = np.zeros(len(x))
+
+        for start in range(0, len(x), PAIRWISE_CHUNK):
+            chunk = slice(start, start + PAIRWISE_CHUNK)
+            kernel_x, kernel_y = self._kernel(x[chunk, None] - x[None, :],
+                                              y[chunk, None] - y[None, :])
+            field_x[chunk] = kernel_x @ charge
+            field_y[chunk] = kernel_y @ charge
+
+        return field_x, field_y
+
+    def _mesh_field(self, x: np.ndarray, y: np.ndarray,
+                    charge: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Find the field at every particle through a particle mesh."""
+
+        # mesh covers every particle, with a spare cell for the
+        # cloud-in-cell weights of the last row/column
+        cell_size = self.cell_size
+        origin_x, origin_y = x.min(), y.min()
+        span = max(x.max() - origin_x, y.max() - origin_y)
+        if span / cell_size + 2 > MAX_MESH_CELLS:
+            # too fine for memory, so spread particles over coarser cells
+            cell_size = span / (MAX_MESH_CELLS - 2)
+
+        cells_x = int((x.max() - origin_x) / cell_size) + 2
+        cells_y = int((y.max() - origin_y) / cell_size) + 2
+
+        indices, weights = _cloud_in_cell((x - origin_x) / cell_size,
+                                          (y - origin_y) / cell_size,
+                                          cells_y)
+        density = np.bincount(indices.ravel(),
+                              (weights * charge[:, None]).ravel(),
+                              cells_x * cells_y).reshape(cells_x, cells_y)
+
+        # field is sampled at every offset from -(cells - 1) to cells - 1,
+        # laid out the way the FFT expects, so the padded convolution is
+        # exactly the free-space (non-wrapping) sum
+        offsets_x = np.fft.fftfreq(2 * cells_x, 1 / (2 * cells_x))
+        offsets_y = np.fft.fftfreq(2 * cells_y, 1 / (2 * cells_y))
+        kernel_x, kernel_y = self._kernel(
+            offsets_x[:, None] * cell_size, offsets_y[None, :] * cell_size)
+
+        shape = (2 * cells_x, 2 * cells_y)
+        density_fft = np.fft.rfft2(density, shape)
+        mesh_x = np.fft.irfft2(density_fft * np.fft.rfft2(kernel_x), shape)
+        mesh_y = np.fft.irfft2(density_fft * np.fft.rfft2(kernel_y), shape)
+
+        # read the field back with the same weights it was spread with,
+        # which also cancels each particle's field on itself
+        mesh_x = mesh_x[:cells_x, :cells_y].ravel()
+        mesh_y = mesh_y[:cells_x, :cells_y].ravel()
+        return ((mesh_x[indices] * weights).sum(axis=1),
+                (mesh_y[indices] * weights).sum(axis=1))
+
+def _cloud_in_cell(grid_x: np.ndarray, grid_y: np.ndarray,
+                   cells_y: int) -> (np.ndarray, np.ndarray):
+    """Find the four mesh cells each particle is spread over.
+
+    grid_x, grid_y -- particle positions in cells from the mesh origin
+    cells_y -- number of cells along y, for flattening indices
+
+    Returns (flat cell indices, weights), both of shape (n, 4)
+    """
+
+    cell_x = np.floor(grid_x).astype(np.int64)
+    cell_y = np.floor(grid_y).astype(np.int64)
+    frac_x = grid_x - cell_x
+    frac_y = grid_y - cell_y
+
+    base = cell_x * cells_y + cell_y
+    indices = np.stack((base, base + 1, base + cells_y, base + cells_y + 1),
+                       axis=1)
+    weights = np.stack(((1 - frac_x) * (1 - frac_y), (1 - frac_x) * frac_y,
+                        frac_x * (1 - frac_y), frac_x * frac_y), axis=1)
+    return indices, weights
@@ -0,0 +1,12 @@
+"""conftest.py: shared setup for the tests
+
+The modules live flat at the top of the repository, so it is put on the
+path; pygame is given a dummy video driver, so no window ever opens.
+"""
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
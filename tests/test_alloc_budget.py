@@ -0,0 +1,41 @@
+"""test_alloc_budget.py: tests that simulator frames stay within their
+allocation budget"""
+
+import pygame
+import alloc_profile, mass_spectrometer, simulation
+
+WARMUP = 20
+FRAMES = 200
+
+def test_steady_state_frames_within_budget():
+    profiler = alloc_profile.measure_simulator_frames(FRAMES, WARMUP)
+
+    assert len(profiler.frames) == FRAMES
+    assert alloc_profile.check_frame_budget(profiler) == []
+
+def test_allocating_frames_go_over_budget():
+    mass_spec = mass_spectrometer.MassSpectrometer(
+        5, -1, 20, 1, 5, pygame.Rect(simulation.DEFAULT_AREA))
+    screen = pygame.Surface(mass_spec.get_area().size)
+    profiler = alloc_profile.AllocationProfiler()
+    kept = []
+
+    for frame in range(WARMUP + FRAMES):
+        if frame == WARMUP:
+            profiler.start()
+        with profiler.phase('draw'):
+            mass_spec.draw(screen)
+            # a per-frame rebuild that is never let go of
+            kept.append([bytearray(alloc_profile.FRAME_BUDGET)
+                         for _ in range(alloc_profile.BLOCK_BUDGET)])
+        if mass_spec.get_particle().is_stopped():
+            mass_spec.reset_particle()
+        else:
+            with profiler.phase('physics'):
+                mass_spec.move()
+        profiler.end_frame()
+    profiler.stop()
+
+    failures = alloc_profile.check_frame_budget(profiler)
+    assert any('allocated' in failure for failure in failures)
+    assert any('blocks each' in failure for failure in failures)
@@ -0,0 +1,48 @@
+"""test_field_optimizer.py: tests of the field optimizer and the mass
+derivative its resolving power comes from"""
+
+import numpy as np
+import field_optimizer, sensitivity
+
+SPECIES = [(20, 1), (25, 1)]
+
+# where only just landing: the lighter species misses with its mass 1%
+# lower, or either field or the velocity 1% higher
+EDGE_SETTING = (-5, 1.67, 4.35)
+
+def _points(setting) -> np.ndarray:
+    """Get sensitivity base points of every species under a setting."""
+
+    e_field, mag_field, velocity = setting
+    mass, charge = np.transpose(SPECIES)
+    return np.column_stack(np.broadcast_arrays(e_field, mag_field, mass,
+                                               charge, velocity))
+
+def test_hit_derivative_falls_back_to_one_side():
+    points = _points(EDGE_SETTING)
+    _, jacobian, valid = sensitivity.landing_sensitivity(points)
+    hits, hit_by_mass = sensitivity.hit_derivative(points, 'mass')
+
+    assert not valid[0]
+    assert np.isfinite(hit_by_mass).all()
+    # matches the central difference where both sides land
+    mass_column = sensitivity.PARAMETERS.index('mass')
+    assert hit_by_mass[1] == jacobian[1, mass_column]
+
+def test_margin_rejects_edge_settings():
+    _, separation = field_optimizer.separations(SPECIES, [EDGE_SETTING])
+    assert np.isfinite(separation[0])
+
+    _, separation = field_optimizer.separations(
+        SPECIES, [EDGE_SETTING], margin=field_optimizer.MARGIN)
+    assert np.isnan(separation[0])
+
+def test_optimum_has_resolving_power():
+    result = field_optimizer.optimize_fields(
+        SPECIES, batch_size=256, rounds=4, rng=np.random.default_rng(0))
+
+    assert result.separation > 0
+    assert np.isfinite(result.resolving_power).all()
+    _, _, valid = sensitivity.landing_sensitivity(_points(
+        (result.e_field, result.mag_field, result.initial_x_velocity)))
+    assert valid.all()
@@ -0,0 +1,43 @@
+"""test_inverse_solver.py: tests of the m/q calibration's error bounds
+
+Each calibration is checked against m/q values between its knots, run on
+their own with simulation.run_hits, so the bounds are tested where the
+table is interpolating rather than where it was built.
+"""
+
+import numpy as np
+import pytest
+import inverse_solver, simulation
+
+SETTING = (-3, 1, 3)
+
+@pytest.mark.parametrize('mass_to_charge_range, points', [
+    ((5, 60), inverse_solver.CALIBRATION_POINTS),
+    # coarse enough that the knots and midpoints line up with the frames
+    ((20, 40), 64)])
+def test_error_bounds_held_out_runs(mass_to_charge_range, points):
+    e_field, mag_field, velocity = SETTING
+    calibration = inverse_solver.MassChargeCalibration.calibrate(
+        e_field, mag_field, velocity, mass_to_charge_range, points)
+
+    low, high = calibration.get_mass_to_charge_range()
+    mass_to_charge = np.random.default_rng(0).uniform(low, high, 2000)
+    hits = simulation.run_hits(e_field, mag_field, mass_to_charge, 1,
+                               velocity)
+    estimate, error, in_range = calibration.invert(hits)
+
+    assert in_range.mean() > 0.99
+    missed = np.abs(estimate - mass_to_charge)[in_range]
+    assert np.all(missed <= error[in_range])
+    # and the bound is still tight enough to be of use
+    assert np.median(error[in_range]) < 1e-3 * (high - low)
+
+def test_hit_error_widens_bound():
+    e_field, mag_field, velocity = SETTING
+    calibration = inverse_solver.MassChargeCalibration.calibrate(
+        e_field, mag_field, velocity, (20, 40), 64)
+
+    hit = [np.mean(calibration.get_hit_range())]
+    _, error, _ = calibration.invert(hit)
+    _, wider, _ = calibration.invert(hit, hit_error=1)
+    assert wider[0] > error[0]
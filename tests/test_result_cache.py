@@ -0,0 +1,48 @@
+"""test_result_cache.py: tests of the on-disk result cache"""
+
+import numpy as np
+import result_cache, simulation
+
+PARAMS = (5, -1, 20, 1, 5)
+
+def _error(trajectory: simulation.Trajectory,
+           exact: simulation.Trajectory) -> float:
+    """Get the furthest any point of a trajectory is from the exact one."""
+
+    return np.hypot(*(np.asarray(trajectory.points)
+                      - np.asarray(exact.points)).T).max()
+
+def test_round_trip_is_exact(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path))
+    computed = cache.run_trajectory(*PARAMS, record=True)
+    cached = cache.run_trajectory(*PARAMS, record=True)
+
+    assert cache.get_stats()['hits'] == 1
+    assert cached.points == computed.points
+    assert cached.stop_pos == computed.stop_pos
+    assert cached.hit_y == computed.hit_y
+
+def test_looser_entries_are_misses(tmp_path):
+    exact = simulation.run_trajectory(*PARAMS, record=True)
+
+    # an exact cache, and a tighter one, recompute rather than take
+    # points up to 5 px out
+    for tolerance in (None, 0.5):
+        loose = result_cache.ResultCache(str(tmp_path), tolerance=5)
+        loose.clear()
+        loose.run_trajectory(*PARAMS, record=True)
+
+        cache = result_cache.ResultCache(str(tmp_path), tolerance=tolerance)
+        trajectory = cache.run_trajectory(*PARAMS, record=True)
+        assert cache.get_stats()['misses'] == 1
+        assert _error(trajectory, exact) <= (tolerance or 0) + 1e-9
+
+def test_tighter_entries_are_hits(tmp_path):
+    exact = simulation.run_trajectory(*PARAMS, record=True)
+    tight = result_cache.ResultCache(str(tmp_path), tolerance=0.5)
+    tight.run_trajectory(*PARAMS, record=True)
+
+    loose = result_cache.ResultCache(str(tmp_path), tolerance=5)
+    trajectory = loose.run_trajectory(*PARAMS, record=True)
+    assert loose.get_stats()['hits'] == 1
+    assert _error(trajectory, exact) <= 0.5 + 1e-9
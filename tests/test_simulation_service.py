@@ -0,0 +1,168 @@
+"""test_simulation_service.py: tests of the simulation service
+
+Each test runs a SimulationServer on a free port in the test's own event
+loop and talks to it with a SimulationClient.
+"""
+
+import asyncio
+import numpy as np
+import pytest
+import simulation, simulation_service
+
+RUNS = [{'e_field': 5, 'mag_field': -1, 'mass': 20, 'charge': 1,
+         'initial_x_velocity': 5},
+        {'e_field': 0, 'mag_field': 2, 'mass': 10, 'charge': -1,
+         'initial_x_velocity': 4},
+        {'e_field': 3, 'mag_field': 0.5, 'mass': 15, 'charge': 2,
+         'initial_x_velocity': 8}]
+
+def _run_params(run: dict) -> tuple:
+    """Get a run dict's parameters in simulation.run_trajectory's order."""
+
+    return tuple(run[param] for param in simulation_service.RUN_PARAMS)
+
+def _serve(test) -> None:
+    """Run an async test with a server and a connected client.
+
+    test -- coroutine function taking the client
+    """
+
+    async def body():
+        server = simulation_service.SimulationServer(port=0)
+        await server.start()
+        try:
+            host, port = server.get_address()
+            client = await simulation_service.SimulationClient.connect(
+                host, port)
+            try:
+                await test(client)
+            finally:
+                await client.close()
+        finally:
+            await server.close()
+
+    asyncio.run(body())
+
+async def _simulate(client, runs: list, **kwargs) -> list:
+    """Collect every result of one batch."""
+
+    return [result async for result in client.simulate(runs, **kwargs)]
+
+def test_batch_matches_run_trajectory():
+    async def test(client):
+        results = await _simulate(client, RUNS)
+
+        assert [result['index'] for result in results] == [0, 1, 2]
+        for run, result in zip(RUNS, results):
+            expected = simulation.run_trajectory(*_run_params(run))
+            assert tuple(result['stop_pos']) == expected.stop_pos
+            assert result['stop_reason'] == expected.stop_reason
+            assert result['steps'] == expected.steps
+            assert result['hit_y'] == expected.hit_y
+            assert 'trajectory' not in result
+
+    _serve(test)
+
+def test_trajectory_matches_recorded_points():
+    async def test(client):
+        results = await _simulate(client, RUNS[:1], trajectory=True)
+
+        expected = simulation.run_trajectory(*_run_params(RUNS[0]),
+                                             record=True)
+        assert [tuple(point) for point in results[0]['trajectory']] == \
+            expected.points
+
+    _serve(test)
+
+def test_bad_request_gets_error_reply():
+    async def test(client):
+        bad_run = dict(RUNS[0])
+        del bad_run['mass']
+        with pytest.raises(ValueError, match='mass'):
+            await _simulate(client, [bad_run])
+
+        bad_run = dict(RUNS[0], mass=-1)
+        with pytest.raises(ValueError, match='Mass must be positive'):
+            await _simulate(client, [bad_run])
+
+        # the connection is still usable afterwards
+        assert len(await _simulate(client, RUNS[:1])) == 1
+
+    _serve(test)
+
+def test_bad_tolerance_gets_error_reply():
+    async def test(client):
+        for tolerance in (True, False, 0, -1, float('nan'), float('inf')):
+            with pytest.raises(ValueError, match='(?i)tolerance'):
+                await _simulate(client, RUNS[:1], trajectory=True,
+                                tolerance=tolerance)
+
+        bad_run = dict(RUNS[0], charge=True)
+        with pytest.raises(ValueError, match='charge must be a number'):
+            await _simulate(client, [bad_run])
+
+    _serve(test)
+
+def test_compressed_trajectory_within_tolerance():
+    tolerance = 0.5
+
+    async def test(client):
+        results = await _simulate(client, RUNS, trajectory=True,
+                                  tolerance=tolerance)
+
+        for run, result in zip(RUNS, results):
+            expected = simulation.run_trajectory(*_run_params(run),
+                                                 record=True)
+            assert result['steps'] == expected.steps
+            points = np.asarray(result['trajectory'])
+            original = np.asarray(expected.points)
+            assert points.shape == original.shape
+            error = np.hypot(*(points - original).T)
+            assert error.max() <= tolerance + 1e-9
+
+    _serve(test)
+
+def test_compressed_trajectory_is_smaller():
+    async def test(client):
+        server_side = simulation_service._format_trajectory(
+            0, 0, simulation.run_trajectory(*_run_params(RUNS[0]),
+                                            record=True), 0.5)
+        assert 'trajectory' not in server_side
+        assert len(server_side['trajectory_codes']) < \
+            2 * simulation.run_trajectory(*_run_params(RUNS[0])).steps
+
+        # and the client gives back plain points
+        results = await _simulate(client, RUNS[:1], trajectory=True,
+                                  tolerance=0.5)
+        assert 'trajectory_codes' not in results[0]
+        assert 'quantum' not in results[0]
+
+    _serve(test)
+
+def test_cancelled_connection_stays_cancelled():
+    class Writer():
+        """Stands in for a connection's StreamWriter."""
+
+        closed = False
+
+        def close(self) -> None:
+            self.closed = True
+
+    async def body():
+        server = simulation_service.SimulationServer(port=0)
+        writer = Writer()
+        # nothing is ever fed to the reader, so the handler waits on it
+        handler = asyncio.ensure_future(server._handle_connection(
+            asyncio.StreamReader(), writer))
+        await asyncio.sleep(0)
+
+        handler.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await handler
+        await asyncio.sleep(0)
+
+        assert writer.closed
+        # the connection's dispatcher and sender are gone too
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(body())
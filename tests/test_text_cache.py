@@ -0,0 +1,63 @@
+"""test_text_cache.py: tests of the rendered text cache"""
+
+import gc, json
+import numpy as np
+import pygame
+import fonts, text_cache
+
+BLACK = (0, 0, 0)
+BACKGROUND_COLOR = (38, 228, 235)
+
+def _drawn(surface: pygame.Surface) -> bytes:
+    """Get the pixels of a Surface drawn over a background."""
+
+    backdrop = pygame.Surface(surface.get_size())
+    backdrop.fill(BACKGROUND_COLOR)
+    backdrop.blit(surface, (0, 0))
+    return pygame.image.tobytes(backdrop, 'RGB')
+
+def test_dead_font_entries_are_dropped():
+    cache = text_cache.TextCache()
+    font = pygame.font.Font(None, 20)
+    cache.render(font, 'label', True, BLACK)
+    assert cache.get_stats()['entries'] == 1
+
+    del font
+    gc.collect()
+    assert cache.get_stats()['entries'] == 0
+
+    # a new font never gets a dead font's Surface, even with its id
+    font = pygame.font.Font(None, 40)
+    surface = cache.render(font, 'label', True, BLACK)
+    assert surface.get_size() == font.size('label')
+    assert cache.get_stats()['misses'] == 2
+
+def test_save_keeps_transparency(tmp_path):
+    filename = str(tmp_path / 'text_cache.npz')
+    cache = text_cache.TextCache()
+    originals = [cache.render(fonts.PARAGRAPH_FONT, 'label', antialias,
+                              BLACK) for antialias in (False, True)]
+    cache.save(filename)
+
+    loaded = text_cache.TextCache()
+    assert loaded.load(filename)
+    for antialias, original in zip((False, True), originals):
+        surface = loaded.render(fonts.PARAGRAPH_FONT, 'label', antialias,
+                                BLACK)
+        assert _drawn(surface) == _drawn(original)
+    assert loaded.get_stats()['hits'] == 2
+
+def test_files_without_colorkeys_are_not_loaded(tmp_path):
+    filename = str(tmp_path / 'text_cache.npz')
+    cache = text_cache.TextCache()
+    cache.render(fonts.PARAGRAPH_FONT, 'label', False, BLACK)
+    cache.save(filename)
+
+    # rewrite the header as saving did before colorkeys were kept
+    with np.load(filename) as data:
+        arrays = {name: data[name] for name in data.files}
+    header = json.loads(str(arrays.pop('header')))
+    del header['colorkeys']
+    np.savez(filename, header=json.dumps(header), **arrays)
+
+    assert not text_cache.TextCache().load(filename)
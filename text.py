@@ -12,6 +12,7 @@ TEXT_COLOR -- color that all text will be in
 """
 
 import pygame
+import text_cache
 
 # required initialization step
 pygame.init()
@@ -43,8 +44,9 @@ class Text():
                  -- defaults to True
         """
         
-        # create the needed text-surface
-        self._text = font.render(text, True, TEXT_COLOR, background_color)
+        # grab the needed text-surface, shared with any identical text
+        self._text = text_cache.render(font, text, True, TEXT_COLOR,
+                                       background_color)
         
         if centered:
             # get (top, left) position to center text with
@@ -103,14 +105,15 @@ def paragraphs_to_lines(paragraphs: list, font: pygame.font.Font,
         
         for word in paragraph:
             # grab width & height of this word
-            word_width = font.render(word, True, TEXT_COLOR).get_size()[0]
+            word_width = text_cache.render(font, word, True,
+                                           TEXT_COLOR).get_size()[0]
                 
             # if this word would cause an overflow
             if line_length + word_width >= area.width:
                 # grab line so far
                 final_line = " ".join(cur_line)
-                line_height = font.render(final_line, True,
-                                          TEXT_COLOR).get_size()[1]
+                line_height = text_cache.render(font, final_line, True,
+                                                TEXT_COLOR).get_size()[1]
                 
                 # create Text and add to list
                 lines.append(Text(final_line, font,
@@ -129,7 +132,8 @@ def paragraphs_to_lines(paragraphs: list, font: pygame.font.Font,
 
         # grab leftover words in paragraph
         final_line = " ".join(cur_line)
-        line_height = font.render(final_line, True, TEXT_COLOR).get_size()[1]
+        line_height = text_cache.render(font, final_line, True,
+                                        TEXT_COLOR).get_size()[1]
         
         # create Text and add to list        
         lines.append(Text(final_line, font,
@@ -154,7 +158,8 @@ def get_text_by_center(text: str, font: pygame.font.Font, center: (int, int),
     """
     
     # grab size of text
-    text_width, text_height = font.render(text, True, TEXT_COLOR).get_size()
+    text_width, text_height = text_cache.render(font, text, True,
+                                                TEXT_COLOR).get_size()
     # calculate just-big-enough centered text rectangle
     centered_area = pygame.Rect(center[0] - (text_width / 2),
                                 center[1] - (text_height / 2),
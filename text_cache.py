@@ -0,0 +1,191 @@
+"""text_cache.py: for a process-wide cache of rendered text
+
+Rendering text rasterizes every glyph, so each distinct label is rendered
+once and its Surface shared by everything showing it. The cache can be
+saved to disk and loaded on the next launch, so static labels are never
+rendered again.
+
+Classes:
+TextCache -- cache of rendered text Surfaces
+
+Methods:
+render -- render text through the shared cache, as Font.render does
+
+Constants:
+CACHE -- the shared TextCache
+TEXT_CACHE_FILE -- default file the cache is saved to between runs
+"""
+
+import json, os, weakref
+import pygame
+import numpy as np
+import fonts
+
+# required initialization step
+pygame.init()
+
+TEXT_CACHE_FILE = 'text_cache.npz'
+
+def _color_key(color) -> tuple:
+    """Get a hashable (r, g, b, a) of a color, or None for no color."""
+
+    return None if color is None else tuple(pygame.Color(color))
+
+class TextCache():
+    """A class to represent a cache of rendered text Surfaces.
+
+    Entries are keyed by (string, font file, size, style, antialias, color,
+    background color), so equal text in equal fonts shares one Surface.
+    Fonts not made by fonts.make_font are only known by identity, so their
+    entries are kept apart, per font, and go when the font does (so a new
+    font given a dead one's id never gets its text), and are never saved.
+    Cached Surfaces are shared, so must not be drawn on.
+
+    Attributes:
+    _surfaces -- dict of rendered Surfaces in known fonts, by key
+    _by_font -- WeakKeyDictionary of dicts of rendered Surfaces in other
+                fonts, by font then key
+    hits -- number of renders answered from the cache
+    misses -- number of renders which had to rasterize
+    loaded -- number of entries loaded from disk
+
+    Methods:
+    render -- render text, from the cache if possible
+    get_stats -- dict of cache statistics
+    clear -- empty the cache
+    save -- save every entry in a known font to a file
+    load -- add entries saved by save
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty TextCache."""
+
+        self._surfaces = {}
+        self._by_font = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+
+    def render(self, font: pygame.font.Font, text: str, antialias: bool,
+               color, background=None) -> pygame.Surface:
+        """Render text, from the cache if it has been rendered before.
+
+        font -- Font the text is to be displayed in
+        text -- string to display
+        antialias -- whether to smooth the text's edges
+        color -- color of the text
+        background -- color behind the text, default None for transparent
+
+        Returns the (shared) Surface with the text on it
+        """
+
+        key = (text, font.get_bold(), font.get_italic(),
+               font.get_underline(), bool(antialias), _color_key(color),
+               _color_key(background))
+        font_key = fonts.get_font_key(font)
+        if font_key is None:
+            surfaces = self._by_font.setdefault(font, {})
+        else:
+            surfaces = self._surfaces
+            key = (key[0], *font_key, *key[1:])
+
+        surface = surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        if background is None:
+            surface = font.render(text, antialias, color)
+        else:
+            surface = font.render(text, antialias, color, background)
+        surfaces[key] = surface
+        return surface
+
+    def get_stats(self) -> dict:
+        """Get a dict of hits, misses, loaded and entries (cache size)."""
+
+        entries = len(self._surfaces) + sum(
+            len(surfaces) for surfaces in self._by_font.values())
+        return {'hits': self.hits, 'misses': self.misses,
+                'loaded': self.loaded, 'entries': entries}
+
+    def clear(self) -> None:
+        """Empty the cache and reset its statistics."""
+
+        self.__init__()
+
+    def save(self, filename: str = TEXT_CACHE_FILE) -> None:
+        """Atomically save every entry in a known font to a .npz file.
+
+        filename -- path of the file, default TEXT_CACHE_FILE
+        """
+
+        keys = sorted(self._surfaces, key=repr)
+        arrays = {}
+        colorkeys = []
+        for i, key in enumerate(keys):
+            surface = self._surfaces[key]
+            # transparency of text rendered without antialiasing
+            colorkey = surface.get_colorkey()
+            colorkeys.append(None if colorkey is None else list(colorkey))
+            # pixels as (height, width, channels), with alpha if it has it
+            image_format = 'RGBA' if surface.get_flags() & pygame.SRCALPHA \
+                else 'RGB'
+            width, height = surface.get_size()
+            arrays['surface_{}'.format(i)] = np.frombuffer(
+                pygame.image.tobytes(surface, image_format), np.uint8
+            ).reshape(height, width, len(image_format))
+
+        # rendering may differ between pygame versions, so note the version
+        header = {'pygame': pygame.version.ver, 'keys': keys,
+                  'colorkeys': colorkeys}
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as file:
+            np.savez(file, header=json.dumps(header), **arrays)
+        os.replace(temp_filename, filename)
+
+    def load(self, filename: str = TEXT_CACHE_FILE) -> bool:
+        """Add entries saved by save, if the file exists and was saved by
+        this version of pygame.
+
+        filename -- path of the file, default TEXT_CACHE_FILE
+
+        Returns whether anything was loaded
+        """
+
+        if not os.path.exists(filename):
+            return False
+
+        with np.load(filename) as data:
+            header = json.loads(str(data['header']))
+            # files saved without colorkeys would load transparent text
+            # with a solid background
+            if header['pygame'] != pygame.version.ver or \
+                    'colorkeys' not in header:
+                return False
+
+            for i, (key, colorkey) in enumerate(zip(header['keys'],
+                                                     header['colorkeys'])):
+                # JSON turns tuples into lists
+                key = tuple(tuple(part) if isinstance(part, list) else part
+                            for part in key)
+                pixels = data['surface_{}'.format(i)]
+                height, width, channels = pixels.shape
+                surface = pygame.image.frombytes(
+                    pixels.tobytes(), (width, height),
+                    'RGBA' if channels == 4 else 'RGB')
+                if colorkey is not None:
+                    surface.set_colorkey(colorkey)
+                self._surfaces.setdefault(key, surface)
+                self.loaded += 1
+
+        return True
+
+CACHE = TextCache()
+
+def render(font: pygame.font.Font, text: str, antialias: bool, color,
+           background=None) -> pygame.Surface:
+    """Render text through the shared cache (see TextCache.render)."""
+
+    return CACHE.render(font, text, antialias, color, background)
@@ -0,0 +1,208 @@
+"""trajectory_codec.py: for compressing recorded trajectories
+
+A trajectory records a point per frame, but most of a mass spectrometer
+trajectory is a straight line or a smooth arc, which a few of its points
+describe to within a small error. Compression keeps only those points,
+rounds them onto a grid, and stores the differences between neighbours as
+small integers.
+
+Points are simplified with a time-synchronized Ramer-Douglas-Peucker: a
+dropped point is compared with where linear interpolation between the
+kept points puts it at the same frame, not just with the nearest point on
+the line. So every decompressed point, frame for frame, is within the
+tolerance of the original, on straight sections and arcs alike.
+
+Half the tolerance goes to simplification, and half to rounding onto a
+grid of quantum tolerance / sqrt(2).
+
+Encoded layout (one integer array):
+count -- number of points in the original trajectory
+kept -- number of points kept
+steps -- kept points' frame numbers, each as a difference from the last
+x, y -- kept points' grid coordinates, the first as is and the rest as
+        differences from the last
+
+Classes:
+CompressedTrajectory -- a compressed trajectory, as small integer arrays
+
+Methods:
+simplify -- indices of the points a trajectory can be reduced to
+compress -- compress a trajectory to within a tolerance
+get_quantum -- grid size compress rounds onto for a tolerance
+"""
+
+import math
+import numpy as np
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Find the points a trajectory can be reduced to.
+
+    points -- (n, 2) array of (x, y), one per frame
+    tolerance -- how far any point may be from its interpolated position
+
+    Returns an increasing array of indices of the points to keep, always
+    including the first and last
+    """
+
+    count = len(points)
+    if count <= 2:
+        return np.arange(count)
+
+    keep = np.zeros(count, bool)
+    keep[[0, -1]] = True
+    spans = [(0, count - 1)]
+
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+
+        # where each point between would be, interpolating by frame
+        fraction = (np.arange(1, last - first) / (last - first))[:, None]
+        expected = points[first] + fraction * (points[last] - points[first])
+        error = np.hypot(*(points[first + 1:last] - expected).T)
+
+        worst = int(np.argmax(error))
+        if error[worst] > tolerance:
+            middle = first + 1 + worst
+            keep[middle] = True
+            spans.append((first, middle))
+            spans.append((middle, last))
+
+    return np.flatnonzero(keep)
+
+def _smallest_int(values: np.ndarray) -> np.dtype:
+    """Get the smallest signed integer dtype which holds every value."""
+
+    if len(values) == 0:
+        return np.dtype(np.int8)
+    low, high = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+class CompressedTrajectory():
+    """A class to represent a compressed trajectory.
+
+    Attributes:
+    count -- number of points in the original trajectory
+    quantum -- size of the grid points are rounded onto
+    steps -- array of kept points' frame differences, the first being 0
+    x, y -- arrays of kept points' grid coordinates, the first as is and
+            the rest as differences from the last
+
+    Methods:
+    decompress -- reconstruct every point
+    to_array -- encode into one integer array
+    from_array -- decode from to_array's array (classmethod)
+    get_kept -- number of points kept
+    """
+
+    def __init__(self, count: int, quantum: float, steps: np.ndarray,
+                 x: np.ndarray, y: np.ndarray) -> None:
+        """Initialize a CompressedTrajectory; use compress instead.
+
+        count -- number of points in the original trajectory
+        quantum -- size of the grid points are rounded onto
+        steps, x, y -- delta-encoded arrays, as in the attributes
+        """
+
+        if not len(steps) == len(x) == len(y):
+            raise ValueError('steps, x and y must be the same length')
+
+        self.count = count
+        self.quantum = quantum
+        self.steps = steps
+        self.x = x
+        self.y = y
+
+    def get_kept(self) -> int:
+        """Get the number of points kept."""
+
+        return len(self.steps)
+
+    def decompress(self) -> np.ndarray:
+        """Reconstruct every point, interpolating between kept points.
+
+        Returns a (count, 2) float64 array of (x, y), one per frame
+        """
+
+        if self.count == 0:
+            return np.empty((0, 2))
+
+        frames = np.cumsum(self.steps, dtype=np.int64)
+        x = np.cumsum(self.x, dtype=np.int64) * self.quantum
+        y = np.cumsum(self.y, dtype=np.int64) * self.quantum
+
+        every_frame = np.arange(self.count)
+        return np.stack((np.interp(every_frame, frames, x),
+                         np.interp(every_frame, frames, y)), axis=-1)
+
+    def to_array(self, dtype=None) -> np.ndarray:
+        """Encode into one integer array (layout in module docstring).
+
+        The quantum is not included, so must be stored alongside.
+
+        dtype -- integer dtype of the array, default the smallest which
+                 holds every value
+
+        Returns the encoded array
+        """
+
+        encoded = np.concatenate(([self.count, self.get_kept()],
+                                  self.steps, self.x, self.y))
+        if dtype is None:
+            dtype = _smallest_int(encoded)
+        elif not np.can_cast(_smallest_int(encoded), dtype):
+            raise ValueError('Compressed trajectory does not fit in ' +
+                             np.dtype(dtype).name)
+        return encoded.astype(dtype)
+
+    @classmethod
+    def from_array(cls, encoded: np.ndarray, quantum: float):
+        """Decode an array made by to_array.
+
+        encoded -- the encoded integer array
+        quantum -- the grid size it was compressed with
+
+        Returns the CompressedTrajectory
+        """
+
+        encoded = np.asarray(encoded, np.int64)
+        count, kept = int(encoded[0]), int(encoded[1])
+        if len(encoded) != 2 + 3 * kept:
+            raise ValueError('Encoded trajectory has the wrong length')
+
+        steps, x, y = encoded[2:].reshape(3, kept)
+        return cls(count, quantum, steps, x, y)
+
+def get_quantum(tolerance: float) -> float:
+    """Get the grid size compress rounds onto for a tolerance."""
+
+    # rounding moves a point by at most quantum / sqrt(2) = tolerance / 2
+    return tolerance / math.sqrt(2)
+
+def compress(points, tolerance: float) -> CompressedTrajectory:
+    """Compress a trajectory so that every point, decompressed, is within
+    tolerance of the original.
+
+    points -- (n, 2) array or list of (x, y), one per frame
+    tolerance -- most any point may move, in pixels; must be positive
+
+    Returns the CompressedTrajectory
+    """
+
+    if tolerance <= 0:
+        raise ValueError('Tolerance must be positive')
+
+    points = np.asarray(points, np.float64).reshape(-1, 2)
+    quantum = get_quantum(tolerance)
+
+    kept = simplify(points, tolerance / 2)
+    grid = np.rint(points[kept] / quantum).astype(np.int64)
+
+    return CompressedTrajectory(len(points), quantum,
+                                np.diff(kept, prepend=0),
+                                np.diff(grid[:, 0], prepend=0),
+                                np.diff(grid[:, 1], prepend=0))